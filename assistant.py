@@ -4,10 +4,14 @@ import subprocess
 import itertools
 import sys
 import time
+import sqlite3
 from dotenv import load_dotenv
 from openai import OpenAI
 from collections import defaultdict
-from scraper.db.database import search_products, search_new_releases, search_products_with_discounts
+import metrics
+from scraper import call_policy
+from scraper.call_policy import CALL_FAILURES
+from scraper.db.database import search_products, search_new_releases, search_products_with_discounts, semantic_search, get_semantic_index
 
 # Load environment variables from .env file
 load_dotenv()
@@ -19,9 +23,28 @@ class Assistant:
     """
     Nike Air Jordan AI Assistant. 
     """
-    def __init__(self, voice=False):
-        # OpenAI Client
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, voice=False, client=None, session_store=None, session_id=None, history_turns=10, policy=None):
+        # OpenAI Client, can be shared between many assistants so they use one connection pool
+        # Retries are left to the call policy so they are not done twice
+        self.client = client or OpenAI(api_key=api_key, max_retries=0)
+        
+        # Deadlines, retries, hedging and the circuit breaker of the OpenAI calls, shared by every assistant by default
+        self.policy = policy or call_policy.default_policy
+        
+        # Deadline of the turn that is running, and whether the turn had to fall back to a degraded answer
+        self.deadline = None
+        self.degraded = False
+        
+        # Store that persists the message history so the session can be resumed later or on another worker
+        self.session_store = session_store
+        self.session_id = session_id
+        
+        # How many of the most recent turns to load when resuming a session
+        self.history_turns = history_turns
+        
+        # How many of the messages are already saved, and where the next one will be stored
+        self.saved_messages = 0
+        self.next_seq = 0
         
         # Array that will hold the history of messages
         self.messages = []
@@ -33,6 +56,11 @@ class Assistant:
         # Feel free to increase or decrease to see the difference
         self.limit = 20
         
+        # How many tokens the search results of a turn can take, and roughly how many one product takes
+        # The number of results is picked from these so large result sets do not flood the context
+        self.context_token_budget = 3000
+        self.row_tokens = 90
+        
         # Set if we should stream back by voice or text
         self.voice = voice
         
@@ -47,10 +75,70 @@ class Assistant:
         if self.voice:
             system_prompt += ' Please provide concise and brief responses suitable for audio playback.'
 
+        # Resume the session if it was saved before
+        if self.session_store is not None and self.session_id and self.session_store.exists(self.session_id):
+            self.messages, self.next_seq = self.session_store.load(self.session_id, max_turns=self.history_turns)
+            self.saved_messages = len(self.messages)
+            return
+        
         # Add the system prompt to the messages
         self.messages.append({"role": "system", "content": system_prompt})
+        
+        # Start a new saved session
+        if self.session_store is not None:
+            self.session_id = self.session_store.create(self.session_id)
+            self.save_session()
+    
+    def save_session(self):
+        """
+        Appends the messages added since the last save to the session store.
+        Does nothing if the assistant has no session store.
+
+        If another worker appended a turn to the same session meanwhile, the new messages are stored after
+        it and the history is reloaded, so both turns are kept in the order they were saved.
+
+        Raises:
+        - LookupError: If the session was deleted meanwhile.
+        """
+        if self.session_store is None:
+            return
+        
+        new_messages = self.messages[self.saved_messages:]
+        try:
+            self.session_store.append(self.session_id, new_messages, self.next_seq)
+        except sqlite3.IntegrityError:
+            # Another worker used these positions, store the turn after its messages instead
+            _, self.next_seq = self.session_store.load(self.session_id, max_turns=1)
+            self.session_store.append(self.session_id, new_messages, self.next_seq)
+            self.messages, self.next_seq = self.session_store.load(self.session_id, max_turns=self.history_turns)
+            self.saved_messages = len(self.messages)
+            return
+        self.saved_messages = len(self.messages)
+        self.next_seq += len(new_messages)
     
     
+    def warm_up(self, timeout=5):
+        """
+        Opens the connection to the OpenAI API and the database ahead of the first turn,
+        so the first question does not pay for the TLS handshake.
+        Errors are ignored, the first turn then opens the connection itself.
+
+        Args:
+        - timeout (float, optional): How many seconds to wait for the API. Default is 5.
+        """
+        # A cheap request that leaves a kept-alive connection in the pool of the client
+        try:
+            self.client.with_options(timeout=timeout).models.list()
+        except Exception:
+            pass
+        
+        # Load the catalog into the page cache and map its semantic index
+        try:
+            search_products(limit=1)
+            get_semantic_index()
+        except Exception:
+            pass
+    
     def add_user_message(self, message):
         """
         Adds a user message to the message history of the assistant.
@@ -234,6 +322,32 @@ class Assistant:
                         "required": []
                     }
                 }
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "semantic_search",
+                    "description": "Search for Nike Air Jordan products by what the user is looking for in their own words (e.g., \"something good for outdoor courts\", \"a retro look for everyday wear\") when no name, color or price answers it",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "query": {
+                                "type": "string",
+                                "description": "What the user is looking for, in their own words"
+                            },
+                            "max_price": {
+                                "type": "number",
+                                "description": "Maximum price of the product"
+                            },
+                            "category": {
+                                "type": "string",
+                                "enum": ["low", "mid", "high", "basketball", "slides"],
+                                "description": "Category of the product (low, mid, high, basketball, slides)"
+                            }
+                        },
+                        "required": ["query"]
+                    }
+                }
             }
         ]
 
@@ -255,10 +369,115 @@ class Assistant:
         return tools
 
         
-    def stream_response(self, message):
+    def degraded_tool_calls(self, message):
         """
-        Streams a response back to the user.
-        Can call functions from the tools to get data to answer a question.
+        Picks a search from the words of a user message, used when the API cannot pick one.
+
+        Args:
+        - message (str): The user message.
+
+        Returns:
+        - list of dict: A single tool call in the format of the message history.
+        """
+        words = message.lower()
+        if 'discount' in words or 'sale' in words or 'deal' in words:
+            function_name = 'search_products_with_discounts'
+        elif 'new' in words or 'release' in words or 'coming' in words:
+            function_name = 'search_new_releases'
+        else:
+            function_name = 'search_products'
+        
+        return [{
+            "id": f"degraded-{self.next_seq + len(self.messages)}",
+            "type": "function",
+            "function": {"name": function_name, "arguments": "{}"}
+        }]
+    
+    def turn_message_index(self):
+        """
+        Returns where the user message of the running turn is in the message history.
+
+        Returns:
+        - int: The index of the last user message.
+        """
+        return max(i for i, item in enumerate(self.messages) if item.get('role') == 'user')
+    
+    def answer_key(self, message):
+        """
+        Returns the key the answer to a user message is cached under, which depends on the conversation before it
+        so the answer to a follow-up question is never served in another context.
+
+        Args:
+        - message (str): The user message.
+
+        Returns:
+        - str: The key.
+        """
+        return call_policy.answer_key(message, self.messages[:self.turn_message_index()], self.session_id)
+    
+    def degraded_answer(self, message):
+        """
+        Answers a user message without the API, with the cached answer to the same message or
+        with the products the searches of this turn found.
+
+        Args:
+        - message (str): The user message.
+
+        Returns:
+        - str: The answer.
+        """
+        cached = self.policy.cached_answer(self.answer_key(message))
+        if cached:
+            return cached
+        
+        # Collect the products found since the last user message
+        start = self.turn_message_index()
+        products = []
+        for item in self.messages[start:]:
+            if item.get('role') == 'tool' and item.get('content'):
+                products.extend(json.loads(item['content']).get('products', []))
+        
+        if not products:
+            return "Sorry, I can't reach my knowledge of Air Jordans right now. Please try again in a moment."
+        
+        lines = [f"- {product['name'].title()}: {product['price']}" + (f" ({product['discount'][1:]}% off)" if product['discount'] else "") for product in products[:5]]
+        return "Sorry, I'm having trouble answering right now. Here are some products that might match what you asked for:\n" + "\n".join(lines)
+        
+    def choose_limit(self, function_name, function_args, remaining_tokens):
+        """
+        Picks how many products a search returns from the tokens the turn has left and how broad the search is.
+
+        Broad searches (no name or description) match a large part of the catalog, so once they match more
+        products than are listed they are summarized (price range, categories, colorways per model) instead.
+
+        Args:
+        - function_name (str): The name of the search function.
+        - function_args (dict): The arguments the search is called with.
+        - remaining_tokens (int): How many tokens the search results of the turn can still take.
+
+        Returns:
+        - Tuple: A tuple containing (limit, summary threshold).
+        """
+        # Never list more products than fit in the tokens that are left
+        limit = max(1, min(self.limit, remaining_tokens // self.row_tokens))
+        
+        # A semantic search returns the most similar products, it is never summarized
+        if function_name == 'semantic_search':
+            return limit, None
+        
+        # Discounts and new releases are usually browsed, a few more of them are listed before summarizing
+        if function_name != 'search_products':
+            return limit, limit * 2
+        
+        # A named or described product narrows the search, list its matches before summarizing them
+        if function_args.get('name') or function_args.get('description'):
+            return limit, limit * 2
+        return limit, limit
+
+    def call_tools(self, message):
+        """
+        Adds a user message and lets the AI call the functions from the tools to get data to answer it.
+        The results of the function calls are added to the message history.
 
         Args:
         - message (str): The user message to be added.
@@ -266,32 +485,54 @@ class Assistant:
         # Add user message
         self.add_user_message(message)
         
-        # Iterate over the messages as they are streamed
-        print("\n")
-        print("Air Jordans AI Assistant: ")
-        print("building response...", end='', flush=True)
+        # Get the initital response, this call can be hedged when it is slower than usual
+        try:
+            with metrics.span('tool_selection'):
+                response = self.policy.call(
+                    self.client.chat.completions.create,
+                    deadline=self.deadline,
+                    hedgeable=True,
+                    model=self.model, 
+                    messages=self.messages,
+                    tools=self.get_tools(first_call=True), # Pass the tools the AI can use
+                    tool_choice="required", # Force a function call for the first use
+                    temperature=1 # Give it a bit of creativity and make it less deterministic
+                )
+            metrics.record_usage(response.usage)
+            
+            response_message = response.choices[0].message
+            content = response_message.content
+            tool_calls = [
+                {
+                    "id": tool_call.id,
+                    "type": tool_call.type,
+                    "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments}
+                }
+                for tool_call in response_message.tool_calls or []
+            ]
+        except CALL_FAILURES:
+            # The API is failing or too slow, pick the search from the words of the message instead
+            self.degraded = True
+            content = None
+            tool_calls = self.degraded_tool_calls(message)
         
-        # Get the initital response
-        response = self.client.chat.completions.create(
-            model=self.model, 
-            messages=self.messages,
-            tools=self.get_tools(first_call=True), # Pass the tools the AI can use
-            tool_choice="required", # Force a function call for the first use
-            temperature=1 # Give it a bit of creativity and make it less deterministic
-        )
-        
-        response_message = response.choices[0].message
-        tool_calls = response_message.tool_calls
         # Check what function the AI wants to call
         if tool_calls:
             # Append the assitant's request for a function call
-            self.messages.append(response.choices[0].message)
+            self.messages.append({
+                "role": "assistant",
+                "content": content,
+                "tool_calls": tool_calls
+            })
+            
+            # Tokens the search results of this turn can still take
+            remaining_tokens = self.context_token_budget
             
             # Send the info for each function call and function response to the model
             for tool_call in tool_calls:
                 # Parse function name and args
-                function_name = tool_call.function.name
-                function_args = json.loads(tool_call.function.arguments)
+                function_name = tool_call['function']['name']
+                function_args = json.loads(tool_call['function']['arguments'])
                 
                 # Parse name if it exists
                 name = function_args.get('name')
@@ -308,117 +549,306 @@ class Assistant:
                 # Parse category if it exists
                 category = function_args.get('category')
                 
+                # Parse the query of a semantic search if it exists
+                query = function_args.get('query')
+                
+                # Size the results to the tokens that are left
+                limit, summary_threshold = self.choose_limit(function_name, function_args, remaining_tokens)
+                
                 # define returned results
                 results = []
                 
                 # Call the correct function
-                if function_name == 'search_products':
-                    results = search_products(
-                        name=name,
-                        max_price=max_price,
-                        colors=colors,
-                        description=description,
-                        category=category,
-                        limit=self.limit
-                    )
-                elif function_name == "search_products_with_discounts":   
-                    results = search_products_with_discounts(
-                        name=name,
-                        max_price=max_price,
-                        colors=colors,
-                        description=description,
-                        category=category,
-                        limit=self.limit
-                    )
-                elif function_name == "search_new_releases": 
-                    results = search_new_releases(
-                        name=name,
-                        max_price=max_price,
-                        colors=colors,
-                        description=description,
-                        category=category,
-                        limit=self.limit
-                    )
+                with metrics.span('search', tool=function_name):
+                    if function_name == 'search_products':
+                        results = search_products(
+                            name=name,
+                            max_price=max_price,
+                            colors=colors,
+                            description=description,
+                            category=category,
+                            limit=limit,
+                            summary_threshold=summary_threshold
+                        )
+                    elif function_name == "search_products_with_discounts":   
+                        results = search_products_with_discounts(
+                            name=name,
+                            max_price=max_price,
+                            colors=colors,
+                            description=description,
+                            category=category,
+                            limit=limit,
+                            summary_threshold=summary_threshold
+                        )
+                    elif function_name == "search_new_releases": 
+                        results = search_new_releases(
+                            name=name,
+                            max_price=max_price,
+                            colors=colors,
+                            description=description,
+                            category=category,
+                            limit=limit,
+                            summary_threshold=summary_threshold
+                        )
+                    elif function_name == "semantic_search":
+                        results = semantic_search(
+                            query=query or message,
+                            max_price=max_price,
+                            category=category,
+                            limit=limit
+                        )
                     
-                # Append the result to the messages history
-                self.add_tool_result(id=tool_call.id, function_name=function_name, result=results) 
+                # Roughly 4 characters make a token
+                remaining_tokens -= len(results) // 4
                 
-        # Notify the user that the AI finishing building up the response
-        sys.stdout.write('\r')  # Move the cursor back to the start of the line
-        sys.stdout.write(' ' * len("Building response..."))  # Overwrite the previous message with spaces
-        sys.stdout.write('\r')  # Move the cursor back to the start of the line again         
+                # Append the result to the messages history
+                self.add_tool_result(id=tool_call['id'], function_name=function_name, result=results) 
+    
+    def rollback_turn(self, turn_start):
+        """
+        Removes the messages a failed turn added to the history, so no tool call is left without its results
+        and the next turn is not rejected by the API.
+
+        Args:
+        - turn_start (int): The length of the history when the turn started.
+        """
+        del self.messages[max(turn_start, self.saved_messages):]
+
+    def generate_response(self, message):
+        """
+        Generates a response to a user message, yielding it in chunks as it is streamed.
+        Can call functions from the tools to get data to answer a question.
         
-        if not self.voice:
+        The full response is added to the message history once it is done. If the turn fails or is
+        cancelled, the messages it added are removed again.
+
+        Args:
+        - message (str): The user message to be added.
+
+        Yields:
+        - str: The chunks of the response.
+        """
+        metrics.start_turn()
+        
+        # Start the deadline of the turn
+        self.deadline = self.policy.deadline()
+        self.degraded = False
+        
+        # The turn is recorded whatever happens, so failed and cancelled turns show up in the metrics too
+        turn_start = len(self.messages)
+        status = 'error'
+        try:
+            yield from self.answer_turn(message)
+            self.save_session()
+            status = 'ok'
+        except GeneratorExit:
+            status = 'cancelled'
+            self.rollback_turn(turn_start)
+            raise
+        except BaseException:
+            self.rollback_turn(turn_start)
+            raise
+        finally:
+            metrics.end_turn(status=status)
+
+    def answer_turn(self, message):
+        """
+        Runs the tool calls and streams the answer of one turn, adding every message of the turn to the history.
+
+        Args:
+        - message (str): The user message to be added.
+
+        Yields:
+        - str: The chunks of the response.
+        """
+        # Call the functions the AI needs to answer
+        self.call_tools(message)
+        
+        start = time.perf_counter()
+        content = ""
+        stream = None
+        try:
             # Start the streaming completion
-            stream = self.client.chat.completions.create(
+            stream = self.policy.call(
+                self.client.chat.completions.create,
+                deadline=self.deadline,
                 model=self.model, 
                 stream=True,  # Set stream to True to receive messages in chunks
                 messages=self.messages,
+                stream_options={"include_usage": True}, # The last chunk holds the token usage
             )
-            # Print the response
+            
+            # Yield the response as it comes in
             for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    print(chunk.choices[0].delta.content, end="")  # Output final result
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not content:
+                        metrics.record_duration('first_token', time.perf_counter() - start)
+                    content += chunk.choices[0].delta.content
+                    yield chunk.choices[0].delta.content
+                if getattr(chunk, 'usage', None):
+                    metrics.record_usage(chunk.usage)
+                
+                # Stop streaming once the turn runs out of time
+                if self.deadline.expired():
+                    raise call_policy.DeadlineExceeded("The turn ran out of time")
+        except CALL_FAILURES as e:
+            # The call succeeded but the stream broke or ran out of time, only a broken connection
+            # or a server error counts against the circuit breaker, a turn that ran out of time does not
+            if stream is not None:
+                stream.close()
+                if isinstance(e, call_policy.UPSTREAM_FAILURES):
+                    self.policy.breaker.record_failure()
+            
+            # Keep what was streamed already, otherwise answer with a cached or degraded answer
+            if not content:
+                self.degraded = True
+                content = self.degraded_answer(message)
+                yield content
         else:
+            # Remember the answer in case the API fails later
+            self.policy.cache_answer(self.answer_key(message), content)
+        metrics.record_duration('answer_stream', time.perf_counter() - start)
+        
+        # Remember the answer so follow up questions have the context
+        self.messages.append({"role": "assistant", "content": content})
+        
+    def stream_response(self, message):
+        """
+        Streams a response back to the user.
+        Can call functions from the tools to get data to answer a question.
+
+        Args:
+        - message (str): The user message to be added.
+        """
+        # Iterate over the messages as they are streamed
+        print("\n")
+        print("Air Jordans AI Assistant: ")
+        print("building response...", end='', flush=True)
+        
+        if not self.voice:
+            # Print the response as it is streamed
+            for i, chunk in enumerate(self.generate_response(message)):
+                if i == 0:
+                    # Notify the user that the AI finishing building up the response
+                    sys.stdout.write('\r')  # Move the cursor back to the start of the line
+                    sys.stdout.write(' ' * len("Building response..."))  # Overwrite the previous message with spaces
+                    sys.stdout.write('\r')  # Move the cursor back to the start of the line again
+                print(chunk, end="")  # Output final result
+            return
+        
+        # The turn is recorded whatever happens, so failed turns show up in the metrics too
+        metrics.start_turn()
+        status = 'error'
+        try:
+            self.speak_response(message)
+            status = 'ok'
+        finally:
+            metrics.end_turn(status=status)
+
+    def speak_response(self, message):
+        """
+        Answers a user message and plays the answer as audio, showing the text of every section as it is played.
+
+        Args:
+        - message (str): The user message to be added.
+        """
+        # Start the deadline of the turn
+        self.deadline = self.policy.deadline()
+        self.degraded = False
+        
+        # Remove the messages of the turn again if it fails
+        turn_start = len(self.messages)
+        try:
+            # Call the functions the AI needs to answer
+            self.call_tools(message)
+                
+            # Notify the user that the AI finishing building up the response
+            sys.stdout.write('\r')  # Move the cursor back to the start of the line
+            sys.stdout.write(' ' * len("Building response..."))  # Overwrite the previous message with spaces
+            sys.stdout.write('\r')  # Move the cursor back to the start of the line again         
+        
             # Get the response
-            text_response = self.client.chat.completions.create(
-                model=self.model,
-                messages=self.messages,
-            )
-            
-            # Extract content from response
-            content = text_response.choices[0].message.content
-
-            # Define maximum length for each section (4096 characters)
-            max_length = 4096
-
-            # Split content into sections without cutting words
-            sections = []
-            current_section = ""
-            for word in content.split():
-                if len(current_section) + len(word) + 1 <= max_length:
-                    if current_section:
-                        current_section += " "
-                    current_section += word
-                else:
-                    sections.append(current_section)
-                    current_section = word
+            try:
+                with metrics.span('answer'):
+                    text_response = self.policy.call(
+                        self.client.chat.completions.create,
+                        deadline=self.deadline,
+                        model=self.model,
+                        messages=self.messages,
+                    )
+                metrics.record_usage(text_response.usage)
             
-            # Append last section if any
-            if current_section:
+                # Extract content from response
+                content = text_response.choices[0].message.content
+                self.policy.cache_answer(self.answer_key(message), content)
+            except CALL_FAILURES:
+                # Answer with a cached or degraded answer if the API is failing
+                self.degraded = True
+                content = self.degraded_answer(message)
+        
+            # Remember the answer so follow up questions have the context
+            self.messages.append({"role": "assistant", "content": content})
+        except BaseException:
+            self.rollback_turn(turn_start)
+            raise
+        self.save_session()
+
+        # Define maximum length for each section (4096 characters)
+        max_length = 4096
+
+        # Split content into sections without cutting words
+        sections = []
+        current_section = ""
+        for word in content.split():
+            if len(current_section) + len(word) + 1 <= max_length:
+                if current_section:
+                    current_section += " "
+                current_section += word
+            else:
                 sections.append(current_section)
-                
-            # Define the states for the dots - This is used for the Generating response text
-            message = "Generating audio response..."
-            # Print the message with moving dots
-            sys.stdout.write(f"\r{message}")
-            sys.stdout.flush()
+                current_section = word
+        
+        # Append last section if any
+        if current_section:
+            sections.append(current_section)
+            
+        # Define the states for the dots - This is used for the Generating response text
+        message = "Generating audio response..."
+        # Print the message with moving dots
+        sys.stdout.write(f"\r{message}")
+        sys.stdout.flush()
 
-            # Iterate over sections
-            for section in sections:
-                # Generate speech for the current section
-                response = self.client.audio.speech.create(
-                    model="tts-1",
-                    voice="nova",  # Adjust voice as needed
-                    input=section,
-                )
-                
-                # Replace the message with the audio response that will be played
-                sys.stdout.write("\r" + " " * (len(message) + 3) + "\r")  # Clear the line
-                sys.stdout.write(f"{section}\n")
-                sys.stdout.flush()
+        # Iterate over sections
+        for section in sections:
+            # Generate speech for the current section, the text is still shown if the speech fails
+            try:
+                with metrics.span('tts_synthesis'):
+                    response = self.policy.call(
+                        self.client.audio.speech.create,
+                        deadline=self.deadline,
+                        model="tts-1",
+                        voice="nova",  # Adjust voice as needed
+                        input=section,
+                    )
+            except CALL_FAILURES:
+                response = None
             
-                # Save the response to a local file
-                output_file = "voice_response.mp3"
-                response.stream_to_file(output_file)
+            # Replace the message with the audio response that will be played
+            sys.stdout.write("\r" + " " * (len(message) + 3) + "\r")  # Clear the line
+            sys.stdout.write(f"{section}\n")
+            sys.stdout.flush()
+            if response is None:
+                continue
+        
+            # Save the response to a local file
+            output_file = "voice_response.mp3"
+            response.stream_to_file(output_file)
 
-                # Play the saved MP3 file using macOS afplay command
-                try:
+            # Play the saved MP3 file using macOS afplay command
+            try:
+                with metrics.span('tts_playback'):
                     subprocess.run(["afplay", output_file])
-                except FileNotFoundError:
-                    print("Error: 'afplay' command not found. Make sure you are using macOS.")
-                except Exception as e:
-                    print(f"Error occurred during playing: {e}")
-                
-    
-
+            except FileNotFoundError:
+                print("Error: 'afplay' command not found. Make sure you are using macOS.")
+            except Exception as e:
+                print(f"Error occurred during playing: {e}")
@@ -0,0 +1,188 @@
+import json
+import time
+import functools
+import threading
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAI, DefaultHttpxClient
+from assistant import Assistant, api_key
+
+
+def parse_question(line_number, line):
+    """
+    Parses one line of the input JSONL file.
+
+    Every line is a JSON object with the question under "question", "message" or "body", and
+    optionally an id under "id" or "request_id". Lines without an id use their line number.
+
+    Args:
+    - line_number (int): The position of the line in the file, starting at 0.
+    - line (str): The line.
+
+    Returns:
+    - Tuple: A tuple containing (id, question).
+
+    Raises:
+    - ValueError: If the line is not a JSON object.
+    """
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError(f"expected a JSON object, got {type(record).__name__}")
+    question = record.get('question') or record.get('message') or record.get('body')
+    if not isinstance(question, str):
+        question = None
+    question_id = record.get('id') or record.get('request_id') or line_number
+    return question_id, question
+
+
+def turn_tool_calls(messages):
+    """
+    Returns the tool calls the assistant made during the last turn.
+
+    Args:
+    - messages (list of dict): The message history of the assistant.
+
+    Returns:
+    - list of dict: Each tool call with its name and parsed arguments.
+    """
+    # The last turn starts at the last user message
+    start = max(i for i, message in enumerate(messages) if message.get('role') == 'user')
+
+    tool_calls = []
+    for message in messages[start:]:
+        for tool_call in message.get('tool_calls') or []:
+            tool_calls.append({
+                "name": tool_call['function']['name'],
+                "arguments": json.loads(tool_call['function']['arguments'] or '{}')
+            })
+    return tool_calls
+
+
+def answer_question(client, line_number, question_id, question):
+    """
+    Answers one question with a fresh assistant so no history leaks between questions.
+
+    Args:
+    - client (OpenAI): The OpenAI client shared by every question.
+    - line_number (int): The position of the question in the input file.
+    - question_id (str or int): The id of the question.
+    - question (str): The question.
+
+    Returns:
+    - dict: The result with the answer, whether it is a degraded fallback answer, tool calls and timings, or the error if the question failed.
+    """
+    result = {"line": line_number, "id": question_id, "question": question}
+    start = time.perf_counter()
+    try:
+        assistant = Assistant(client=client)
+        answer = ""
+        for chunk in assistant.generate_response(question):
+            # Time to the first token of the answer
+            if not answer:
+                result["first_token_seconds"] = round(time.perf_counter() - start, 3)
+            answer += chunk
+        result["answer"] = answer
+        result["degraded"] = assistant.degraded
+        result["tool_calls"] = turn_tool_calls(assistant.messages)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["total_seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_batch(input_path, output_path, concurrency=8, offset=0, resume=False):
+    """
+    Answers every question of a JSONL file and writes the results to an output JSONL file.
+
+    Questions are read lazily and answered concurrently, and each result is written as soon as it
+    finishes, so results are in the order they finished and carry the line of their question.
+
+    Args:
+    - input_path (str): Path of the input JSONL file.
+    - output_path (str): Path of the output JSONL file, results are appended to it.
+    - concurrency (int, optional): How many questions are answered at the same time. Default is 8.
+    - offset (int, optional): How many lines of the input file to skip. Default is 0.
+    - resume (bool, optional): Whether to skip the lines that already have a result in the output file. Default is False.
+      Lines whose result is a degraded fallback answer are answered again, the newer result is appended after it.
+    """
+    # Find the questions that already have a real answer, the last result of a line counts
+    done = set()
+    if resume:
+        try:
+            with open(output_path, encoding='utf-8') as f:
+                for line in f:
+                    # Skip lines that are not results, like the truncated last line of a crashed run
+                    try:
+                        result = json.loads(line)
+                        line_number = result['line']
+                    except (ValueError, TypeError, KeyError):
+                        continue
+                    if result.get('degraded'):
+                        done.discard(line_number)
+                    else:
+                        done.add(line_number)
+        except FileNotFoundError:
+            pass
+
+    # End a truncated last line so the next result starts on a line of its own
+    try:
+        with open(output_path, 'rb+') as f:
+            f.seek(0, 2)
+            if f.tell():
+                f.seek(-1, 2)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+    except FileNotFoundError:
+        pass
+
+    # One pooled client shared by every question
+    client = OpenAI(
+        api_key=api_key,
+        max_retries=0, # Retries are left to the call policy
+        http_client=DefaultHttpxClient(limits=httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2))
+    )
+
+    # Only concurrency questions are in flight at a time, so the input file is never read all at once
+    slots = threading.Semaphore(concurrency)
+    write_lock = threading.Lock()
+    answered = 0
+
+    with open(input_path, encoding='utf-8') as input_file, open(output_path, 'a', encoding='utf-8') as output_file:
+        def write_result(line_number, question_id, question, future):
+            nonlocal answered
+            try:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"line": line_number, "id": question_id, "question": question, "error": f"{type(e).__name__}: {e}", "total_seconds": 0}
+                with write_lock:
+                    output_file.write(json.dumps(result) + "\n")
+                    output_file.flush()
+                    answered += 1
+                    print(f"[{answered}] line {result['line']} answered in {result['total_seconds']}s")
+            except Exception as e:
+                print(f"Error writing the result of line {line_number} - Error: {str(e)}")
+            finally:
+                # Always free the slot, otherwise the loop reading the questions waits forever
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for line_number, line in enumerate(input_file):
+                if line_number < offset or line_number in done or not line.strip():
+                    continue
+
+                # Skip lines that are not valid questions
+                try:
+                    question_id, question = parse_question(line_number, line)
+                except ValueError as e:
+                    print(f"Skipping line {line_number} - Error: {str(e)}")
+                    continue
+                if not question:
+                    print(f"Skipping line {line_number} - Error: no question")
+                    continue
+
+                slots.acquire()
+                future = executor.submit(answer_question, client, line_number, question_id, question)
+                future.add_done_callback(functools.partial(write_result, line_number, question_id, question))
+
+    print(f"Answered {answered} questions, results written to {output_path}")
@@ -0,0 +1,93 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Directory of main.py
+ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def measure_import_time(module='main'):
+    """
+    Measures how long importing a module takes with `python -X importtime`.
+
+    Args:
+    - module (str, optional): The module to import. Default is main.
+
+    Returns:
+    - Tuple: A tuple containing (milliseconds of the module, list of (milliseconds, name) of the slowest imports).
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT_DIR, capture_output=True, text=True, check=True
+    )
+
+    # Every line is "import time: self [us] | cumulative | imported package"
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative) / 1000, name.rstrip()))
+
+    # The imports of the module are listed right before it, indented under it
+    index = next(i for i, (ms, name) in enumerate(imports) if name == f' {module}')
+    children = []
+    for ms, name in reversed(imports[:index]):
+        if not name.startswith('   '):
+            break
+        if not name.startswith('     '):
+            children.append((ms, name.strip()))
+    return imports[index][0], sorted(children, reverse=True)[:10]
+
+
+def measure_time_to_prompt():
+    """
+    Measures how long main.py takes from starting until it asks for the first question.
+
+    Returns:
+    - float: The milliseconds until the prompt showed.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-u', 'main.py'],
+        cwd=ROOT_DIR, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    try:
+        # Read until the prompt shows
+        output = b''
+        while not output.endswith(b'user: '):
+            byte = process.stdout.read(1)
+            if not byte:
+                raise RuntimeError("main.py exited before asking for a question")
+            output += byte
+        return (time.perf_counter() - start) * 1000
+    finally:
+        process.kill()
+        process.wait()
+
+
+# Main function to check the startup time against its budget
+def main():
+    parser = argparse.ArgumentParser(description="Check that main.py starts within its time budget.")
+    parser.add_argument("--import-budget-ms", type=float, default=100, help="How long importing main.py can take")
+    parser.add_argument("--prompt-budget-ms", type=float, default=500, help="How long main.py can take to show the prompt")
+    parser.add_argument("--runs", type=int, default=5, help="How many times to measure, the fastest run counts")
+    args = parser.parse_args()
+
+    # The fastest run counts, slower ones measure the machine more than the code
+    import_ms, slowest = min(measure_import_time() for _ in range(args.runs))
+    prompt_ms = min(measure_time_to_prompt() for _ in range(args.runs))
+
+    print(f"Import of main.py: {import_ms:.1f} ms (budget {args.import_budget_ms:.0f} ms)")
+    for ms, name in slowest:
+        print(f"  {ms:8.1f} ms  {name}")
+    print(f"Time to prompt: {prompt_ms:.1f} ms (budget {args.prompt_budget_ms:.0f} ms)")
+
+    if import_ms > args.import_budget_ms or prompt_ms > args.prompt_budget_ms:
+        print("Startup is over budget")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
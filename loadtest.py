@@ -0,0 +1,186 @@
+import argparse
+import json
+import time
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAI, DefaultHttpxClient
+from assistant import Assistant
+from batch import parse_question
+from scraper.call_policy import CallPolicy
+
+# Questions the conversations ask when no questions file is given
+DEFAULT_QUESTIONS = [
+    "What are the newest Air Jordan releases?",
+    "Show me Air Jordan shoes with discounts.",
+    "Tell me more about the Air Jordan 1 Retro High OG.",
+    "Do you have any black high tops under $150?",
+    "Which of those would you recommend for basketball?"
+]
+
+
+def percentile(values, percent):
+    """
+    Returns a percentile of a list of values with the nearest-rank method.
+
+    Args:
+    - values (list of float): The values, they do not need to be sorted.
+    - percent (float): The percentile to return (e.g., 95).
+
+    Returns:
+    - float or None: The percentile, or None if there are no values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def load_questions(path=None):
+    """
+    Loads the questions the conversations ask.
+
+    Args:
+    - path (str, optional): Path of a JSONL file in the batch format. Default uses the built-in questions.
+
+    Returns:
+    - list of str: The questions.
+    """
+    if not path:
+        return DEFAULT_QUESTIONS
+    with open(path, encoding='utf-8') as f:
+        return [parse_question(i, line)[1] for i, line in enumerate(f) if line.strip()]
+
+
+def run_conversation(client, conversation, questions, turns, policy=None):
+    """
+    Runs one conversation, asking a question per turn with the history of the earlier turns.
+
+    Args:
+    - client (OpenAI): The OpenAI client shared by every conversation.
+    - conversation (int): The number of the conversation, used to pick its first question.
+    - questions (list of str): The questions to ask.
+    - turns (int): How many turns the conversation has.
+    - policy (CallPolicy, optional): The call policy of the assistant. Default is the shared default policy.
+
+    Returns:
+    - list of dict: The time to first token, latency and number of chunks of every turn, whether it was degraded, or its error.
+    """
+    assistant = Assistant(client=client, policy=policy)
+    results = []
+    for turn in range(turns):
+        question = questions[(conversation + turn) % len(questions)]
+        result = {"conversation": conversation, "turn": turn}
+        start = time.perf_counter()
+        try:
+            chunks = 0
+            for _ in assistant.generate_response(question):
+                if not chunks:
+                    result["first_token_seconds"] = time.perf_counter() - start
+                chunks += 1
+            result["chunks"] = chunks
+            result["degraded"] = assistant.degraded
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["seconds"] = time.perf_counter() - start
+        results.append(result)
+    return results
+
+
+def run_load_test(base_url, conversations, turns, questions, api_key='stub', policy=None):
+    """
+    Runs many conversations at the same time against an OpenAI-compatible API and summarizes them.
+
+    Args:
+    - base_url (str): The base URL of the API (e.g., the stand-in at "http://127.0.0.1:8766/v1").
+    - conversations (int): How many conversations run at the same time.
+    - turns (int): How many turns every conversation has.
+    - questions (list of str): The questions the conversations ask.
+    - api_key (str, optional): The API key sent to the API. Default is "stub".
+    - policy (CallPolicy, optional): The call policy shared by the conversations. Default is the shared default policy.
+
+    Returns:
+    - dict: The summary with time-to-first-token and turn latency percentiles in seconds, throughput and errors.
+    """
+    # One pooled client shared by every conversation, like the server and batch mode
+    client = OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        max_retries=0, # Retries are left to the call policy
+        http_client=DefaultHttpxClient(limits=httpx.Limits(max_connections=conversations * 2, max_keepalive_connections=conversations * 2))
+    )
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=conversations) as executor:
+        futures = [executor.submit(run_conversation, client, i, questions, turns, policy) for i in range(conversations)]
+        results = [result for future in futures for result in future.result()]
+    seconds = time.perf_counter() - start
+
+    completed = [result for result in results if 'error' not in result]
+    first_tokens = [result['first_token_seconds'] for result in completed if 'first_token_seconds' in result]
+    latencies = [result['seconds'] for result in completed]
+    return {
+        "conversations": conversations,
+        "turns": len(results),
+        "errors": len(results) - len(completed),
+        "degraded": sum(1 for result in completed if result['degraded']),
+        "seconds": round(seconds, 3),
+        "turns_per_second": round(len(completed) / seconds, 2),
+        "chunks_per_second": round(sum(result['chunks'] for result in completed) / seconds, 1),
+        "first_token": {f"p{p}": percentile(first_tokens, p) for p in (50, 95, 99)},
+        "turn_latency": {f"p{p}": percentile(latencies, p) for p in (50, 95, 99)},
+        "error_samples": [result['error'] for result in results if 'error' in result][:5]
+    }
+
+
+def print_summary(summary):
+    """
+    Prints the summary of a load test.
+
+    Args:
+    - summary (dict): The summary returned by run_load_test.
+    """
+    def format_seconds(value):
+        return 'n/a' if value is None else f"{value * 1000:.0f} ms"
+
+    print(f"{summary['conversations']} conversations, {summary['turns']} turns in {summary['seconds']}s ({summary['errors']} errors, {summary['degraded']} degraded)")
+    print(f"Throughput: {summary['turns_per_second']} turns/s, {summary['chunks_per_second']} chunks/s")
+    for label, key in (("Time to first token", "first_token"), ("Turn latency", "turn_latency")):
+        values = summary[key]
+        print(f"{label}: p50 {format_seconds(values['p50'])}, p95 {format_seconds(values['p95'])}, p99 {format_seconds(values['p99'])}")
+    for error in summary['error_samples']:
+        print(f"Error: {error}")
+
+
+# Main function to run the load test
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many concurrent conversations against the OpenAI stand-in or another compatible API.")
+    parser.add_argument("--conversations", type=int, default=20, help="How many conversations run at the same time")
+    parser.add_argument("--turns", type=int, default=3, help="How many turns every conversation has")
+    parser.add_argument("--questions", help="JSONL file of questions in the batch format")
+    parser.add_argument("--base-url", help="Base URL of the API to test. Default starts a stand-in in this process")
+    parser.add_argument("--behavior", help="Behavior file of the stand-in started in this process")
+    parser.add_argument("--cassette", help="Cassette the stand-in started in this process replays")
+    parser.add_argument("--turn-deadline", type=float, default=60, help="Seconds every turn can take before it falls back to a degraded answer")
+    parser.add_argument("--max-retries", type=int, default=3, help="How many times to retry a failed OpenAI call")
+    parser.add_argument("--hedge", action="store_true", help="Send a duplicate tool-selection request once it is slower than its p95")
+    parser.add_argument("--output", help="Write the summary as JSON to this file")
+    args = parser.parse_args()
+
+    base_url = args.base_url
+    if not base_url:
+        from openai_stub import OpenAIStub, load_behavior, start_stub_server
+        _, base_url = start_stub_server(OpenAIStub(load_behavior(args.behavior), cassette=args.cassette))
+
+    policy = CallPolicy(turn_deadline=args.turn_deadline, max_retries=args.max_retries, hedge=args.hedge)
+    summary = run_load_test(base_url, args.conversations, args.turns, load_questions(args.questions), policy=policy)
+    if args.hedge:
+        print(f"Hedged {policy.hedges} tool-selection calls")
+    print_summary(summary)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == '__main__':
+    main()
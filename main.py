@@ -1,16 +1,130 @@
 import argparse
-from assistant import Assistant
+import atexit
+import threading
+
+def configure_policy(args):
+    """
+    Sets the deadlines, retries and hedging of the OpenAI calls of every assistant.
+
+    Args:
+    - args (argparse.Namespace): The command-line arguments.
+    """
+    from scraper import call_policy
+    call_policy.default_policy = call_policy.CallPolicy(turn_deadline=args.turn_deadline, max_retries=args.max_retries, hedge=args.hedge)
+
+
+def load_assistant(args, session_store):
+    """
+    Imports and creates the assistant, and starts warming up its connections so the first turn does not pay for them.
+
+    The assistant pulls in the OpenAI SDK (httpx, pydantic), which takes most of the startup time,
+    so this runs in the background while the banner and the prompt show. The warm up runs on a thread of its own,
+    so a question asked before it is done does not wait for it (the API can take seconds to answer it).
+
+    Args:
+    - args (argparse.Namespace): The command-line arguments.
+    - session_store (SessionStore or None): The store the conversation is saved in.
+
+    Returns:
+    - Assistant: The assistant.
+    """
+    configure_policy(args)
+    from assistant import Assistant
+    assistant = Assistant(voice=args.audio, session_store=session_store, session_id=args.session)
+    threading.Thread(target=assistant.warm_up, daemon=True).start()
+    return assistant
+
+
+class BackgroundLoader(threading.Thread):
+    """
+    Runs load_assistant on a background thread and hands over its result, or its error, once it is needed.
+    """
+    def __init__(self, args, session_store):
+        super().__init__(daemon=True)
+        self.args = args
+        self.session_store = session_store
+        self.assistant = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.assistant = load_assistant(self.args, self.session_store)
+        except Exception as e:
+            self.error = e
+
+    def result(self):
+        """
+        Waits for the assistant to be ready.
+
+        Returns:
+        - Assistant: The assistant.
+        """
+        self.join()
+        if self.error:
+            raise self.error
+        return self.assistant
 
 def main():
     # Parse if audio is passed
     parser = argparse.ArgumentParser(description="Command-line interface for Nike Air Jordan Product Assistant.")
     parser.add_argument("--audio", action="store_true", help="Enable voice interaction")
+    parser.add_argument("--serve", action="store_true", help="Run an HTTP server hosting many sessions instead of the command-line interface")
+    parser.add_argument("--host", default="127.0.0.1", help="Host the server listens on")
+    parser.add_argument("--port", type=int, default=8000, help="Port the server listens on")
+    parser.add_argument("--max-inflight", type=int, default=16, help="How many completions the server runs at the same time")
+    parser.add_argument("--idle-timeout", type=float, default=900, help="Seconds before an idle session is evicted")
+    parser.add_argument("--session", help="Save the conversation under this id, or resume it if it exists")
+    parser.add_argument("--sessions-db", help="Path of the session database (default: sessions.db)")
+    parser.add_argument("--batch", help="Answer every question of this JSONL file instead of running the command-line interface")
+    parser.add_argument("--output", default="answers.jsonl", help="JSONL file the batch results are appended to")
+    parser.add_argument("--concurrency", type=int, default=8, help="How many batch questions are answered at the same time")
+    parser.add_argument("--offset", type=int, default=0, help="How many lines of the batch file to skip")
+    parser.add_argument("--resume", action="store_true", help="Skip the batch questions that already have a result in the output file")
+    parser.add_argument("--metrics", action="store_true", help="Record latency and token metrics (served at /metrics in server mode)")
+    parser.add_argument("--metrics-jsonl", help="Append the metrics of every turn to this JSON lines file (implies --metrics)")
+    parser.add_argument("--metrics-prom", help="Write the metric histograms in Prometheus text format to this file on exit (implies --metrics)")
+    parser.add_argument("--profile", nargs="?", const="profiles", help="Profile every conversation turn and write the profiles to this directory (default: profiles)")
+    parser.add_argument("--turn-deadline", type=float, default=60, help="Seconds a turn can take before it falls back to a degraded answer")
+    parser.add_argument("--max-retries", type=int, default=3, help="How many times to retry a failed OpenAI call")
+    parser.add_argument("--hedge", action="store_true", help="Send a duplicate tool-selection request once it is slower than its p95")
+    parser.add_argument("--profile-top", type=int, default=20, help="How many of the hottest functions the profile summary shows")
     args = parser.parse_args()
 
-    if args.audio:
-        assistant = Assistant(voice=True)
-    else:
-        assistant = Assistant()
+    # Turns of the server and of batches run on worker threads, which cProfile does not see
+    if args.profile and (args.serve or args.batch):
+        parser.error("--profile only works with the command-line interface, not with --serve or --batch")
+
+    # Turn on the metrics if asked for
+    if args.metrics or args.metrics_jsonl or args.metrics_prom:
+        import metrics
+        metrics.enable(jsonl=args.metrics_jsonl)
+        if args.metrics_prom:
+            atexit.register(metrics.write_prometheus, args.metrics_prom)
+
+    # Run the server instead of the command-line interface
+    if args.serve:
+        configure_policy(args)
+        from server import run_server
+        run_server(host=args.host, port=args.port, max_inflight=args.max_inflight, idle_timeout=args.idle_timeout, sessions_path=args.sessions_db)
+        return
+
+    # Answer a file of questions instead of the command-line interface
+    if args.batch:
+        configure_policy(args)
+        from batch import run_batch
+        run_batch(args.batch, args.output, concurrency=args.concurrency, offset=args.offset, resume=args.resume)
+        return
+
+    # Save the conversation if a session is given
+    session_store = None
+    if args.session:
+        from session_store import SessionStore
+        session_store = SessionStore(args.sessions_db) if args.sessions_db else SessionStore()
+
+    # Import and create the assistant in the background so the banner and the prompt show right away
+    loader = BackgroundLoader(args, session_store)
+    loader.start()
+    assistant = None
     
     # Print welcome message
     print("\n")
@@ -24,10 +138,27 @@ def main():
     print("Let's dive into the world of Air Jordans together!")
     print("\n")
     
+    # Profile every turn and print the hottest functions on exit
+    profiler = None
+    if args.profile:
+        from scraper.profiling import Profiler
+        profiler = Profiler(args.profile, top=args.profile_top)
+        atexit.register(profiler.print_summary)
+    
     # Take user input
+    turn = 0
     while True:
         user_input = input("user: ")
-        assistant.stream_response(user_input)  # Stream AI response
+        turn += 1
+        
+        # Wait for the assistant if the first question came in before it was ready
+        if assistant is None:
+            assistant = loader.result()
+        if profiler:
+            with profiler.profile(f"turn-{turn}"):
+                assistant.stream_response(user_input)  # Stream AI response
+        else:
+            assistant.stream_response(user_input)  # Stream AI response
         
         # Allow user to input another question after the assistant's response
         print("\n")  # Print newline for readability
@@ -0,0 +1,242 @@
+import json
+import time
+import threading
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Upper bounds of the token histogram buckets
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+# Metrics are off by default, every hook returns straight away until enable is called
+enabled = False
+
+# Path of the JSON lines file every turn is written to, if any
+jsonl_path = None
+
+# Histograms keyed by their name and labels, guarded by the lock
+histograms = {}
+lock = threading.Lock()
+
+# The turn that is running on the current thread
+current = threading.local()
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus format.
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Adds a value to the histogram.
+
+        Args:
+        - value (float): The value to add.
+        """
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class NoopSpan:
+    """
+    Span returned while metrics are disabled, entering and leaving it does nothing.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    """
+    Times a phase of a turn and records it when the block ends.
+    """
+    def __init__(self, phase, labels):
+        self.phase = phase
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        record_duration(self.phase, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def enable(jsonl=None):
+    """
+    Turns metrics on.
+
+    Args:
+    - jsonl (str, optional): Path of a JSON lines file every turn is appended to.
+    """
+    global enabled, jsonl_path
+    enabled = True
+    jsonl_path = jsonl
+
+
+def observe(name, value, buckets, **labels):
+    """
+    Adds a value to a histogram, creating the histogram if needed.
+
+    Args:
+    - name (str): The name of the histogram.
+    - value (float): The value to add.
+    - buckets (tuple): The upper bounds of the buckets, used when the histogram is created.
+    - labels: The labels of the histogram.
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+def span(phase, **labels):
+    """
+    Returns a context manager that times a phase of the current turn.
+
+    Args:
+    - phase (str): The name of the phase (e.g., "tool_selection").
+    - labels: Extra labels of the phase (e.g., tool="search_products").
+
+    Returns:
+    - Span or NoopSpan: The context manager.
+    """
+    if not enabled:
+        return NOOP_SPAN
+    return Span(phase, labels)
+
+
+def record_duration(phase, seconds, **labels):
+    """
+    Records how long a phase of the current turn took.
+
+    Args:
+    - phase (str): The name of the phase.
+    - seconds (float): How long the phase took.
+    - labels: Extra labels of the phase.
+    """
+    if not enabled:
+        return
+    observe('assistant_phase_seconds', seconds, LATENCY_BUCKETS, phase=phase, **labels)
+    turn = getattr(current, 'turn', None)
+    if turn is not None:
+        turn['spans'].append({"phase": phase, "seconds": round(seconds, 6), **labels})
+
+
+def record_usage(usage):
+    """
+    Adds the token usage of a completion to the current turn.
+
+    Args:
+    - usage (object): The usage of the completion, with prompt_tokens and completion_tokens.
+    """
+    if not enabled or usage is None:
+        return
+    turn = getattr(current, 'turn', None)
+    if turn is not None:
+        turn['prompt_tokens'] += usage.prompt_tokens or 0
+        turn['completion_tokens'] += usage.completion_tokens or 0
+
+
+def start_turn():
+    """
+    Starts recording a turn on the current thread.
+    """
+    if not enabled:
+        return
+    current.turn = {"started_at": time.time(), "start": time.perf_counter(), "spans": [], "prompt_tokens": 0, "completion_tokens": 0}
+
+
+def end_turn(status='ok'):
+    """
+    Finishes the turn running on the current thread, recording its total latency and token usage,
+    and appending it to the JSON lines file if one is set.
+
+    Args:
+    - status (str, optional): How the turn ended ("ok", "error" or "cancelled"), the latency is labeled with it. Default is "ok".
+    """
+    if not enabled:
+        return
+    turn = getattr(current, 'turn', None)
+    if turn is None:
+        return
+    current.turn = None
+
+    seconds = time.perf_counter() - turn.pop('start')
+    turn['seconds'] = round(seconds, 6)
+    turn['status'] = status
+    observe('assistant_turn_seconds', seconds, LATENCY_BUCKETS, status=status)
+    observe('assistant_turn_tokens', turn['prompt_tokens'], TOKEN_BUCKETS, kind='prompt')
+    observe('assistant_turn_tokens', turn['completion_tokens'], TOKEN_BUCKETS, kind='completion')
+
+    if jsonl_path:
+        with lock:
+            with open(jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(turn) + "\n")
+
+
+def format_labels(labels, extra=None):
+    """
+    Formats labels in the Prometheus text format.
+
+    Args:
+    - labels (tuple): The labels as (key, value) pairs.
+    - extra (tuple, optional): An extra (key, value) pair added at the end.
+
+    Returns:
+    - str: The labels (e.g., '{phase="search",le="0.1"}'), or an empty string if there are none.
+    """
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+def render_prometheus():
+    """
+    Renders every histogram in the Prometheus text format.
+
+    Returns:
+    - str: The histograms.
+    """
+    lines = []
+    with lock:
+        names_seen = set()
+        for (name, labels), histogram in sorted(histograms.items()):
+            if name not in names_seen:
+                lines.append(f"# TYPE {name} histogram")
+                names_seen.add(name)
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f"{name}_bucket{format_labels(labels, ('le', bound))} {count}")
+            lines.append(f"{name}_bucket{format_labels(labels, ('le', '+Inf'))} {histogram.count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    """
+    Writes every histogram in the Prometheus text format to a file.
+
+    Args:
+    - path (str): Path of the file.
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(render_prometheus())
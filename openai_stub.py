@@ -0,0 +1,481 @@
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# How the stand-in behaves unless the behavior file says otherwise
+DEFAULT_BEHAVIOR = {
+    # Seconds before the tool-selection call answers
+    "tool_selection_latency": 0.4,
+    # Seconds before the first token of a streamed answer
+    "first_token_latency": 0.3,
+    # How many tokens per second answers are streamed at
+    "tokens_per_second": 60,
+    # Every latency is multiplied by a random factor between 1 - jitter and 1 + jitter
+    "jitter": 0.1,
+    # Seconds before a speech request answers
+    "speech_latency": 0.5,
+    # The tool calls of the tool-selection call, used when no rule matches the user message
+    "tool_calls": [{"name": "search_products", "arguments": {"name": "air jordan 1"}}],
+    # Rules picking the tool calls from the last user message, checked in order
+    # (e.g., {"match": "discount", "tool_calls": [{"name": "search_products_with_discounts", "arguments": {}}]})
+    "rules": [],
+    # The answers, used one after the other
+    "answers": ["Here are a few Air Jordans that match what you are looking for. Let me know if you would like more details about any of them."],
+    # Share of requests answered with an error status instead, to test retries and the circuit breaker
+    "error_rate": 0.0,
+    "error_status": 503,
+    # Share of requests that take slow_latency seconds longer, to test deadlines and hedging
+    "slow_rate": 0.0,
+    "slow_latency": 5.0,
+    # Seed of the jitter and the faults so runs are repeatable
+    "seed": 0
+}
+
+
+def load_behavior(path=None):
+    """
+    Loads the behavior of the stand-in.
+
+    Args:
+    - path (str, optional): Path of a JSON file whose keys override the default behavior.
+
+    Returns:
+    - dict: The behavior.
+    """
+    behavior = dict(DEFAULT_BEHAVIOR)
+    if path:
+        with open(path, encoding='utf-8') as f:
+            behavior.update(json.load(f))
+    return behavior
+
+
+def cassette_key(endpoint, request):
+    """
+    Returns the key a request is recorded under in a cassette.
+
+    Message histories hold random search results, so requests are matched on the endpoint, the
+    last user message, whether tools were offered and whether the response is streamed.
+
+    Args:
+    - endpoint (str): The endpoint of the request (e.g., "chat/completions").
+    - request (dict): The body of the request.
+
+    Returns:
+    - str: The key.
+    """
+    user_messages = [message.get('content') for message in request.get('messages', []) if message.get('role') == 'user']
+    parts = [endpoint, user_messages[-1] if user_messages else request.get('input'), bool(request.get('tools')), bool(request.get('stream'))]
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+def count_tokens(text):
+    """
+    Roughly counts the tokens of a text, about four characters per token.
+
+    Args:
+    - text (str): The text.
+
+    Returns:
+    - int: The number of tokens.
+    """
+    return max(1, len(text) // 4)
+
+
+class OpenAIStub:
+    """
+    Local stand-in for the OpenAI chat completions and audio speech endpoints the assistant uses.
+
+    Responses are generated from the behavior (latencies, token rate, scripted tool calls and answers),
+    replayed from a cassette, or proxied to the real API and recorded into a cassette. The behavior can
+    inject errors and slow responses, and POST /_stub/behavior changes it while the stand-in runs.
+    """
+    def __init__(self, behavior=None, cassette=None, record=None, upstream='https://api.openai.com/v1', api_key=None):
+        # How the generated responses behave
+        self.behavior = behavior or load_behavior()
+        self.random = random.Random(self.behavior['seed'])
+
+        # The answers are handed out one after the other
+        self.answers = itertools.cycle(self.behavior['answers'])
+
+        # Recorded responses keyed by their request, replayed one after the other
+        self.cassette = {}
+        if cassette:
+            with open(cassette, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.cassette.setdefault(entry['key'], []).append(entry)
+            self.cassette = {key: itertools.cycle(entries) for key, entries in self.cassette.items()}
+
+        # Cassette the proxied responses are recorded into, and where they are proxied to
+        self.record = record
+        self.upstream = upstream
+        self.api_key = api_key
+
+        # How many requests each endpoint served, and how many faults were injected
+        self.requests = {}
+        self.faults = 0
+        self.lock = threading.Lock()
+
+    def sleep(self, seconds):
+        """
+        Sleeps for a latency of the behavior with jitter applied.
+
+        Args:
+        - seconds (float): The latency.
+        """
+        with self.lock:
+            factor = 1 + self.random.uniform(-self.behavior['jitter'], self.behavior['jitter'])
+        if seconds > 0:
+            time.sleep(seconds * factor)
+
+    def count(self, endpoint):
+        """
+        Counts a request to an endpoint.
+
+        Args:
+        - endpoint (str): The endpoint.
+        """
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def inject_fault(self):
+        """
+        Decides whether a request fails or is slowed down, following the fault rates of the behavior.
+
+        Returns:
+        - int or None: The error status to answer with, or None if the request should be answered.
+        """
+        with self.lock:
+            failed = self.random.random() < self.behavior['error_rate']
+            slow = self.random.random() < self.behavior['slow_rate']
+            if failed or slow:
+                self.faults += 1
+        if slow:
+            time.sleep(self.behavior['slow_latency'])
+        return self.behavior['error_status'] if failed else None
+
+    def update_behavior(self, changes):
+        """
+        Changes the behavior while the stand-in runs (e.g., to start or end an outage).
+
+        Args:
+        - changes (dict): The keys of the behavior to change.
+        """
+        with self.lock:
+            self.behavior.update(changes)
+            if 'answers' in changes:
+                self.answers = itertools.cycle(self.behavior['answers'])
+
+    def pick_tool_calls(self, request):
+        """
+        Picks the tool calls of a tool-selection call from the rules of the behavior.
+
+        Args:
+        - request (dict): The body of the request.
+
+        Returns:
+        - list of dict: The tool calls in the chat completions format.
+        """
+        user_messages = [message.get('content') or '' for message in request.get('messages', []) if message.get('role') == 'user']
+        last_message = user_messages[-1].lower() if user_messages else ''
+
+        tool_calls = self.behavior['tool_calls']
+        for rule in self.behavior['rules']:
+            if rule['match'].lower() in last_message:
+                tool_calls = rule['tool_calls']
+                break
+
+        return [
+            {
+                "id": f"call_{i}_{int(time.time() * 1000)}",
+                "type": "function",
+                "function": {"name": tool_call['name'], "arguments": json.dumps(tool_call.get('arguments', {}))}
+            }
+            for i, tool_call in enumerate(tool_calls)
+        ]
+
+    def completion(self, request):
+        """
+        Generates a non-streamed chat completion.
+
+        Args:
+        - request (dict): The body of the request.
+
+        Returns:
+        - dict: The completion.
+        """
+        prompt_tokens = count_tokens(json.dumps(request.get('messages', [])))
+        if request.get('tools'):
+            self.sleep(self.behavior['tool_selection_latency'])
+            message = {"role": "assistant", "content": None, "tool_calls": self.pick_tool_calls(request)}
+            finish_reason = "tool_calls"
+            completion_tokens = count_tokens(json.dumps(message['tool_calls']))
+        else:
+            with self.lock:
+                answer = next(self.answers)
+            completion_tokens = count_tokens(answer)
+            self.sleep(self.behavior['first_token_latency'] + completion_tokens / self.behavior['tokens_per_second'])
+            message = {"role": "assistant", "content": answer}
+            finish_reason = "stop"
+
+        return {
+            "id": f"chatcmpl-stub-{int(time.time() * 1000)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get('model'),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        }
+
+    def completion_chunks(self, request):
+        """
+        Generates a streamed chat completion as Server-Sent Events, pacing the tokens at the token rate.
+
+        Args:
+        - request (dict): The body of the request.
+
+        Yields:
+        - bytes: The events.
+        """
+        with self.lock:
+            answer = next(self.answers)
+        prompt_tokens = count_tokens(json.dumps(request.get('messages', [])))
+        base = {"id": f"chatcmpl-stub-{int(time.time() * 1000)}", "object": "chat.completion.chunk", "created": int(time.time()), "model": request.get('model')}
+
+        # Every word is streamed as one token
+        tokens = [word if i == 0 else ' ' + word for i, word in enumerate(answer.split(' '))]
+        self.sleep(self.behavior['first_token_latency'])
+        for i, token in enumerate(tokens):
+            if i:
+                self.sleep(1 / self.behavior['tokens_per_second'])
+            chunk = {**base, "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n".encode('utf-8')
+
+        yield f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n".encode('utf-8')
+
+        # The last chunk holds the token usage if it was asked for
+        if (request.get('stream_options') or {}).get('include_usage'):
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+            yield f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n".encode('utf-8')
+        yield b"data: [DONE]\n\n"
+
+    def speech(self, request):
+        """
+        Generates the audio of a speech request.
+
+        Args:
+        - request (dict): The body of the request.
+
+        Returns:
+        - bytes: Placeholder audio whose size grows with the input text.
+        """
+        self.sleep(self.behavior['speech_latency'])
+        return b'\xff\xfb\x90\x00' * max(1, len(request.get('input', '')))
+
+    def replay(self, endpoint, request):
+        """
+        Returns the recorded response of a request.
+
+        Args:
+        - endpoint (str): The endpoint of the request.
+        - request (dict): The body of the request.
+
+        Returns:
+        - dict or None: The recorded entry, or None if the request was not recorded.
+        """
+        entries = self.cassette.get(cassette_key(endpoint, request))
+        if entries is None:
+            return None
+        with self.lock:
+            return next(entries)
+
+    def proxy(self, endpoint, request):
+        """
+        Sends a request to the real API and records its response into the cassette.
+
+        Args:
+        - endpoint (str): The endpoint of the request.
+        - request (dict): The body of the request.
+
+        Returns:
+        - dict: The recorded entry.
+        """
+        import httpx
+        start = time.perf_counter()
+        response = httpx.post(
+            f"{self.upstream}/{endpoint}",
+            json=request,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            timeout=120
+        )
+        entry = {
+            "key": cassette_key(endpoint, request),
+            "endpoint": endpoint,
+            "status": response.status_code,
+            "seconds": round(time.perf_counter() - start, 3),
+            "content_type": response.headers.get('content-type', 'application/json'),
+            "body": base64.b64encode(response.content).decode('ascii')
+        }
+        with self.lock:
+            with open(self.record, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + "\n")
+        return entry
+
+
+def make_handler(stub):
+    """
+    Creates a request handler that answers like the OpenAI API.
+
+    Args:
+    - stub (OpenAIStub): The stand-in generating the responses.
+
+    Returns:
+    - class: The request handler class.
+    """
+    class OpenAIHandler(BaseHTTPRequestHandler):
+        # Streamed responses have no length, so they need HTTP/1.1 chunked encoding
+        protocol_version = 'HTTP/1.1'
+
+        def handle(self):
+            try:
+                super().handle()
+            except ConnectionError:
+                # The client gave up on the request (e.g., its deadline ran out)
+                pass
+
+        def send_body(self, status, content_type, body):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_chunks(self, content_type, chunks):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in chunks:
+                self.wfile.write(f"{len(chunk):x}\r\n".encode('ascii') + chunk + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_GET(self):
+            # Only the model list is served, the assistant uses it to warm up its connection
+            endpoint = self.path.split('?')[0].strip('/')
+            if endpoint in ('models', 'v1/models'):
+                stub.count('models')
+                self.send_body(200, 'application/json', json.dumps({"object": "list", "data": [{"id": "stub", "object": "model", "created": 0, "owned_by": "stub"}]}).encode('utf-8'))
+            else:
+                self.send_body(404, 'application/json', json.dumps({"error": {"message": f"Unknown endpoint {endpoint}"}}).encode('utf-8'))
+
+        def do_POST(self):
+            # The client can use a base URL with or without /v1
+            endpoint = self.path.split('?')[0].strip('/')
+            if endpoint.startswith('v1/'):
+                endpoint = endpoint[3:]
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+            # The behavior can be changed while the stand-in runs
+            if endpoint == '_stub/behavior':
+                stub.update_behavior(request)
+                self.send_body(200, 'application/json', json.dumps(stub.behavior).encode('utf-8'))
+                return
+            stub.count(endpoint)
+
+            if endpoint not in ('chat/completions', 'audio/speech'):
+                self.send_body(404, 'application/json', json.dumps({"error": {"message": f"Unknown endpoint {endpoint}"}}).encode('utf-8'))
+                return
+
+            # Fail or slow down the request if the behavior asks for faults
+            status = stub.inject_fault()
+            if status:
+                error = {"error": {"message": "Injected fault", "type": "server_error", "code": None}}
+                self.send_body(status, 'application/json', json.dumps(error).encode('utf-8'))
+                return
+
+            # Recorded responses are replayed, or recorded from the real API
+            entry = stub.replay(endpoint, request) if stub.cassette else None
+            if entry is None and stub.record:
+                entry = stub.proxy(endpoint, request)
+            if entry is not None:
+                body = base64.b64decode(entry['body'])
+                if entry['content_type'].startswith('text/event-stream'):
+                    # Pace the recorded events like generated ones
+                    def events():
+                        stub.sleep(stub.behavior['first_token_latency'])
+                        for event in body.split(b"\n\n"):
+                            if event.strip():
+                                yield event + b"\n\n"
+                                stub.sleep(1 / stub.behavior['tokens_per_second'])
+                    self.send_chunks(entry['content_type'], events())
+                else:
+                    # Answer as slowly as the real API did
+                    stub.sleep(entry.get('seconds', 0))
+                    self.send_body(entry['status'], entry['content_type'], body)
+                return
+
+            if endpoint == 'audio/speech':
+                self.send_body(200, 'audio/mpeg', stub.speech(request))
+            elif request.get('stream'):
+                self.send_chunks('text/event-stream', stub.completion_chunks(request))
+            else:
+                self.send_body(200, 'application/json', json.dumps(stub.completion(request)).encode('utf-8'))
+
+        def log_message(self, format, *args):
+            # Keep the output of the load test readable
+            pass
+
+    return OpenAIHandler
+
+
+def start_stub_server(stub=None, port=0):
+    """
+    Starts the OpenAI stand-in in a background thread.
+
+    Args:
+    - stub (OpenAIStub, optional): The stand-in. Default generates responses with the default behavior.
+    - port (int, optional): The port to listen on. Default is 0 which picks a free port.
+
+    Returns:
+    - Tuple: A tuple containing (server, base URL). Call server.shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(stub or OpenAIStub()))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+# Main function to run the OpenAI stand-in
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the OpenAI API the assistant uses.")
+    parser.add_argument("--port", type=int, default=8766, help="Port to listen on")
+    parser.add_argument("--behavior", help="JSON file overriding the default latencies, token rate, tool calls and answers")
+    parser.add_argument("--cassette", help="Replay the responses recorded in this cassette")
+    parser.add_argument("--record", help="Proxy requests to the real API and record the responses into this cassette")
+    parser.add_argument("--upstream", default="https://api.openai.com/v1", help="The API requests are proxied to when recording")
+    args = parser.parse_args()
+
+    api_key = None
+    if args.record:
+        from assistant import api_key
+
+    stub = OpenAIStub(load_behavior(args.behavior), cassette=args.cassette, record=args.record, upstream=args.upstream, api_key=api_key)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(stub))
+    server.daemon_threads = True
+    print(f"OpenAI stand-in serving at http://127.0.0.1:{args.port}/v1 (set OPENAI_BASE_URL to use it)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from db import database
+from db.synthetic import create_synthetic_database
+
+# Default directory the synthetic catalogs and the results are written to
+DEFAULT_RESULTS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'bench_results')
+
+# The search functions the assistant calls
+SEARCH_FUNCTIONS = {
+    'search_products': database.search_products,
+    'search_products_with_discounts': database.search_products_with_discounts,
+    'search_new_releases': database.search_new_releases
+}
+
+# The value every filter is benchmarked with, in the shape the assistant passes it
+FILTER_VALUES = {
+    'name': 'air jordan 1',
+    'max_price': 150,
+    'colors': 'black',
+    'description': 'leather',
+    'category': 'high'
+}
+
+# The filter combinations every search function is benchmarked with
+FILTER_COMBINATIONS = [
+    (),
+    ('name',),
+    ('max_price',),
+    ('colors',),
+    ('description',),
+    ('category',),
+    ('name', 'max_price'),
+    ('colors', 'category'),
+    ('name', 'colors', 'max_price'),
+    ('name', 'max_price', 'colors', 'description', 'category')
+]
+
+
+def percentile(values, percent):
+    """
+    Returns a percentile of a list of values with the nearest-rank method.
+
+    Args:
+    - values (list of float): The values, they do not need to be sorted.
+    - percent (float): The percentile to return (e.g., 95).
+
+    Returns:
+    - float: The percentile.
+    """
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def get_git_commit():
+    """
+    Returns the commit the benchmark runs on.
+
+    Returns:
+    - str or None: The short hash of the commit, or None if it is not a git checkout.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def combination_key(function_name, combination):
+    """
+    Returns the key a filter combination is saved under in the results.
+
+    Args:
+    - function_name (str): The name of the search function.
+    - combination (tuple of str): The filters.
+
+    Returns:
+    - str: The key (e.g., "search_products[name+max_price]").
+    """
+    return f"{function_name}[{'+'.join(combination) or 'none'}]"
+
+
+def measure_latency(repeat, summary_threshold=None):
+    """
+    Measures the latency of every search function with every filter combination.
+
+    Args:
+    - repeat (int): How many times to run every combination.
+    - summary_threshold (int, optional): Summarize the matches like the assistant does once there are more than this. Default never summarizes.
+
+    Returns:
+    - dict: Maps the key of each combination to its latency percentiles in milliseconds and how many rows it returned.
+    """
+    results = {}
+    for function_name, function in SEARCH_FUNCTIONS.items():
+        for combination in FILTER_COMBINATIONS:
+            filters = {name: FILTER_VALUES[name] for name in combination}
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                response = function(**filters, summary_threshold=summary_threshold)
+                timings.append((time.perf_counter() - start) * 1000)
+            results[combination_key(function_name, combination)] = {
+                "p50_ms": round(percentile(timings, 50), 3),
+                "p95_ms": round(percentile(timings, 95), 3),
+                "p99_ms": round(percentile(timings, 99), 3),
+                "rows": len(json.loads(response)['products'])
+            }
+    return results
+
+
+def measure_throughput(readers, queries_per_reader, seed=0, summary_threshold=None):
+    """
+    Measures how many searches per second concurrent readers get through.
+
+    Every reader runs the same seeded mix of search functions and filter combinations.
+
+    Args:
+    - readers (int): How many threads search at the same time.
+    - queries_per_reader (int): How many searches every reader runs.
+    - seed (int, optional): Seed of the mix of searches. Default is 0.
+    - summary_threshold (int, optional): Summarize the matches once there are more than this. Default never summarizes.
+
+    Returns:
+    - dict: The number of readers, searches, seconds and searches per second.
+    """
+    rng = random.Random(seed)
+    queries = [(rng.choice(list(SEARCH_FUNCTIONS.values())), rng.choice(FILTER_COMBINATIONS)) for _ in range(queries_per_reader)]
+
+    def read():
+        for function, combination in queries:
+            function(**{name: FILTER_VALUES[name] for name in combination}, summary_threshold=summary_threshold)
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    return {
+        "readers": readers,
+        "queries": readers * queries_per_reader,
+        "seconds": round(seconds, 3),
+        "queries_per_second": round(readers * queries_per_reader / seconds, 1)
+    }
+
+
+def get_synthetic_catalog(rows, seed, results_dir):
+    """
+    Returns the path of the synthetic catalog of the given size, generating it the first time.
+
+    The same size and seed always generate the same catalog, so it is reused afterwards.
+
+    Args:
+    - rows (int): How many products the catalog has.
+    - seed (int): Seed of the synthetic catalog.
+    - results_dir (str): Directory the synthetic catalog is written to.
+
+    Returns:
+    - str: The path of the catalog.
+    """
+    path = os.path.join(results_dir, f'synthetic-{rows}-{seed}.db')
+    if not os.path.exists(path):
+        print(f"Generating {rows} products into {path}")
+        create_synthetic_database(path, rows, seed=seed)
+    return path
+
+
+def run_benchmark(rows, seed, results_dir, repeat, readers, queries_per_reader, summary_threshold=None):
+    """
+    Benchmarks the search functions on a synthetic catalog of the given size.
+
+    Run it with run_benchmark_process so the peak resident set size belongs to this catalog only.
+
+    Args:
+    - rows (int): How many products the catalog has.
+    - seed (int): Seed of the synthetic catalog.
+    - results_dir (str): Directory the synthetic catalog is written to.
+    - repeat (int): How many times to run every filter combination.
+    - readers (int): How many concurrent readers to measure the throughput with.
+    - queries_per_reader (int): How many searches every reader runs.
+    - summary_threshold (int, optional): Summarize the matches once there are more than this. Default never summarizes.
+
+    Returns:
+    - dict: The latency, throughput and memory results of the catalog.
+    """
+    path = get_synthetic_catalog(rows, seed, results_dir)
+    database.set_database_path(path)
+    
+    # Index the names like the scraper does after a scrape
+    database.build_name_index()
+
+    # Python allocations are traced during the latency run, SQLite's own memory shows up in the resident set size
+    tracemalloc.start()
+    latency = measure_latency(repeat, summary_threshold)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    throughput = measure_throughput(readers, queries_per_reader, seed=seed, summary_threshold=summary_threshold)
+    database.set_database_path(None)
+
+    return {
+        "rows": rows,
+        "database_bytes": os.path.getsize(path),
+        "latency": latency,
+        "throughput": throughput,
+        "memory": {
+            "python_peak_bytes": peak,
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        }
+    }
+
+
+def run_benchmark_process(*args):
+    """
+    Runs run_benchmark in a fresh process.
+
+    The peak resident set size only ever grows during a process, so measuring every catalog size in the
+    same process would report the peak of the largest catalog so far instead of the catalog itself.
+
+    Args:
+    - args: The arguments of run_benchmark.
+
+    Returns:
+    - dict: The results of run_benchmark.
+    """
+    # Generate the catalog here so generating it does not count towards the memory of the benchmark
+    get_synthetic_catalog(*args[:3])
+
+    # Spawn instead of fork so the new process does not start with the memory of this one
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_benchmark, *args).result()
+
+
+def compare_results(previous, current):
+    """
+    Prints how the latency and throughput changed compared to previous results.
+
+    Args:
+    - previous (dict): The previous results.
+    - current (dict): The current results.
+    """
+    print(f"\nCompared to {previous.get('commit') or 'previous run'}:")
+    previous_runs = {run['rows']: run for run in previous['runs']}
+    for run in current['runs']:
+        before = previous_runs.get(run['rows'])
+        if before is None:
+            continue
+        print(f"{run['rows']} rows:")
+        for key, latency in run['latency'].items():
+            if key in before['latency'] and before['latency'][key]['p95_ms']:
+                change = (latency['p95_ms'] - before['latency'][key]['p95_ms']) / before['latency'][key]['p95_ms'] * 100
+                print(f"  {key:<72} p95 {before['latency'][key]['p95_ms']:>9.3f} -> {latency['p95_ms']:>9.3f} ms ({change:+.1f}%)")
+        change = (run['throughput']['queries_per_second'] - before['throughput']['queries_per_second']) / before['throughput']['queries_per_second'] * 100
+        print(f"  {'throughput':<72} {before['throughput']['queries_per_second']:>9.1f} -> {run['throughput']['queries_per_second']:>9.1f} q/s ({change:+.1f}%)")
+
+
+# Main function to run the database benchmark
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the search functions on deterministic synthetic catalogs.")
+    parser.add_argument("--rows", type=int, nargs='+', default=[1000, 10000, 100000], help="Sizes of the synthetic catalogs")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic catalogs")
+    parser.add_argument("--results-dir", default=DEFAULT_RESULTS_DIR, help="Directory the synthetic catalogs and the results are written to")
+    parser.add_argument("--repeat", type=int, default=20, help="How many times to run every filter combination")
+    parser.add_argument("--readers", type=int, default=8, help="How many concurrent readers to measure the throughput with")
+    parser.add_argument("--queries-per-reader", type=int, default=50, help="How many searches every reader runs")
+    parser.add_argument("--summary-threshold", type=int, default=20, help="Summarize the matches once there are more than this, like the assistant does with its default limit (use -1 to never summarize)")
+    parser.add_argument("--output", help="Path of the results file. Default is database-<commit>.json in the results directory")
+    parser.add_argument("--compare", help="Path of previous results to compare against")
+    args = parser.parse_args()
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    commit = get_git_commit()
+    summary_threshold = args.summary_threshold if args.summary_threshold >= 0 else None
+    results = {"commit": commit, "created_at": time.time(), "seed": args.seed, "summary_threshold": summary_threshold, "runs": []}
+
+    for rows in args.rows:
+        run = run_benchmark_process(rows, args.seed, args.results_dir, args.repeat, args.readers, args.queries_per_reader, summary_threshold)
+        results["runs"].append(run)
+
+        print(f"\n{rows} rows ({run['database_bytes'] // 1024} KB):")
+        for key, latency in run['latency'].items():
+            print(f"  {key:<72} p50 {latency['p50_ms']:>9.3f}  p95 {latency['p95_ms']:>9.3f}  p99 {latency['p99_ms']:>9.3f} ms  ({latency['rows']} rows)")
+        print(f"  {run['throughput']['readers']} readers: {run['throughput']['queries_per_second']} queries per second")
+        print(f"  Python peak {run['memory']['python_peak_bytes'] // 1024} KB, max RSS {run['memory']['max_rss_kb']} KB")
+
+    output = args.output or os.path.join(args.results_dir, f"database-{commit or 'unknown'}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        try:
+            with open(args.compare, encoding='utf-8') as f:
+                compare_results(json.load(f), results)
+        except (OSError, ValueError) as e:
+            print(f"Error comparing results - Error: {str(e)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import sys
+import time
+from extraction import extract_product_details, get_default_parser
+from response_store import ResponseStore
+
+# Default directory holding the saved product pages
+DEFAULT_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'pages')
+
+
+def load_fixtures(fixtures_dir):
+    """
+    Loads the saved product pages from the fixtures directory.
+
+    Every "<name>.html" file is a saved product page. If a "<name>.expected.json" file sits next to it,
+    it holds the details the page is expected to produce.
+
+    Args:
+    - fixtures_dir (str): The directory holding the saved pages.
+
+    Returns:
+    - list of tuples: Each tuple contains (name, html, expected details or None).
+    """
+    fixtures = []
+    for file_name in sorted(os.listdir(fixtures_dir)):
+        if not file_name.endswith('.html'):
+            continue
+
+        # Read the saved page
+        name = file_name[:-len('.html')]
+        with open(os.path.join(fixtures_dir, file_name), encoding='utf-8') as f:
+            html = f.read()
+
+        # Read the expected details if they exist
+        expected = None
+        expected_path = os.path.join(fixtures_dir, f'{name}.expected.json')
+        if os.path.exists(expected_path):
+            with open(expected_path, encoding='utf-8') as f:
+                expected = json.load(f)
+
+        fixtures.append((name, html, expected))
+    return fixtures
+
+
+def load_store_fixtures(store_dir):
+    """
+    Loads the product pages recorded in a response store.
+
+    Listing pages and feed pages are skipped, recorded pages have no expected details.
+
+    Args:
+    - store_dir (str): The directory of the response store.
+
+    Returns:
+    - list of tuples: Each tuple contains (url, html, None).
+    """
+    fixtures = []
+    for url, content in ResponseStore(store_dir, track_usage=False).items():
+        # Feed pages are JSON and listing pages live under /w/
+        if content.lstrip().startswith('<') and '/w/' not in url:
+            fixtures.append((url, content, None))
+    return fixtures
+
+
+def save_fixtures(fixtures, fixtures_dir):
+    """
+    Saves recorded product pages as fixtures, with the details BeautifulSoup extracts from them as the expected details.
+
+    Review the expected details before committing them, they become the reference every backend is checked against.
+
+    Args:
+    - fixtures (list of tuples): The fixtures returned by load_store_fixtures.
+    - fixtures_dir (str): The directory to save the pages to.
+
+    Returns:
+    - int: How many pages were saved.
+    """
+    os.makedirs(fixtures_dir, exist_ok=True)
+    for url, html, _ in fixtures:
+        # Name the page after the last parts of its URL (e.g., "air-jordan-6-retro-mens-shoes-Wk71GJ-CT8529-112")
+        name = '-'.join(url.rstrip('/').split('/')[-2:])
+        with open(os.path.join(fixtures_dir, f'{name}.html'), 'w', encoding='utf-8') as f:
+            f.write(html)
+        with open(os.path.join(fixtures_dir, f'{name}.expected.json'), 'w', encoding='utf-8') as f:
+            json.dump(extract_product_details(html, use_next_data=False, parser='bs4'), f, indent=2)
+    return len(fixtures)
+
+
+def time_backend(fixtures, repeat, **kwargs):
+    """
+    Times how long it takes to extract the details of every fixture with the given options.
+
+    Args:
+    - fixtures (list of tuples): The fixtures returned by load_fixtures.
+    - repeat (int): How many times to go over all of the fixtures.
+    - kwargs: Options passed to extract_product_details.
+
+    Returns:
+    - float: The average time per page in milliseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, html, _ in fixtures:
+            extract_product_details(html, **kwargs)
+    elapsed = time.perf_counter() - start
+    return elapsed * 1000 / (repeat * len(fixtures))
+
+
+def check_fixtures(fixtures):
+    """
+    Checks that every backend extracts the same details from each fixture, and that they match
+    the expected details when the fixture has them.
+
+    Args:
+    - fixtures (list of tuples): The fixtures returned by load_fixtures.
+
+    Returns:
+    - list of str: A message for every mismatch found.
+    """
+    errors = []
+    for name, html, expected in fixtures:
+        # The HTML parsers are compared against BeautifulSoup which was the original parser
+        reference = extract_product_details(html, use_next_data=False, parser='bs4')
+        if get_default_parser() == 'lxml':
+            fast = extract_product_details(html, use_next_data=False, parser='lxml')
+            if fast != reference:
+                errors.append(f'{name}: lxml extracted {fast} but bs4 extracted {reference}')
+
+        # The default path (embedded JSON first) must match the expected details
+        if expected is not None:
+            details = extract_product_details(html)
+            if details != expected:
+                errors.append(f'{name}: extracted {details} but expected {expected}')
+    return errors
+
+
+# Main function to run the benchmark
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and check the product page extraction on saved pages.")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES_DIR, help="Directory holding the saved product pages")
+    parser.add_argument("--store", help="Use the product pages recorded in this response store instead of the fixtures")
+    parser.add_argument("--repeat", type=int, default=20, help="How many times to go over the saved pages")
+    parser.add_argument("--save", action="store_true", help="Save the product pages recorded in --store into --fixtures with their expected details, then exit")
+    args = parser.parse_args()
+
+    if args.save:
+        if not args.store:
+            parser.error("--save needs --store")
+        print(f"Saved {save_fixtures(load_store_fixtures(args.store), args.fixtures)} pages into {args.fixtures}")
+        return
+
+    fixtures = load_store_fixtures(args.store) if args.store else load_fixtures(args.fixtures)
+    if not fixtures:
+        print(f"No saved pages found in {args.store or args.fixtures}")
+        sys.exit(1)
+
+    # Check the extraction first, a fast parser that extracts the wrong details is useless
+    errors = check_fixtures(fixtures)
+    for error in errors:
+        print(error)
+
+    # Time each backend
+    print(f"Benchmarking {len(fixtures)} pages, {args.repeat} times each")
+    print(f"bs4:       {time_backend(fixtures, args.repeat, use_next_data=False, parser='bs4'):.2f} ms/page")
+    if get_default_parser() == 'lxml':
+        print(f"lxml:      {time_backend(fixtures, args.repeat, use_next_data=False, parser='lxml'):.2f} ms/page")
+    print(f"default:   {time_backend(fixtures, args.repeat):.2f} ms/page")
+
+    # Fail if the extraction does not match so this can be used as a regression check
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
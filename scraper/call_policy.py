@@ -0,0 +1,372 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+import httpx
+from openai import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+
+# Errors that are worth retrying, the rest fail straight away
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError, httpx.TransportError)
+
+
+class CallPolicyError(Exception):
+    """
+    Raised when the policy gives up on a call without the API answering it.
+    """
+
+
+class DeadlineExceeded(CallPolicyError):
+    """
+    Raised when the deadline of the turn ran out before the call succeeded.
+    """
+
+
+class CircuitOpenError(CallPolicyError):
+    """
+    Raised straight away while the circuit breaker is open.
+    """
+
+
+# Every error a caller should answer with a degraded response
+CALL_FAILURES = RETRYABLE_ERRORS + (CallPolicyError,)
+
+# Errors that mean the upstream itself is failing (transport errors and 5xx), the only ones the circuit breaker counts
+# outside of the retries of a call (e.g., a stream that breaks after the call succeeded)
+UPSTREAM_FAILURES = (APIConnectionError, InternalServerError, httpx.TransportError)
+
+
+def retry_delay(error, attempt, base_delay=0.5, max_delay=8):
+    """
+    Returns how long to wait before retrying a failed call.
+
+    Uses the Retry-After header when the API sends one, otherwise backs off exponentially with full jitter
+    so concurrent callers do not retry in lockstep.
+
+    Args:
+    - error (Exception): The error the call failed with.
+    - attempt (int): How many times the call was tried already.
+    - base_delay (float, optional): The wait before the first retry. Default is 0.5.
+    - max_delay (float, optional): The longest wait. Default is 8.
+
+    Returns:
+    - float: How many seconds to wait.
+    """
+    response = getattr(error, 'response', None)
+    if response is not None:
+        header = response.headers.get('retry-after')
+        try:
+            return min(max_delay, float(header))
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def answer_key(question, history=(), session_id=None):
+    """
+    Returns the key an answer is cached under.
+
+    An answer depends on the conversation it was given in, so the key holds a digest of the history before
+    the question. Follow-up questions are also keyed by their session, only the first question of a conversation
+    (whose history is the system prompt alone) can be answered from another session.
+
+    Args:
+    - question (str): The user message.
+    - history (list of dict, optional): The messages before the user message.
+    - session_id (str, optional): The session of the conversation.
+
+    Returns:
+    - str: The key.
+    """
+    context = [[message.get('role'), message.get('content')] for message in history
+               if isinstance(message, dict) and message.get('role') in ('system', 'user', 'assistant') and isinstance(message.get('content'), str)]
+    if any(role != 'system' for role, _ in context):
+        context.append(['session', session_id])
+    digest = hashlib.sha256(json.dumps(context).encode('utf-8')).hexdigest()
+    return f"{digest}:{question.strip().lower()}"
+
+
+class Deadline:
+    """
+    The time a unit of work (a conversation turn or an image) has left.
+    """
+    def __init__(self, seconds=None):
+        # When the deadline runs out, or None if there is no deadline
+        self.expires = time.monotonic() + seconds if seconds is not None else None
+
+    def remaining(self):
+        """
+        Returns how many seconds are left.
+
+        Returns:
+        - float or None: The seconds left, or None if there is no deadline.
+        """
+        if self.expires is None:
+            return None
+        return self.expires - time.monotonic()
+
+    def expired(self):
+        """
+        Returns whether the deadline ran out.
+
+        Returns:
+        - bool: True if no time is left.
+        """
+        return self.expires is not None and time.monotonic() >= self.expires
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing.
+
+    After failure_threshold failures in a row the circuit opens and every call fails fast. Once
+    reset_timeout seconds passed a single probe call is let through, and its result closes or reopens the circuit.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        # "closed", "open" or "half_open"
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self.lock = threading.Lock()
+
+        # Thread running the probe call while the circuit is half open
+        self.probe_thread = None
+
+    def allow(self):
+        """
+        Returns whether a call can go through.
+
+        Returns:
+        - bool: True if the call can go through.
+        """
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let one probe call through
+                self.state = 'half_open'
+                self.probe_thread = threading.get_ident()
+                return True
+            return False
+
+    def release_probe(self):
+        """
+        Gives up the probe of the calling thread when its call ended without the upstream answering or failing
+        (e.g., the turn ran out of time first), so the next call can probe instead.
+        """
+        with self.lock:
+            if self.state == 'half_open' and self.probe_thread == threading.get_ident():
+                self.state = 'open'
+                self.probe_thread = None
+
+    def record_success(self):
+        """
+        Records that the upstream answered, closing the circuit.
+        """
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.probe_thread = None
+
+    def record_failure(self):
+        """
+        Records that the upstream failed, opening the circuit if it failed too often or the probe failed.
+        """
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.probe_thread = None
+
+
+class CallPolicy:
+    """
+    Runs OpenAI calls with a deadline, jittered retries on retryable errors, optional hedging and a circuit breaker.
+
+    One policy is shared by every assistant of a process so they share the circuit breaker, the
+    latency history hedging is based on, and the cache of answers used while the upstream is down.
+    """
+    def __init__(self, turn_deadline=60, max_retries=3, base_delay=0.5, max_delay=8, hedge=False,
+                 hedge_min_samples=20, breaker=None, cache_size=256):
+        # How many seconds a turn can take in total
+        self.turn_deadline = turn_deadline
+
+        # How often and how long to retry retryable errors
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        # Whether hedgeable calls send a duplicate request once they are slower than their p95,
+        # and how many latencies are needed before the p95 is trusted
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = deque(maxlen=200)
+        self.hedges = 0
+        self.executor = ThreadPoolExecutor(max_workers=16) if hedge else None
+
+        # Circuit breaker shared by every call of the policy
+        self.breaker = breaker or CircuitBreaker()
+
+        # Recent answers by question and conversation, used while the upstream is down
+        self.cache_size = cache_size
+        self.answers = OrderedDict()
+        self.lock = threading.Lock()
+
+    def deadline(self):
+        """
+        Starts the deadline of a turn.
+
+        Returns:
+        - Deadline: The deadline.
+        """
+        return Deadline(self.turn_deadline)
+
+    def hedge_threshold(self):
+        """
+        Returns how long a hedgeable call can take before a duplicate request is sent.
+
+        Returns:
+        - float or None: The p95 latency of the recent calls, or None if there are not enough of them.
+        """
+        with self.lock:
+            if len(self.latencies) < self.hedge_min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def call_hedged(self, function, kwargs):
+        """
+        Runs a call, sending a duplicate request if it takes longer than its p95 and returning whichever answers first.
+
+        Args:
+        - function (callable): The API call.
+        - kwargs (dict): The arguments of the call.
+
+        Returns:
+        - object: The response of the first request that succeeded.
+        """
+        start = time.perf_counter()
+        threshold = self.hedge_threshold()
+        if threshold is None:
+            result = function(**kwargs)
+        else:
+            futures = [self.executor.submit(function, **kwargs)]
+            done, _ = wait(futures, timeout=threshold)
+            if not done:
+                with self.lock:
+                    self.hedges += 1
+                futures.append(self.executor.submit(function, **kwargs))
+
+            # Use the first request that succeeds, fail only if every request failed
+            error = None
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                    break
+                except Exception as e:
+                    error = e
+            else:
+                raise error
+
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+        return result
+
+    def call(self, function, deadline=None, hedgeable=False, **kwargs):
+        """
+        Runs an API call under the policy.
+
+        Args:
+        - function (callable): The API call (e.g., client.chat.completions.create).
+        - deadline (Deadline, optional): The deadline of the turn, its remaining time is the timeout of every attempt.
+        - hedgeable (bool, optional): Whether the call can be hedged when the policy hedges. Default is False.
+        - kwargs: The arguments of the call.
+
+        Returns:
+        - object: The response of the call.
+
+        Raises:
+        - CircuitOpenError: If the circuit breaker is open.
+        - DeadlineExceeded: If the deadline ran out before the call succeeded.
+        - Exception: The last retryable error once the retries ran out, or any error that is not retryable.
+        """
+        # Check the deadline first, a call that cannot run should not take the probe of a half-open circuit
+        if deadline and deadline.expired():
+            raise DeadlineExceeded("The turn ran out of time")
+        if not self.breaker.allow():
+            raise CircuitOpenError("The OpenAI API is failing, skipping the call")
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                # Every attempt only gets the time the turn has left
+                remaining = deadline.remaining() if deadline else None
+                if remaining is not None:
+                    if remaining <= 0:
+                        raise DeadlineExceeded("The turn ran out of time")
+                    kwargs['timeout'] = remaining
+
+                try:
+                    if hedgeable and self.hedge:
+                        result = self.call_hedged(function, kwargs)
+                    else:
+                        result = function(**kwargs)
+                except RETRYABLE_ERRORS as e:
+                    if attempt == self.max_retries:
+                        self.breaker.record_failure()
+                        raise
+
+                    # Give up early if the wait would not leave time for another attempt
+                    wait_seconds = retry_delay(e, attempt, self.base_delay, self.max_delay)
+                    if deadline and deadline.remaining() is not None and wait_seconds >= deadline.remaining():
+                        self.breaker.record_failure()
+                        raise DeadlineExceeded("The turn ran out of time") from e
+                    time.sleep(wait_seconds)
+                    continue
+                except Exception:
+                    # The request itself was wrong (e.g., a 400), which says nothing about the health of the upstream,
+                    # so it is not an outcome and must not close a half-open circuit
+                    raise
+
+                self.breaker.record_success()
+                return result
+        finally:
+            # Every path above records the outcome except running out of time between attempts, errors that are
+            # not retryable (or being interrupted), which must not leave the circuit half open forever
+            self.breaker.release_probe()
+
+    def cache_answer(self, key, answer):
+        """
+        Remembers the answer to a question so it can be served while the upstream is down.
+
+        Args:
+        - key (str): The key of the question in its conversation, see answer_key.
+        - answer (str): The answer.
+        """
+        with self.lock:
+            self.answers[key] = answer
+            self.answers.move_to_end(key)
+            while len(self.answers) > self.cache_size:
+                self.answers.popitem(last=False)
+
+    def cached_answer(self, key):
+        """
+        Returns the remembered answer to a question.
+
+        Args:
+        - key (str): The key of the question in its conversation, see answer_key.
+
+        Returns:
+        - str or None: The answer, or None if the question was not answered before.
+        """
+        with self.lock:
+            return self.answers.get(key)
+
+
+# Policy shared by every assistant that is not given one
+default_policy = CallPolicy()
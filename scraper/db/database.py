@@ -1,22 +1,245 @@
 import os
+import re
+import shutil
 import sqlite3
 import math
 import json
+import time
 from typing import List, Optional, Tuple
+from .semantic_index import SemanticIndex, VECTORS_SUFFIX, LOCK_SUFFIX, tokenize
+
+# Path of the database to use instead of the published catalog, set with set_database_path
+database_path = None
+
+# Directory of this script, the catalog generations are published into its catalogs folder
+DB_DIR = os.path.dirname(os.path.realpath(__file__))
+CATALOGS_DIR = os.path.join(DB_DIR, 'catalogs')
+
+# File holding the name of the generation readers use, swapped atomically on publish
+CURRENT_POINTER = os.path.join(CATALOGS_DIR, 'CURRENT')
+
+# The generation readers last resolved, refreshed when the pointer file changes
+current_catalog = {"version": None, "path": None}
+
+# The largest share of products without a type a catalog is published with, unless overridden
+MAX_UNTYPED_SHARE = 0.05
+
+# Files stored next to a catalog that move and get removed with it
+CATALOG_SIDECARS = (VECTORS_SUFFIX, LOCK_SUFFIX)
+
+# The semantic index of every catalog searched, with the version it was loaded at
+semantic_indexes = {}
+
+def set_database_path(path):
+    """
+    Points every function of this module at another database file, for example a synthetic catalog.
+    
+    Args:
+    - path (str or None): Path of the database file, or None to use database.db again.
+    """
+    global database_path
+    database_path = path
+
+def get_published_path():
+    """
+    Returns the path of the catalog generation readers should use.
+    
+    The pointer file is checked on every call, so serving processes switch to a newly published
+    generation with their next query while the queries already running finish on the previous one.
+    
+    Returns:
+    - str: The path of the current generation, or of database.db if no generation was published yet.
+    """
+    try:
+        stat = os.stat(CURRENT_POINTER)
+    except FileNotFoundError:
+        return os.path.join(DB_DIR, 'database.db')
+    
+    # The pointer is replaced on every publish, so a new inode or mtime means a new generation
+    version = (stat.st_ino, stat.st_mtime_ns)
+    if version != current_catalog['version']:
+        with open(CURRENT_POINTER, encoding='utf-8') as f:
+            name = f.read().strip()
+        current_catalog.update(version=version, path=os.path.join(CATALOGS_DIR, name))
+    return current_catalog['path']
+
+def get_database_file():
+    """
+    Returns the path of the database this module uses.
+    
+    Returns:
+    - str: The database that was set explicitly if there is one (e.g., the staging catalog of the scraper), otherwise the published catalog.
+    """
+    return database_path or get_published_path()
 
 def get_connection():
     """
     Establishes a connection to the Database
     """
-    # Get the current directory of this script
-    current_dir = os.path.dirname(os.path.realpath(__file__))
+    return sqlite3.connect(get_database_file())
+
+def list_catalog_generations():
+    """
+    Lists the published catalog generations, oldest first.
+    
+    Returns:
+    - list of str: The file names of the generations (e.g., "catalog-0003.db").
+    """
+    if not os.path.isdir(CATALOGS_DIR):
+        return []
+    return sorted(name for name in os.listdir(CATALOGS_DIR) if name.startswith('catalog-') and name.endswith('.db'))
+
+def write_catalog_pointer(name):
+    """
+    Points readers at a catalog generation, replacing the pointer file atomically.
+    
+    Args:
+    - name (str): The file name of the generation.
+    """
+    temp_path = CURRENT_POINTER + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, CURRENT_POINTER)
+
+def create_staging_database():
+    """
+    Creates an empty staging catalog next to the published ones and points this module at it.
     
-    # Construct the path to the database file
-    # Rename database.db to something else if you would like rescrape with new DB
-    db_path = os.path.join(current_dir, 'database.db')
+    The scraper and the image processing write into the staging catalog while readers keep using the
+    published one. The image classification and feature caches are carried over so known images are not classified again,
+    the name aliases so aliases added to the published catalog are kept, and the semantic index.
+    
+    Returns:
+    - str: The path of the staging catalog.
+    """
+    os.makedirs(CATALOGS_DIR, exist_ok=True)
+    published_path = get_published_path()
+    staging_path = os.path.join(CATALOGS_DIR, f"staging-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.db")
     
-    # Connect to the SQLite database
-    return sqlite3.connect(db_path)
+    # Create the tables in the staging catalog
+    set_database_path(staging_path)
+    create_products_table()
+    create_classifications_table()
+    create_image_features_table()
+    
+    # Carry over the classification cache of the published catalog
+    if os.path.exists(published_path):
+        with get_connection() as conn:
+            conn.execute('ATTACH DATABASE ? AS published', (published_path,))
+            tables = conn.execute("SELECT name FROM published.sqlite_master WHERE type = 'table' AND name = 'image_classifications'").fetchall()
+            if tables:
+                conn.execute('INSERT OR IGNORE INTO image_classifications SELECT image_hash, image_url, type FROM published.image_classifications')
+            
+            # Carry over the image features so the local classifier does not download the images again
+            tables = conn.execute("SELECT name FROM published.sqlite_master WHERE type = 'table' AND name = 'image_features'").fetchall()
+            if tables:
+                conn.execute('INSERT OR IGNORE INTO image_features SELECT image_hash, image_url, vector, perceptual_hash FROM published.image_features')
+            
+            # Carry over the aliases that were added to the published catalog
+            tables = conn.execute("SELECT name FROM published.sqlite_master WHERE type = 'table' AND name = 'name_aliases'").fetchall()
+            if tables:
+                conn.execute('CREATE TABLE IF NOT EXISTS name_aliases (alias TEXT PRIMARY KEY, name TEXT)')
+                conn.execute('INSERT OR IGNORE INTO name_aliases SELECT alias, name FROM published.name_aliases')
+            conn.commit()
+            conn.execute('DETACH DATABASE published')
+        
+        # Carry over the semantic index, only the products that changed are embedded again
+        for suffix in CATALOG_SIDECARS:
+            if os.path.exists(published_path + suffix):
+                shutil.copyfile(published_path + suffix, staging_path + suffix)
+    
+    return staging_path
+
+def carry_over_types():
+    """
+    Copies the types of the published catalog into the products of the staging catalog that have none,
+    for runs that cannot classify every product (e.g., replaying recorded pages without the vision API).
+    
+    Returns:
+    - int: How many products got their type from the published catalog.
+    """
+    published_path = get_published_path()
+    if not database_path or database_path == published_path or not os.path.exists(published_path):
+        return 0
+    
+    with get_connection() as conn:
+        conn.execute('ATTACH DATABASE ? AS published', (published_path,))
+        cur = conn.execute("""
+            UPDATE products SET type = (SELECT p.type FROM published.products p WHERE p.id = products.id)
+            WHERE type IS NULL AND id IN (SELECT id FROM published.products WHERE type IS NOT NULL)
+        """)
+        conn.commit()
+        conn.execute('DETACH DATABASE published')
+    return cur.rowcount
+
+def publish_staging_database(staging_path, keep=2, max_untyped_share=MAX_UNTYPED_SHARE):
+    """
+    Publishes a staging catalog as the next generation, so readers switch to it with their next query.
+    
+    The staging catalog is checked, renamed to a versioned file name and the pointer is swapped atomically.
+    The previous generations are kept for rollback, older ones are removed.
+    
+    Args:
+    - staging_path (str): The path of the staging catalog.
+    - keep (int, optional): How many generations to keep, the new one included. Default is 2.
+    - max_untyped_share (float, optional): The largest share of products without a type that can be published. Default is MAX_UNTYPED_SHARE.
+    
+    Returns:
+    - str: The file name of the published generation.
+    """
+    # Never publish a broken, empty or half-classified catalog
+    with sqlite3.connect(staging_path) as conn:
+        integrity = conn.execute('PRAGMA integrity_check').fetchone()[0]
+        count = conn.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+        untyped = conn.execute('SELECT COUNT(*) FROM products WHERE type IS NULL').fetchone()[0]
+    if integrity != 'ok' or count == 0:
+        raise ValueError(f"Staging catalog {staging_path} is not publishable (integrity: {integrity}, products: {count})")
+    if untyped > count * max_untyped_share:
+        raise ValueError(f"Staging catalog {staging_path} is not publishable ({untyped} of {count} products have no type)")
+    
+    # Rename the staging catalog to the next generation and swap the pointer
+    generations = list_catalog_generations()
+    number = int(generations[-1][len('catalog-'):-len('.db')]) + 1 if generations else 1
+    name = f'catalog-{number:04d}.db'
+    for suffix in CATALOG_SIDECARS:
+        if os.path.exists(staging_path + suffix):
+            os.replace(staging_path + suffix, os.path.join(CATALOGS_DIR, name + suffix))
+    os.replace(staging_path, os.path.join(CATALOGS_DIR, name))
+    write_catalog_pointer(name)
+    
+    # Stop writing into the staging catalog
+    if database_path == staging_path:
+        set_database_path(None)
+    
+    # Remove the oldest generations, readers still using them keep their open files
+    for old_name in list_catalog_generations()[:-keep]:
+        try:
+            for suffix in CATALOG_SIDECARS:
+                if os.path.exists(os.path.join(CATALOGS_DIR, old_name + suffix)):
+                    os.remove(os.path.join(CATALOGS_DIR, old_name + suffix))
+            os.remove(os.path.join(CATALOGS_DIR, old_name))
+        except OSError as e:
+            print(f'Error removing catalog generation {old_name} - Error: {str(e)}')
+    
+    return name
+
+def rollback_catalog():
+    """
+    Points readers back at the generation published before the current one.
+    
+    Returns:
+    - str: The file name of the generation readers use now.
+    """
+    generations = list_catalog_generations()
+    current = os.path.basename(get_published_path())
+    if current not in generations or generations.index(current) == 0:
+        raise ValueError("There is no previous catalog generation to roll back to")
+    
+    previous = generations[generations.index(current) - 1]
+    write_catalog_pointer(previous)
+    return previous
 
 def create_products_table():
     """
@@ -94,39 +317,226 @@ def insert_product(id, name, promotion_status, price, colors, url, image_src, de
         ))
         conn.commit()
     
-def search_products(
-        name: Optional[str] = None, 
-        max_price: Optional[float] = None, 
-        colors: Optional[List[str]] = None, 
+# Shorthand users write for product names, the catalog can add its own in the name_aliases table
+DEFAULT_NAME_ALIASES = {
+    **{f"aj{number}": f"air jordan {number}" for number in range(1, 41)},
+    "aj": "air jordan",
+    "jordon": "jordan",
+    "jordans": "jordan",
+    "jumpman": "jordan",
+    "hi": "high",
+    "lo": "low"
+}
+
+# Default aliases earlier catalogs were built with that turned out wrong, removed when the name index is rebuilt
+# ("chicago" is a colorway of many models, not a model, and is found in the names as it is)
+RETIRED_NAME_ALIASES = {
+    "chicago": "air jordan 1 retro high og"
+}
+
+# How similar a name has to be to be a fuzzy match, and how many fuzzy matches are used
+# Matches also have to be nearly as similar as the best one, so "air jordn 1 mid" does not pull in the lows
+NAME_MATCH_THRESHOLD = 0.4
+NAME_MATCH_RELATIVE = 0.8
+NAME_MATCH_LIMIT = 5
+
+def name_trigrams(text):
+    """
+    Splits a name into its character trigrams, padding every word so short words and word starts count.
+
+    Args:
+    - text (str): The name.
+
+    Returns:
+    - set of str: The trigrams (e.g., "aj1" gives "  a", " aj", "aj1", "j1 ").
+    """
+    trigrams = set()
+    for word in re.findall(r'[a-z0-9]+', text.lower()):
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+def build_name_index():
+    """
+    Builds the fuzzy name index of the catalog from the names of its products.
+
+    Every distinct name is split into trigrams so misspelled names can be matched by the trigrams they share.
+    The alias table is created with the default aliases, aliases already in it are kept.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('CREATE TABLE IF NOT EXISTS name_aliases (alias TEXT PRIMARY KEY, name TEXT)')
+        cur.executemany('DELETE FROM name_aliases WHERE alias = ? AND name = ?', RETIRED_NAME_ALIASES.items())
+        cur.executemany('INSERT OR IGNORE INTO name_aliases (alias, name) VALUES (?, ?)', DEFAULT_NAME_ALIASES.items())
+
+        # Rebuild the trigrams from scratch, the names change with every scrape
+        cur.execute('DROP TABLE IF EXISTS name_trigrams')
+        cur.execute('DROP TABLE IF EXISTS name_index')
+        cur.execute('CREATE TABLE name_index (name TEXT PRIMARY KEY, trigrams INTEGER)')
+        cur.execute('CREATE TABLE name_trigrams (trigram TEXT, name TEXT)')
+
+        names = [row[0] for row in cur.execute('SELECT DISTINCT name FROM products WHERE name IS NOT NULL').fetchall()]
+        for name in names:
+            trigrams = name_trigrams(name)
+            cur.execute('INSERT INTO name_index (name, trigrams) VALUES (?, ?)', (name, len(trigrams)))
+            cur.executemany('INSERT INTO name_trigrams (trigram, name) VALUES (?, ?)', [(trigram, name) for trigram in trigrams])
+        cur.execute('CREATE INDEX idx_name_trigrams ON name_trigrams (trigram)')
+        conn.commit()
+
+def expand_name_aliases(cur, name):
+    """
+    Replaces the shorthand in a name with what it stands for (e.g., "aj1 lo" with "air jordan 1 low").
+
+    Args:
+    - cur (sqlite3.Cursor): Cursor of the open connection.
+    - name (str): The name the user searched for.
+
+    Returns:
+    - str: The name with its aliases expanded, in lowercase.
+    """
+    try:
+        aliases = dict(cur.execute('SELECT alias, name FROM name_aliases').fetchall())
+    except sqlite3.OperationalError:
+        # The catalog was built before the name index
+        aliases = DEFAULT_NAME_ALIASES
+
+    words = []
+    # How many of the last words come from expanded aliases
+    expanded_words = 0
+    for word in re.findall(r'[a-z0-9]+', name.lower()):
+        if word not in aliases:
+            words.append(word)
+            expanded_words = 0
+            continue
+
+        # Skip the start of the expansion the alias before it already expanded into (e.g., "aj jordans"),
+        # the words the user typed are always kept
+        expanded = aliases[word].split()
+        overlap = max((size for size in range(1, min(len(expanded), expanded_words) + 1) if words[-size:] == expanded[:size]), default=0)
+        words.extend(expanded[overlap:])
+        expanded_words += len(expanded) - overlap
+    return " ".join(words)
+
+def match_names(cur, name, limit=NAME_MATCH_LIMIT, threshold=NAME_MATCH_THRESHOLD):
+    """
+    Finds the product names most similar to a name by the trigrams they share.
+
+    The numbers in a name are model numbers, so only names that have every number of it are compared
+    (e.g., "air jordan 11" never matches "air jordan 1 low" however many trigrams they share).
+
+    Args:
+    - cur (sqlite3.Cursor): Cursor of the open connection.
+    - name (str): The name to match.
+    - limit (int, optional): How many names to return. Default is NAME_MATCH_LIMIT.
+    - threshold (float, optional): The lowest similarity (shared trigrams over all trigrams of both names) to return. Default is NAME_MATCH_THRESHOLD.
+      Names less than NAME_MATCH_RELATIVE as similar as the best match are not returned either.
+
+    Returns:
+    - list of str: The matching names, most similar first.
+    """
+    trigrams = name_trigrams(name)
+    if not trigrams:
+        return []
+    numbers = set(re.findall(r'[0-9]+', name))
+
+    try:
+        # Count the trigrams every indexed name shares with the name
+        cur.execute(f"""
+            SELECT t.name, COUNT(*), i.trigrams FROM name_trigrams t JOIN name_index i ON i.name = t.name
+            WHERE t.trigram IN ({", ".join("?" for _ in trigrams)}) GROUP BY t.name
+        """, list(trigrams))
+        candidates = cur.fetchall()
+    except sqlite3.OperationalError:
+        # The catalog was built before the name index, compare every name instead
+        names = [row[0] for row in cur.execute('SELECT DISTINCT name FROM products WHERE name IS NOT NULL').fetchall()]
+        candidates = []
+        for candidate in names:
+            candidate_trigrams = name_trigrams(candidate)
+            candidates.append((candidate, len(trigrams & candidate_trigrams), len(candidate_trigrams)))
+
+    scored = []
+    for candidate, shared, count in candidates:
+        if not numbers <= set(re.findall(r'[0-9]+', candidate)):
+            continue
+        similarity = shared / (len(trigrams) + count - shared)
+        if similarity >= threshold:
+            scored.append((similarity, candidate))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [candidate for similarity, candidate in scored[:limit] if similarity >= scored[0][0] * NAME_MATCH_RELATIVE]
+
+# The condition every search tool starts from
+SEARCH_CONDITIONS = {
+    "search_products": "1=1",
+    "search_products_with_discounts": "discount IS NOT NULL",
+    "search_new_releases": "promotion_status IN ('Just In', 'Coming Soon')"
+}
+
+# How many products a summarized result still lists
+SUMMARY_ROWS = 5
+
+# The product name with a space at both ends, so a name at its start or end is still between two non-word characters
+PADDED_NAME_SQL = "(' ' || name || ' ')"
+
+def name_patterns(name: str) -> Tuple[str, str]:
+    """
+    Returns the patterns that find a name as whole words of the product names
+    (e.g., "air jordan 1" finds "air jordan 1 low" but not "air jordan 11").
+
+    Every character of the name that is not a letter or a digit matches any such character, so 'og "latte"',
+    "2/3" or "high '85" need no exact punctuation. The LIKE pattern is cheap and skips most products,
+    the GLOB pattern then checks that the name is not part of a longer word or number.
+
+    Args:
+    - name (str): The name to search for.
+
+    Returns:
+    - Tuple: A tuple containing (LIKE pattern for the name, GLOB pattern for PADDED_NAME_SQL).
+    """
+    name = name.lower().strip()
+    return f"%{re.sub(r'[^a-z0-9]', '_', name)}%", f"*[^a-z0-9]{re.sub(r'[^a-z0-9]', '[^a-z0-9]', name)}[^a-z0-9]*"
+
+def build_filters(
+        name: Optional[str] = None,
+        max_price: Optional[float] = None,
+        colors: Optional[List[str]] = None,
         description: Optional[str] = None,
         category: Optional[str] = None,
-        limit: int = 20
-    ) -> List[Tuple]:
+        names: Optional[List[str]] = None
+    ) -> Tuple[str, List]:
     """
-    Searches for products in the database based on the given criteria.
+    Builds the WHERE conditions shared by the search functions.
 
     Args:
-    - name (str, optional): Name of the product to search for.
+    - name (str, optional): Name of the product to search for, matched on whole words.
     - max_price (float, optional): Maximum price of the product.
-    - colors (list of str, optional): List of colors to search for.
+    - colors (list of str or str, optional): List of colors to search for, or one string of comma separated colors.
     - description (str, optional): Description text to search for.
     - category (str, optional): Category of the product (low, mid, high, basketball, slides).
-    - limit (int, optional): Limit of how many results we should return.
+    - names (list of str, optional): Exact product names to search for instead of name (e.g., the fuzzy matches of name).
 
     Returns:
-    - list of tuples: A list of tuples representing the products that match the search criteria.
+    - Tuple: A tuple containing (conditions starting with " AND", parameters).
     """
-    query = "SELECT name, price, colors, discount, description FROM products WHERE 1=1"
+    query = ""
     params = []
+    whole_words = None
 
-    if name:
+    if names:
+        query += " AND name IN (" + ", ".join("?" for _ in names) + ")"
+        params.extend(names)
+    elif name:
         query += " AND name LIKE ?"
-        params.append(f"%{name.lower()}%")
+        pattern, whole_words = name_patterns(name)
+        params.append(pattern)
 
     if max_price is not None:
         query += " AND CAST(SUBSTR(price, 2) AS FLOAT) <= ?"
         params.append(max_price)
 
+    # The assistant passes the colors as one string (e.g., "black, red")
+    if isinstance(colors, str):
+        colors = [color.strip() for color in colors.split(',') if color.strip()]
+
     if colors:
         query += " AND (" + " OR ".join(["colors LIKE ?" for _ in colors]) + ")"
         params.extend([f"%{color.lower()}%" for color in colors])
@@ -138,15 +548,157 @@ def search_products(
     if category and category in ["low", "mid", "high", "basketball", "slides"]:
         query += " AND type = ?"
         params.append(category)
-    
+
+    # The whole words of the name are checked last, so only the products every other filter kept are checked
+    if whole_words:
+        query += f" AND {PADDED_NAME_SQL} GLOB ?"
+        params.append(whole_words)
+
+    return query, params
+
+def summarize_matches(cur, where: str, params: List) -> Tuple[int, dict]:
+    """
+    Counts and summarizes the matching products in one pass, instead of listing them all.
+
+    The matches are grouped by model and category once, the totals are added up from the groups.
+
+    Args:
+    - cur (sqlite3.Cursor): Cursor of the open connection.
+    - where (str): The WHERE clause of the search.
+    - params (list): The parameters of the WHERE clause.
+
+    Returns:
+    - Tuple: A tuple containing (number of matches, summary with the price range, how many are discounted,
+      how many match per category and the colorways per model).
+    """
+    cur.execute(f"""
+        SELECT name, COALESCE(type, 'unknown'), COUNT(*), COUNT(discount), COUNT(price_value), MIN(price_value), MAX(price_value), SUM(price_value)
+        FROM (SELECT name, type, discount, CAST(SUBSTR(price, 2) AS FLOAT) AS price_value FROM products WHERE {where})
+        GROUP BY name, type
+    """, params)
+    groups = cur.fetchall()
+
+    match_count = 0
+    discounted = 0
+    priced = 0
+    price_total = 0
+    prices = []
+    categories = {}
+    models = {}
+    for name, category, count, discounts, prices_count, min_price, max_price, price_sum in groups:
+        match_count += count
+        discounted += discounts
+        categories[category] = categories.get(category, 0) + count
+        if prices_count:
+            priced += prices_count
+            price_total += price_sum
+            prices.extend([min_price, max_price])
+
+        # A model can span categories, add up its colorways and keep its lowest price
+        colorways, from_price = models.get(name, (0, None))
+        if min_price is not None and (from_price is None or min_price < from_price):
+            from_price = min_price
+        models[name] = (colorways + count, from_price)
+
+    # The models with the most colorways
+    top_models = sorted(models.items(), key=lambda item: (-item[1][0], item[0]))[:10]
+
+    return match_count, {
+        "price_range": {"min": f"${min(prices, default=None)}", "max": f"${max(prices, default=None)}", "average": f"${round(price_total / priced, 2) if priced else None}"},
+        "discounted": discounted,
+        "categories": dict(sorted(categories.items(), key=lambda item: -item[1])),
+        "models": [{"name": name, "colorways": count, "from_price": f"${price}"} for name, (count, price) in top_models]
+    }
+
+def fetch_matches(cur, where: str, params: List, limit: int) -> List[Tuple]:
+    """
+    Fetches a random page of the matching products.
+
+    Args:
+    - cur (sqlite3.Cursor): Cursor of the open connection.
+    - where (str): The WHERE clause of the search.
+    - params (list): The parameters of the WHERE clause.
+    - limit (int): How many products to fetch.
+
+    Returns:
+    - list of tuple: The name, price, colors, discount and description of every product.
+    """
     # Add some randomness to the fetched results and add a limit
-    query += " ORDER BY RANDOM() LIMIT ?"
-    params.append(limit)
+    cur.execute(f"SELECT name, price, colors, discount, description FROM products WHERE {where} ORDER BY RANDOM() LIMIT ?", params + [limit])
+    return cur.fetchall()
+
+def run_search(
+        condition: str,
+        name: Optional[str] = None,
+        max_price: Optional[float] = None,
+        colors: Optional[List[str]] = None,
+        description: Optional[str] = None,
+        category: Optional[str] = None,
+        limit: int = 20,
+        summary_threshold: Optional[int] = None
+    ) -> str:
+    """
+    Runs a search with the filters shared by the search functions.
+
+    The name is matched as it is first. If it matches no product, its shorthand is expanded (e.g., "aj4"),
+    and if that matches nothing either, the products with the most similar names in the fuzzy name index
+    are searched instead.
+
+    A page of up to limit products is fetched first. Only if the page is full are the matches counted, and if
+    there are more than summary_threshold of them an aggregate summary is returned with only a few of the products.
+
+    Args:
+    - condition (str): The condition of the search tool (see SEARCH_CONDITIONS).
+    - name, max_price, colors, description, category: The filters (see build_filters).
+    - limit (int, optional): Limit of how many results we should return.
+    - summary_threshold (int, optional): How many matches are listed before they are summarized. Default never summarizes.
+
+    Returns:
+    - str: JSON string with the number of matches, the products, the fuzzy name matches and the summary if there are any.
+    """
+    # At least one product is fetched, so an empty page always means there are no matches
+    page_size = max(limit, 1)
 
     with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute(query, params)
-        results = cur.fetchall()
+
+        filters, params = build_filters(name, max_price, colors, description, category)
+        where = condition + filters
+        results = fetch_matches(cur, where, params, page_size)
+
+        # Expand the shorthand only if the name matches nothing as it is, so names like "jordan jumpman jack" are kept
+        if name and not results:
+            expanded_name = expand_name_aliases(cur, name)
+            if expanded_name != name.lower():
+                name = expanded_name
+                filters, params = build_filters(name, max_price, colors, description, category)
+                where = condition + filters
+                results = fetch_matches(cur, where, params, page_size)
+
+        # Search the most similar names if the name matches nothing, so a misspelled name still finds products
+        similar_names = []
+        if name and not results:
+            similar_names = match_names(cur, name)
+            if similar_names:
+                filters, params = build_filters(name, max_price, colors, description, category, names=similar_names)
+                where = condition + filters
+                results = fetch_matches(cur, where, params, page_size)
+
+        # A page that is not full holds every match, otherwise count them, with the summary if it may be needed
+        summary = None
+        match_count = len(results)
+        if match_count == page_size:
+            if summary_threshold is not None:
+                match_count, summary = summarize_matches(cur, where, params)
+                if match_count <= summary_threshold:
+                    summary = None
+            else:
+                cur.execute(f"SELECT COUNT(*) FROM products WHERE {where}", params)
+                match_count = cur.fetchone()[0]
+
+        if summary:
+            limit = min(limit, SUMMARY_ROWS)
+        results = results[:limit]
 
     products_list = []
     for result in results:
@@ -160,7 +712,38 @@ def search_products(
         }
         products_list.append(product_dict)
 
-    return json.dumps({"products": products_list}, indent=2)
+    response = {"match_count": match_count, "products": products_list}
+    if similar_names:
+        response["similar_names"] = similar_names
+    if summary:
+        response["summary"] = summary
+    return json.dumps(response, indent=2)
+
+def search_products(
+        name: Optional[str] = None, 
+        max_price: Optional[float] = None, 
+        colors: Optional[List[str]] = None, 
+        description: Optional[str] = None,
+        category: Optional[str] = None,
+        limit: int = 20,
+        summary_threshold: Optional[int] = None
+    ) -> str:
+    """
+    Searches for products in the database based on the given criteria.
+
+    Args:
+    - name (str, optional): Name of the product to search for.
+    - max_price (float, optional): Maximum price of the product.
+    - colors (list of str, optional): List of colors to search for.
+    - description (str, optional): Description text to search for.
+    - category (str, optional): Category of the product (low, mid, high, basketball, slides).
+    - limit (int, optional): Limit of how many results we should return.
+    - summary_threshold (int, optional): Summarize the matches instead of listing them if there are more than this.
+
+    Returns:
+    - str: JSON string representing the products that match the search criteria.
+    """
+    return run_search(SEARCH_CONDITIONS["search_products"], name, max_price, colors, description, category, limit, summary_threshold)
 
 def search_products_with_discounts(
         name: Optional[str] = None,
@@ -168,7 +751,8 @@ def search_products_with_discounts(
         colors: Optional[List[str]] = None,
         description: Optional[str] = None,
         category: Optional[str] = None,
-        limit: int = 20
+        limit: int = 20,
+        summary_threshold: Optional[int] = None
     ) -> str:
     """
     Searches for products in the database that have discounts, optionally filtering by additional criteria.
@@ -180,55 +764,12 @@ def search_products_with_discounts(
     - description (str, optional): Description text to search for.
     - category (str, optional): Category of the product (low, mid, high, basketball, slides).
     - limit (int, optional): Limit of how many results we should return.
+    - summary_threshold (int, optional): Summarize the matches instead of listing them if there are more than this.
 
     Returns:
     - str: JSON string representing the products with discounts matching the criteria.
     """
-    query = "SELECT name, price, colors, discount, description FROM products WHERE discount IS NOT NULL"
-    params = []
-
-    if name:
-        query += " AND name LIKE ?"
-        params.append(f"%{name.lower()}%")
-
-    if max_price is not None:
-        query += " AND CAST(SUBSTR(price, 2) AS FLOAT) <= ?"
-        params.append(max_price)
-
-    if colors:
-        query += " AND (" + " OR ".join(["colors LIKE ?" for _ in colors]) + ")"
-        params.extend([f"%{color.lower()}%" for color in colors])
-
-    if description:
-        query += " AND description LIKE ?"
-        params.append(f"%{description.lower()}%")
-        
-    if category and category in ["low", "mid", "high", "basketball", "slides"]:
-        query += " AND type = ?"
-        params.append(category)
-        
-    # Add some randomness to the fetched results and add a limit
-    query += " ORDER BY RANDOM() LIMIT ?"
-    params.append(limit)
-
-    with get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute(query, params)
-        results = cur.fetchall()
-
-    products_list = []
-    for result in results:
-        name, price, colors, discount, description = result
-        product_dict = {
-            "name": name,
-            "price": price,
-            "colors": colors,
-            "discount": discount,
-            "description": description
-        }
-        products_list.append(product_dict)
-
-    return json.dumps({"products": products_list}, indent=2)
+    return run_search(SEARCH_CONDITIONS["search_products_with_discounts"], name, max_price, colors, description, category, limit, summary_threshold)
 
 def search_new_releases(
         name: Optional[str] = None,
@@ -236,7 +777,8 @@ def search_new_releases(
         colors: Optional[List[str]] = None,
         description: Optional[str] = None,
         category: Optional[str] = None,
-        limit: int = 20  
+        limit: int = 20,
+        summary_threshold: Optional[int] = None
     ) -> str:
     """
     Searches for new releases in the database based on the given criteria.
@@ -248,55 +790,132 @@ def search_new_releases(
     - description (str, optional): Description text to search for.
     - category (str, optional): Category of the product (low, mid, high, basketball, slides).
     - limit (int, optional): Limit of how many results we should return.
+    - summary_threshold (int, optional): Summarize the matches instead of listing them if there are more than this.
 
     Returns:
     - str: JSON string representing the upcoming new releases matching the criteria.
     """
-    query = "SELECT name, price, colors, discount, description FROM products WHERE promotion_status IN ('Just In', 'Coming Soon')"
-    params = []
+    return run_search(SEARCH_CONDITIONS["search_new_releases"], name, max_price, colors, description, category, limit, summary_threshold)
 
-    if name:
-        query += " AND name LIKE ?"
-        params.append(f"%{name.lower()}%")
+def get_semantic_index():
+    """
+    Returns the semantic index of the database this module uses, reloading it when it was updated.
+    
+    Returns:
+    - SemanticIndex: The index.
+    """
+    path = get_database_file()
+    cached = semantic_indexes.get(path)
+    if cached is None or cached.version() != cached.loaded_version:
+        cached = SemanticIndex(path)
+        semantic_indexes[path] = cached
+    return cached
 
-    if max_price is not None:
-        query += " AND CAST(SUBSTR(price, 2) AS FLOAT) <= ?"
-        params.append(max_price)
+def update_semantic_index():
+    """
+    Embeds the products that were added or changed since the semantic index was last updated.
+    Only the scraper calls this, before a catalog is published, searches never write the index.
+    
+    Returns:
+    - dict: How many products were added, changed and removed.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # Products without an id cannot be looked up again, so they are left out
+        cur.execute('SELECT id, name, colors, description FROM products WHERE id IS NOT NULL')
+        products = cur.fetchall()
+    
+    return get_semantic_index().update(products)
 
-    if colors:
-        query += " AND (" + " OR ".join(["colors LIKE ?" for _ in colors]) + ")"
-        params.extend([f"%{color.lower()}%" for color in colors])
+def semantic_search(
+        query: str,
+        max_price: Optional[float] = None,
+        category: Optional[str] = None,
+        limit: int = 10
+    ) -> str:
+    """
+    Searches for the products whose name, colors and description are most similar to a free-text query.
 
-    if description:
-        query += " AND description LIKE ?"
-        params.append(f"%{description.lower()}%")
-        
-    if category and category in ["low", "mid", "high", "basketball", "slides"]:
-        query += " AND type = ?"
-        params.append(category)
-        
-    # Add some randomness to the fetched results and add a limit
-    query += " ORDER BY RANDOM() LIMIT ?"
-    params.append(limit)
+    Args:
+    - query (str): What the user is looking for (e.g., "something good for outdoor courts").
+    - max_price (float, optional): Maximum price of the product.
+    - category (str, optional): Category of the product (low, mid, high, basketball, slides).
+    - limit (int, optional): Limit of how many results we should return.
 
+    Returns:
+    - str: JSON string representing the most similar products, most similar first.
+      Marked with "fallback": "keyword" if the catalog has no semantic index.
+    """
+    # Searches only read the index, it is built by the scraper before a catalog is published
+    index = get_semantic_index()
+    filters, params = build_filters(max_price=max_price, category=category)
+    
     with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute(query, params)
-        results = cur.fetchall()
-
+        
+        if index.matrix is None:
+            matches = keyword_search(cur, query, filters, params, limit)
+        else:
+            # Only rank the products that match the filters
+            product_ids = None
+            if filters:
+                cur.execute(f"SELECT id FROM products WHERE 1=1{filters}", params)
+                product_ids = [row[0] for row in cur.fetchall()]
+            
+            matches = index.search(query, k=limit, product_ids=product_ids)
+        
+        rows = {}
+        if matches:
+            cur.execute(f"SELECT id, name, price, colors, discount, description FROM products WHERE id IN ({', '.join('?' for _ in matches)})", [product_id for product_id, _ in matches])
+            rows = {row[0]: row[1:] for row in cur.fetchall()}
+    
     products_list = []
-    for result in results:
-        name, price, colors, discount, description = result
+    for product_id, similarity in matches:
+        if product_id not in rows:
+            continue
+        name, price, colors, discount, description = rows[product_id]
         product_dict = {
             "name": name,
             "price": price,
             "colors": colors,
             "discount": discount,
-            "description": description
+            "description": description,
+            "similarity": round(similarity, 3)
         }
         products_list.append(product_dict)
+    
+    response = {"products": products_list}
+    if index.matrix is None:
+        response["fallback"] = "keyword"
+    return json.dumps(response, indent=2)
 
-    return json.dumps({"products": products_list}, indent=2)
+def keyword_search(cur, query: str, filters: str, params: List, limit: int) -> List[Tuple[str, float]]:
+    """
+    Ranks the products by how many words of a query their name and description contain.
+    Used by semantic_search when the catalog has no semantic index.
+
+    Args:
+    - cur (sqlite3.Cursor): Cursor of the open connection.
+    - query (str): What the user is looking for.
+    - filters (str): The conditions of build_filters.
+    - params (list): The parameters of the conditions.
+    - limit (int): How many products to return.
+
+    Returns:
+    - list of tuples: Each tuple contains (product id, share of the words found), best match first.
+    """
+    words = tokenize(query)[:8]
+    if not words or limit <= 0:
+        return []
+    
+    # A product without a name or description would make the whole score NULL
+    score = " + ".join("(IFNULL(name, '') LIKE ?) + (IFNULL(description, '') LIKE ?)" for _ in words)
+    word_params = [f"%{word}%" for word in words for _ in range(2)]
+    cur.execute(f"""
+        SELECT id, score FROM (SELECT id, {score} AS score FROM products WHERE id IS NOT NULL{filters})
+        WHERE score > 0 ORDER BY score DESC LIMIT ?
+    """, word_params + params + [limit])
+    return [(product_id, score / (2 * len(words))) for product_id, score in cur.fetchall()]
 
 def get_product_details():
     """
@@ -313,6 +932,21 @@ def get_product_details():
         rows = cur.fetchall()
     return rows
 
+def get_typed_product_images():
+    """
+    Retrieves the image URLs and types of the products whose type is known.
+    
+    This is used to build the local image-similarity classifier.
+    
+    Returns:
+    - list of tuples: Each tuple contains (image_src, type)
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT DISTINCT image_src, type FROM products WHERE type IS NOT NULL AND image_src IS NOT NULL')
+        rows = cur.fetchall()
+    return rows
+
 def insert_product_type(product_id, product_type):
     """
     Inserts a type into the products table based on the product ID.
@@ -326,3 +960,98 @@ def insert_product_type(product_id, product_type):
         cur.execute('UPDATE products SET type = ? WHERE id = ?', (product_type, product_id))
         conn.commit()
 
+def create_classifications_table():
+    """
+    Creates the image classifications table if it doesnt exist
+    
+    The table caches the type gpt vision categorized each product image into, keyed by the hash of the image URL.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS image_classifications (
+            image_hash TEXT PRIMARY KEY,
+            image_url TEXT,
+            type TEXT
+        )
+        ''')
+        conn.commit()
+
+def create_image_features_table():
+    """
+    Creates the image features table if it doesnt exist
+    
+    The table caches the feature vector and perceptual hash of every product image the local classifier
+    has seen, keyed by the hash of the image URL, so images are only downloaded and featurized once.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS image_features (
+            image_hash TEXT PRIMARY KEY,
+            image_url TEXT,
+            vector BLOB,
+            perceptual_hash BLOB
+        )
+        ''')
+        conn.commit()
+
+def get_image_features(image_hashes):
+    """
+    Retrieves the cached features of images.
+    
+    Args:
+    - image_hashes (list of str): Hashes of the image URLs.
+    
+    Returns:
+    - dict: Maps the hash of each cached image URL to its (vector bytes, perceptual hash bytes).
+    """
+    features = {}
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # Query in chunks so the number of parameters stays under the SQLite limit
+        for start in range(0, len(image_hashes), 500):
+            chunk = image_hashes[start:start + 500]
+            cur.execute(f"SELECT image_hash, vector, perceptual_hash FROM image_features WHERE image_hash IN ({', '.join('?' * len(chunk))})", chunk)
+            for image_hash, vector, perceptual_hash in cur.fetchall():
+                features[image_hash] = (vector, perceptual_hash)
+    return features
+
+def insert_image_features(rows):
+    """
+    Caches the features of images.
+    
+    Args:
+    - rows (list of tuples): Each tuple contains (hash of the image URL, image URL, vector bytes, perceptual hash bytes).
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.executemany('INSERT OR REPLACE INTO image_features (image_hash, image_url, vector, perceptual_hash) VALUES (?, ?, ?, ?)', rows)
+        conn.commit()
+
+def get_classifications():
+    """
+    Retrieves every cached image classification.
+    
+    Returns:
+    - dict: Maps the hash of each image URL to its type.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT image_hash, type FROM image_classifications')
+        rows = cur.fetchall()
+    return dict(rows)
+
+def insert_classification(image_hash, image_url, product_type):
+    """
+    Caches the type an image was categorized into.
+    
+    Args:
+    - image_hash (str): Hash of the image URL.
+    - image_url (str): URL of the image.
+    - product_type (str): Type the image was categorized into.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('INSERT OR REPLACE INTO image_classifications (image_hash, image_url, type) VALUES (?, ?, ?)', (image_hash, image_url, product_type))
+        conn.commit()
@@ -0,0 +1,369 @@
+import argparse
+import os
+import re
+import sqlite3
+import json
+import zlib
+import fcntl
+import numpy as np
+
+# Number of dimensions the words are hashed into, every product takes DIMENSIONS * 4 bytes
+DIMENSIONS = 1024
+
+# How much the words of each field count, the name says the most about a product
+FIELD_WEIGHTS = {"name": 2.0, "colors": 1.0, "description": 1.0}
+
+# Suffixes of the files stored next to a catalog, the index and the lock serializing its updates
+VECTORS_SUFFIX = '.vectors'
+LOCK_SUFFIX = '.vectors.lock'
+
+# The index file starts with the length of its JSON header in this many bytes
+HEADER_LENGTH_BYTES = 8
+
+# The matrix starts at a multiple of this many bytes after the header
+MATRIX_ALIGNMENT = 64
+
+# How many rows are copied at a time when the index is rewritten
+COPY_CHUNK_ROWS = 4096
+
+# Words that say nothing about a product
+STOP_WORDS = {
+    'a', 'an', 'and', 'any', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'from', 'good', 'has', 'have', 'i',
+    'in', 'into', 'is', 'it', 'its', 'look', 'looking', 'me', 'my', 'of', 'on', 'or', 'pair', 'shoe', 'shoes',
+    'so', 'some', 'something', 'that', 'the', 'their', 'them', 'they', 'this', 'to', 'want', 'was', 'we',
+    'what', 'with', 'you', 'your'
+}
+
+
+def tokenize(text):
+    """
+    Splits a text into its lowercase words, without stop words and plural endings.
+
+    Args:
+    - text (str): The text.
+
+    Returns:
+    - list of str: The words (e.g., "Outdoor courts" gives ["outdoor", "court"]).
+    """
+    words = []
+    for word in re.findall(r"[a-z0-9]+", (text or '').lower()):
+        if word in STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+def embed(fields, dimensions=DIMENSIONS):
+    """
+    Embeds weighted text fields with a hashing vectorizer.
+
+    Every word is hashed into one of the dimensions with a sign, so no vocabulary has to be fitted and
+    products can be added one at a time. Repeated words count logarithmically.
+
+    Args:
+    - fields (dict): Maps a field name of FIELD_WEIGHTS to its text (e.g., {"name": "air jordan 1 low"}).
+    - dimensions (int, optional): The number of dimensions. Default is DIMENSIONS.
+
+    Returns:
+    - numpy.ndarray: The L2 normalized float32 vector, all zeros if the fields have no words.
+    """
+    counts = {}
+    for field, text in fields.items():
+        for word in tokenize(text):
+            counts[word] = counts.get(word, 0.0) + FIELD_WEIGHTS.get(field, 1.0)
+
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word, count in counts.items():
+        digest = zlib.crc32(word.encode('utf-8'))
+        sign = 1.0 if digest & 0x80000000 else -1.0
+        vector[digest % dimensions] += sign * (1.0 + np.log(count))
+
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def matrix_offset(header_size):
+    """
+    Returns where the matrix of an index file starts.
+
+    Args:
+    - header_size (int): The size of the JSON header in bytes.
+
+    Returns:
+    - int: The offset of the matrix, aligned to MATRIX_ALIGNMENT bytes.
+    """
+    end = HEADER_LENGTH_BYTES + header_size
+    return -(-end // MATRIX_ALIGNMENT) * MATRIX_ALIGNMENT
+
+
+def product_digest(name, colors, description):
+    """
+    Returns a checksum of the fields a product is embedded from, used to find changed products.
+
+    Args:
+    - name (str): Name of the product.
+    - colors (str): Colors of the product.
+    - description (str): Description of the product.
+
+    Returns:
+    - int: The checksum.
+    """
+    return zlib.crc32('\x1f'.join([name or '', colors or '', description or '']).encode('utf-8'))
+
+
+class SemanticIndex:
+    """
+    Embeddings of the products of a catalog, stored next to it as a contiguous float32 matrix.
+
+    The file starts with a JSON header holding the product id of every row, the checksum it was embedded
+    from and how many products use every dimension (which weighs the dimensions of a query like an inverse
+    document frequency), followed by the matrix, which is memory mapped so every process searching the
+    catalog shares its pages. Updates write a new file and replace the old one, so readers always see a
+    header and a matrix that belong together.
+    """
+    def __init__(self, catalog_path, dimensions=DIMENSIONS):
+        self.vectors_path = catalog_path + VECTORS_SUFFIX
+        self.lock_path = catalog_path + LOCK_SUFFIX
+        self.dimensions = dimensions
+
+        # Product id and checksum of every row
+        self.ids = []
+        self.digests = []
+
+        # How many products have a non-zero value in every dimension
+        self.document_frequency = np.zeros(dimensions, dtype=np.int64)
+
+        self.rows = {}
+        self.matrix = None
+
+        # Version of the stored index that was loaded, to see when another process updated it
+        self.loaded_version = None
+        self.load()
+
+    def load(self):
+        """
+        Loads the header and maps the matrix, if the index was built before.
+        """
+        self.ids = []
+        self.digests = []
+        self.document_frequency = np.zeros(self.dimensions, dtype=np.int64)
+        self.rows = {}
+        self.matrix = None
+
+        # Read the header and map the matrix from the same open file, even if it is replaced meanwhile
+        try:
+            f = open(self.vectors_path, 'rb')
+        except FileNotFoundError:
+            self.loaded_version = None
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            self.loaded_version = (stat.st_ino, stat.st_mtime_ns)
+            header_size = int.from_bytes(f.read(HEADER_LENGTH_BYTES), 'little')
+            meta = json.loads(f.read(header_size))
+            if meta['dimensions'] != self.dimensions:
+                return
+
+            self.ids = meta['ids']
+            self.digests = meta['digests']
+            self.document_frequency = np.array(meta['document_frequency'], dtype=np.int64)
+            self.rows = {product_id: row for row, product_id in enumerate(self.ids)}
+            if self.ids:
+                self.matrix = np.memmap(f, dtype=np.float32, mode='r', offset=matrix_offset(header_size), shape=(len(self.ids), self.dimensions))
+
+    def version(self):
+        """
+        Returns the version of the stored index, it changes every time the index is updated.
+
+        Returns:
+        - Tuple or None: The inode and modification time of the file, or None if the index was never built.
+        """
+        try:
+            stat = os.stat(self.vectors_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def update(self, products):
+        """
+        Brings the index up to date with the products of the catalog, embedding only new and changed products.
+
+        Updates are serialized with a lock file. The rows of removed products are left out of the new file,
+        so the matrix never holds more rows than the catalog has products.
+
+        Args:
+        - products (list of tuples): Each tuple contains (id, name, colors, description) of a product of the catalog.
+
+        Returns:
+        - dict: How many products were added, changed and removed.
+        """
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Start from what the last writer stored, not from what this process loaded earlier
+                self.load()
+                return self.write_update(products)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def write_update(self, products):
+        """
+        Writes the updated index to a temporary file and replaces the stored index with it. Runs under the lock of update.
+
+        Args:
+        - products (list of tuples): Each tuple contains (id, name, colors, description) of a product of the catalog.
+
+        Returns:
+        - dict: How many products were added, changed and removed.
+        """
+        seen = set()
+        changed = {}
+        added = []
+        for product_id, name, colors, description in products:
+            seen.add(product_id)
+            digest = product_digest(name, colors, description)
+            row = self.rows.get(product_id)
+            if row is None:
+                added.append((product_id, digest, name, colors, description))
+            elif self.digests[row] != digest:
+                changed[row] = (digest, name, colors, description)
+        removed = {row for product_id, row in self.rows.items() if product_id not in seen}
+        stats = {"added": len(added), "changed": len(changed), "removed": len(removed)}
+        if not (added or changed or removed) and self.loaded_version is not None:
+            return stats
+
+        def embed_product(name, colors, description):
+            return embed({"name": name, "colors": colors, "description": description}, self.dimensions)
+
+        # The kept rows in their order, then the new products
+        kept = [row for row in range(len(self.ids)) if row not in removed]
+        ids = [self.ids[row] for row in kept] + [product_id for product_id, _, _, _, _ in added]
+        digests = [changed[row][0] if row in changed else self.digests[row] for row in kept] + [digest for _, digest, _, _, _ in added]
+
+        # The header has a fixed size once the ids and checksums are known, the frequencies are padded to it
+        document_frequency = np.zeros(self.dimensions, dtype=np.int64)
+        header = self.encode_header(ids, digests, np.full(self.dimensions, len(ids), dtype=np.int64))
+
+        temp_path = f"{self.vectors_path}.tmp-{os.getpid()}"
+        try:
+            with open(temp_path, 'wb') as f:
+                # Leave room for the header, it is written once the frequencies are counted
+                f.write(b'\0' * matrix_offset(len(header) - HEADER_LENGTH_BYTES))
+
+                # Copy the kept rows in chunks, embedding the changed ones again
+                for start in range(0, len(kept), COPY_CHUNK_ROWS):
+                    chunk_rows = kept[start:start + COPY_CHUNK_ROWS]
+                    chunk = np.array(self.matrix[chunk_rows], dtype=np.float32)
+                    for i, row in enumerate(chunk_rows):
+                        if row in changed:
+                            chunk[i] = embed_product(*changed[row][1:])
+                    document_frequency += (chunk != 0).sum(axis=0)
+                    f.write(chunk.tobytes())
+
+                for start in range(0, len(added), COPY_CHUNK_ROWS):
+                    chunk = np.vstack([embed_product(name, colors, description) for _, _, name, colors, description in added[start:start + COPY_CHUNK_ROWS]])
+                    document_frequency += (chunk != 0).sum(axis=0)
+                    f.write(chunk.tobytes())
+
+                f.seek(0)
+                f.write(self.encode_header(ids, digests, document_frequency, size=len(header)))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.vectors_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        self.load()
+        return stats
+
+    def encode_header(self, ids, digests, document_frequency, size=None):
+        """
+        Encodes the header of the index file.
+
+        Args:
+        - ids (list of str): The product id of every row.
+        - digests (list of int): The checksum of every row.
+        - document_frequency (numpy.ndarray): How many products use every dimension.
+        - size (int, optional): Pad the header to this many bytes. Default does not pad.
+
+        Returns:
+        - bytes: The length of the JSON header followed by the JSON header.
+        """
+        meta = json.dumps({
+            "dimensions": self.dimensions,
+            "ids": ids,
+            "digests": digests,
+            "document_frequency": document_frequency.tolist()
+        }).encode('utf-8')
+        if size is not None:
+            meta = meta.ljust(size - HEADER_LENGTH_BYTES)
+        return len(meta).to_bytes(HEADER_LENGTH_BYTES, 'little') + meta
+
+    def search(self, query, k=10, product_ids=None):
+        """
+        Finds the products most similar to a query by cosine similarity.
+
+        Args:
+        - query (str): The query (e.g., "something good for outdoor courts").
+        - k (int, optional): How many products to return. Default is 10.
+        - product_ids (iterable of str, optional): Only search these products (e.g., the ones matching the filters). Default searches every product.
+
+        Returns:
+        - list of tuples: Each tuple contains (product id, similarity), most similar first.
+        """
+        if self.matrix is None or k <= 0:
+            return []
+
+        # Words that few products use count more
+        idf = np.log((len(self.rows) + 1) / (self.document_frequency + 1)).astype(np.float32) + 1
+        vector = embed({"description": query}, self.dimensions) * idf
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return []
+        vector /= norm
+
+        # Scoring every row and masking the rest is cheaper than copying the rows of the filtered products
+        similarities = self.matrix @ vector
+        if product_ids is not None:
+            mask = np.zeros(len(similarities), dtype=bool)
+            mask[[self.rows[product_id] for product_id in product_ids if product_id in self.rows]] = True
+            similarities = np.where(mask, similarities, -np.inf)
+
+        k = min(k, len(similarities))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+
+        results = []
+        for row in top:
+            if similarities[row] > 0:
+                results.append((self.ids[row], float(similarities[row])))
+        return results
+
+
+# Main function to build the semantic index of an existing catalog without scraping
+def main():
+    parser = argparse.ArgumentParser(description="Build or update the semantic index of an existing catalog without scraping it again.")
+    parser.add_argument("--catalog", help="Path of the catalog database (default: the published catalog, or database.db before the first one)")
+    args = parser.parse_args()
+
+    # The database module imports this one, so it is only imported once this runs as a script
+    from .database import set_database_path, get_database_file, update_semantic_index
+    if args.catalog:
+        set_database_path(args.catalog)
+
+    # Connecting to a missing catalog would create an empty one
+    catalog_path = get_database_file()
+    if not os.path.exists(catalog_path):
+        print(f'Error building the semantic index - Error: {catalog_path} does not exist')
+        return
+
+    try:
+        print(f"Updated the semantic index of {catalog_path}: {update_semantic_index()}")
+    except sqlite3.Error as e:
+        print(f'Error building the semantic index - Error: {str(e)}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import os
+import re
+import math
+import random
+import sqlite3
+import argparse
+import string
+from collections import Counter
+
+# The scraped catalog the value distributions are taken from
+SEED_DATABASE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'database.db')
+
+# Suffixes added to model names to create new variants, like the real catalog does
+NAME_SUFFIXES = ['', '', '', ' se', ' og', ' retro', ' premium', ' craft']
+
+# The types a product can have
+VALID_TYPES = ['low', 'mid', 'high', 'basketball', 'slides']
+
+
+def load_seed_catalog(seed_path=SEED_DATABASE):
+    """
+    Loads the value distributions of the scraped catalog.
+
+    Args:
+    - seed_path (str, optional): Path of the scraped database. Default is database.db.
+
+    Returns:
+    - dict: The distributions with the following keys:
+        - models (list of tuples): Each tuple contains (name, original price, type, description).
+        - color_words (Counter): How often every color appears in the colors of a product.
+        - color_counts (Counter): How many colors products have.
+        - promotion_statuses (Counter): How often every promotion status appears.
+        - discount_rate (float): Share of products that have a discount.
+        - discounts (list of int): The discount percentages of the discounted products.
+    """
+    with sqlite3.connect(seed_path) as conn:
+        rows = conn.execute('SELECT name, type, promotion_status, price, discount, colors, description FROM products').fetchall()
+
+    models = {}
+    color_words = Counter()
+    color_counts = Counter()
+    promotion_statuses = Counter()
+    discounts = []
+    for name, type, promotion_status, price, discount, colors, description in rows:
+        # Recover the original price of discounted products, prices are in $5 steps
+        current_price = float(price[1:])
+        original_price = current_price
+        if discount:
+            percent = int(discount[1:])
+            discounts.append(percent)
+            original_price = 5 * round(current_price / (1 - percent / 100) / 5)
+        models.setdefault(name, (name, original_price, type, description))
+
+        if colors:
+            words = colors.split('/')
+            color_words.update(words)
+            color_counts[len(words)] += 1
+        promotion_statuses[promotion_status] += 1
+
+    return {
+        'models': list(models.values()),
+        'color_words': color_words,
+        'color_counts': color_counts,
+        'promotion_statuses': promotion_statuses,
+        'discount_rate': len(discounts) / len(rows),
+        'discounts': discounts
+    }
+
+
+def weighted_choice(rng, counter):
+    """
+    Picks a value of a counter with a probability proportional to its count.
+
+    Args:
+    - rng (random.Random): The random number generator.
+    - counter (Counter): The values and their counts.
+
+    Returns:
+    - object: The picked value.
+    """
+    values = list(counter.keys())
+    return rng.choices(values, weights=[counter[value] for value in values])[0]
+
+
+def generate_products(count, seed=0, seed_catalog=None):
+    """
+    Generates synthetic products that follow the schema and value distributions of the scraped catalog.
+
+    The same count and seed always generate the same products.
+
+    Args:
+    - count (int): How many products to generate.
+    - seed (int, optional): Seed of the random number generator. Default is 0.
+    - seed_catalog (dict, optional): The distributions returned by load_seed_catalog. Default loads them from database.db.
+
+    Yields:
+    - tuple: The row of a product in the order (id, name, type, promotion_status, price, discount, colors, url, image_src, description).
+    """
+    rng = random.Random(seed)
+    catalog = seed_catalog or load_seed_catalog()
+    color_words = list(catalog['color_words'].keys())
+    color_weights = [catalog['color_words'][word] for word in color_words]
+
+    for i in range(count):
+        # Pick a model and maybe turn it into a new variant
+        name, original_price, type, description = rng.choice(catalog['models'])
+        suffix = rng.choice(NAME_SUFFIXES)
+        if suffix and suffix.strip() not in name:
+            name += suffix
+
+        # Pick the colors of the product, the first color names some variants like the real catalog
+        colors = rng.choices(color_words, weights=color_weights, k=weighted_choice(rng, catalog['color_counts']))
+        if rng.random() < 0.1:
+            name += f' "{colors[0]}"'
+
+        # Prices move in $5 steps around the model's price, some products are discounted
+        original_price = max(25, original_price + 5 * rng.randint(-4, 4))
+        if rng.random() < catalog['discount_rate']:
+            percent = rng.choice(catalog['discounts'])
+            current_price = round(original_price * (1 - percent / 100) - 0.03, 2)
+            discount = f"%{math.floor(((original_price - current_price) / original_price) * 100)}"
+        else:
+            current_price = float(original_price)
+            discount = None
+
+        # Products get a unique style code like the real ones (e.g., "FQ1759-001")
+        product_id = ''.join(rng.choices(string.ascii_uppercase, k=2)) + f"{i // 1000:04d}-{i % 1000:03d}"
+        slug = re.sub(r'[^a-z0-9]+', '-', name).strip('-')
+
+        yield (
+            product_id,
+            name,
+            type if type in VALID_TYPES else rng.choice(VALID_TYPES),
+            weighted_choice(rng, catalog['promotion_statuses']),
+            f"${current_price}",
+            discount,
+            '/'.join(colors),
+            f"https://www.nike.com/t/{slug}/{product_id}",
+            f"https://static.nike.com/a/images/{slug}-{product_id}.png",
+            description
+        )
+
+
+def create_synthetic_database(path, count, seed=0, batch_size=10000):
+    """
+    Creates a database with a synthetic catalog.
+
+    Args:
+    - path (str): Path of the database file, it is replaced if it exists.
+    - count (int): How many products to generate.
+    - seed (int, optional): Seed of the random number generator. Default is 0.
+    - batch_size (int, optional): How many products to insert per statement. Default is 10000.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+    with sqlite3.connect(path) as conn:
+        # Same schema as create_products_table
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            id TEXT PRIMARY KEY,
+            name TEXT,
+            type TEXT,
+            promotion_status TEXT,
+            price TEXT,
+            discount TEXT,
+            colors TEXT,
+            url TEXT,
+            image_src TEXT,
+            description TEXT
+        )
+        ''')
+
+        # Insert in batches so a million products never sit in memory at once
+        batch = []
+        for product in generate_products(count, seed=seed):
+            batch.append(product)
+            if len(batch) == batch_size:
+                conn.executemany('INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+                batch = []
+        if batch:
+            conn.executemany('INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+        conn.commit()
+
+
+# Main function to generate a synthetic catalog
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic catalog that follows the scraped catalog.")
+    parser.add_argument("--rows", type=int, default=100000, help="How many products to generate")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random number generator")
+    parser.add_argument("--output", default="synthetic.db", help="Path of the database file to create")
+    args = parser.parse_args()
+
+    create_synthetic_database(args.output, args.rows, seed=args.seed)
+    print(f"Generated {args.rows} products into {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+import json
+import re
+
+# lxml is a C-backed parser and is much faster than BeautifulSoup's pure Python 'html.parser'
+# If it is not installed we fall back to BeautifulSoup so the scraper keeps working
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:
+    etree = None
+    lxml_html = None
+
+from bs4 import BeautifulSoup
+
+# Nike embeds the data used to render the page as JSON inside this script tag
+NEXT_DATA_PATTERN = re.compile(r'<script[^>]*id="__NEXT_DATA__"[^>]*>(.*?)</script>', re.DOTALL)
+
+
+def _class_xpath(tag, class_name):
+    """
+    Builds an XPath expression that matches a tag containing the given class name.
+
+    Args:
+    - tag (str): The tag name to match (e.g., "div").
+    - class_name (str): The class name the tag should contain.
+
+    Returns:
+    - str: The XPath expression.
+    """
+    return f"{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]"
+
+
+# Precompile the XPath selectors once so each page only pays for evaluating them
+if etree is not None:
+    CARD_XPATH = etree.XPath('//' + _class_xpath('div', 'product-card__body'))
+    CARD_LINK_XPATH = etree.XPath('.//' + _class_xpath('a', 'product-card__link-overlay'))
+    CARD_MESSAGING_XPATH = etree.XPath(".//div[@data-testid='product-card__messaging']")
+    CARD_PRICE_XPATH = etree.XPath(".//div[@data-testid='product-card__price']")
+    CARD_IMAGE_XPATH = etree.XPath(".//img[contains(concat(' ', normalize-space(@class)), ' product-card__hero-image')]/@src")
+    DESCRIPTION_XPATH = etree.XPath("//div[contains(concat(' ', normalize-space(@class)), ' description-preview')]")
+    DESCRIPTION_P_XPATH = etree.XPath('.//p')
+    SHOWN_XPATH = etree.XPath('//' + _class_xpath('li', 'description-preview__color-description'))
+    STYLE_XPATH = etree.XPath('//' + _class_xpath('li', 'description-preview__style-color'))
+    COLORWAY_XPATH = etree.XPath("//div[@id='ColorwayDiv']//div[starts-with(@class, 'css-7aigzk colorway-container')]")
+    COLORWAY_ID_XPATH = etree.XPath(".//input[@name='pdp-colorpicker']/@data-style-color")
+    COLORWAY_IMAGE_XPATH = etree.XPath('.//img/@src')
+
+
+def get_default_parser():
+    """
+    Returns the name of the fastest HTML parser that is installed.
+
+    Returns:
+    - str: "lxml" if lxml is installed, otherwise "bs4".
+    """
+    return 'lxml' if etree is not None else 'bs4'
+
+
+def extract_next_data(html):
+    """
+    Extracts the JSON Nike embeds in the page inside the __NEXT_DATA__ script tag.
+
+    Args:
+    - html (str): The HTML content of the page.
+
+    Returns:
+    - dict or None: The parsed JSON, or None if the page has no valid __NEXT_DATA__ script.
+    """
+    match = NEXT_DATA_PATTERN.search(html)
+    if not match:
+        return None
+
+    try:
+        return json.loads(match.group(1))
+    except ValueError:
+        return None
+
+
+def _split_label(text, label):
+    """
+    Returns the text after a label such as "Shown:" or "Style:".
+
+    Args:
+    - text (str): The text of the element.
+    - label (str): The label that comes before the value.
+
+    Returns:
+    - str or None: The value after the label, or None if the label is missing.
+    """
+    parts = text.split(label)
+    return parts[1].strip() if len(parts) > 1 else None
+
+
+def _details_from_next_data(data):
+    """
+    Builds the product details from the page's __NEXT_DATA__ JSON.
+
+    Args:
+    - data (dict): The parsed __NEXT_DATA__ JSON.
+
+    Returns:
+    - dict or None: The product details, or None if the JSON does not describe a product.
+    """
+    page_props = data.get('props', {}).get('pageProps', {})
+    product = page_props.get('selectedProduct')
+    if not product or not product.get('styleColor'):
+        return None
+
+    # Extract the description of the product
+    product_info = product.get('productInfo') or {}
+    description = product_info.get('productDescription')
+
+    # Extract the other colors of the same product
+    colorways = []
+    for colorway in page_props.get('colorwayImages') or []:
+        colorways.append({
+            'product_id': colorway.get('styleColor'),
+            'image_url': colorway.get('squarishImg') or colorway.get('portraitImg')
+        })
+
+    return {
+        'product_id': product.get('styleColor'),
+        'description': description.strip() if description else None,
+        'colors': product.get('colorDescription'),
+        'colorways': colorways
+    }
+
+
+def _details_from_lxml(html):
+    """
+    Builds the product details from the page's HTML using lxml and the precompiled selectors.
+
+    Args:
+    - html (str): The HTML content of the product page.
+
+    Returns:
+    - dict: The product details.
+    """
+    tree = lxml_html.fromstring(html)
+
+    # Extract Product description
+    description = None
+    description_elements = DESCRIPTION_XPATH(tree)
+    if description_elements:
+        p_tags = DESCRIPTION_P_XPATH(description_elements[0])
+        description = p_tags[0].text_content().strip() if p_tags else None
+
+    # Extract "Shown:" details
+    shown_elements = SHOWN_XPATH(tree)
+    colors = _split_label(shown_elements[0].text_content(), 'Shown:') if shown_elements else None
+
+    # Extract "Style:" details
+    style_elements = STYLE_XPATH(tree)
+    product_id = _split_label(style_elements[0].text_content(), 'Style:') if style_elements else None
+
+    # For other colors of the shoe extract their id and image url
+    colorways = []
+    for container in COLORWAY_XPATH(tree):
+        ids = COLORWAY_ID_XPATH(container)
+        images = COLORWAY_IMAGE_XPATH(container)
+        colorways.append({
+            'product_id': ids[0] if ids else None,
+            'image_url': images[0] if images else None
+        })
+
+    return {
+        'product_id': product_id,
+        'description': description,
+        'colors': colors,
+        'colorways': colorways
+    }
+
+
+def _details_from_bs4(html):
+    """
+    Builds the product details from the page's HTML using BeautifulSoup.
+
+    Args:
+    - html (str): The HTML content of the product page.
+
+    Returns:
+    - dict: The product details.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Extract Product description
+    description_element = soup.find('div', class_=re.compile(r'^description-preview'))
+    if description_element:
+        p_tag = description_element.find('p')
+        description = p_tag.text.strip() if p_tag else None
+    else:
+        description = None
+
+    # Extract "Shown:" details
+    shown_element = soup.find('li', class_='description-preview__color-description')
+    colors = _split_label(shown_element.text, 'Shown:') if shown_element else None
+
+    # Extract "Style:" details
+    style_element = soup.find('li', class_='description-preview__style-color')
+    product_id = _split_label(style_element.text, 'Style:') if style_element else None
+
+    # For other colors of the shoe extract their id and image url
+    colorways = []
+    colorway_div = soup.find('div', id='ColorwayDiv')
+    if colorway_div:
+        for container in colorway_div.find_all('div', class_=re.compile(r'^css-7aigzk colorway-container')):
+            input_tag = container.find('input', {'name': 'pdp-colorpicker'})
+            img_tag = container.find('img')
+            colorways.append({
+                'product_id': input_tag['data-style-color'] if input_tag else None,
+                'image_url': img_tag['src'] if img_tag else None
+            })
+
+    return {
+        'product_id': product_id,
+        'description': description,
+        'colors': colors,
+        'colorways': colorways
+    }
+
+
+def extract_product_details(html, use_next_data=True, parser=None):
+    """
+    Extracts the details of a product from its product page.
+
+    The embedded __NEXT_DATA__ JSON is tried first since it needs no HTML parsing at all,
+    otherwise the page is parsed with lxml (or BeautifulSoup if lxml is not installed).
+
+    Args:
+    - html (str): The HTML content of the product page.
+    - use_next_data (bool, optional): Whether to try the embedded JSON first. Default is True.
+    - parser (str, optional): The HTML parser to use ("lxml" or "bs4"). Default is the fastest installed.
+
+    Returns:
+    - dict: A dictionary with the following keys:
+        - product_id (str or None): The style color of the product.
+        - description (str or None): Description of the product.
+        - colors (str or None): The color(s) of the product.
+        - colorways (list of dict): The product_id and image_url of each other color of the product.
+    """
+    # Try the structured JSON first
+    if use_next_data:
+        data = extract_next_data(html)
+        details = _details_from_next_data(data) if data else None
+        if details:
+            return details
+
+    # Otherwise parse the HTML itself
+    parser = parser or get_default_parser()
+    if parser == 'lxml':
+        return _details_from_lxml(html)
+    return _details_from_bs4(html)
+
+
+def extract_product_colors(html, parser=None):
+    """
+    Extracts only the "Shown:" colors of a product from its product page.
+
+    Args:
+    - html (str): The HTML content of the product page.
+    - parser (str, optional): The HTML parser to use ("lxml" or "bs4"). Default is the fastest installed.
+
+    Returns:
+    - str or None: The color(s) of the product.
+    """
+    return extract_product_details(html, parser=parser)['colors']
+
+
+def extract_product_cards(html, parser=None):
+    """
+    Extracts the product cards from a listing page.
+
+    Args:
+    - html (str): The HTML content of the listing page.
+    - parser (str, optional): The HTML parser to use ("lxml" or "bs4"). Default is the fastest installed.
+
+    Returns:
+    - list of dict: Each card has the keys name, url, promotion_status, price and image_url.
+    """
+    parser = parser or get_default_parser()
+    cards = []
+
+    if parser == 'lxml':
+        tree = lxml_html.fromstring(html)
+        for card in CARD_XPATH(tree):
+            # Extract product name and URL
+            links = CARD_LINK_XPATH(card)
+            if not links:
+                continue
+
+            # Extract messaging, price and image if they exist
+            messages = CARD_MESSAGING_XPATH(card)
+            prices = CARD_PRICE_XPATH(card)
+            images = CARD_IMAGE_XPATH(card)
+
+            cards.append({
+                'name': links[0].text_content().strip(),
+                'url': links[0].get('href'),
+                'promotion_status': messages[0].text_content().strip() if messages else None,
+                'price': prices[0].text_content().strip() if prices else None,
+                'image_url': images[0] if images else None
+            })
+        return cards
+
+    soup = BeautifulSoup(html, 'html.parser')
+    for card in soup.find_all('div', class_='product-card__body'):
+        # Extract product name and URL
+        link = card.find('a', class_='product-card__link-overlay')
+        if not link:
+            continue
+
+        # Extract messaging, price and image if they exist
+        message_tag = card.find('div', {'data-testid': 'product-card__messaging'})
+        price_tag = card.find('div', {'data-testid': 'product-card__price'})
+        image_tag = card.find('img', class_=re.compile(r'^product-card__hero-image'))
+
+        cards.append({
+            'name': link.text.strip(),
+            'url': link['href'],
+            'promotion_status': message_tag.text.strip() if message_tag else None,
+            'price': price_tag.text.strip() if price_tag else None,
+            'image_url': image_tag['src'] if image_tag else None
+        })
+    return cards
@@ -0,0 +1,152 @@
+import json
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, urlencode
+
+# The endpoint Nike's listing pages call to load their products page by page
+FEED_URL = 'https://api.nike.com/discover/product_wall/v1/marketplace/US/language/en/consumerChannelId/d9a5bc42-4b9c-4976-858a-f159cf99c647'
+
+# The feed rejects requests that do not say which client is calling
+FEED_HEADERS = {
+    'nike-api-caller-id': 'nike:dotcom:browse:wall.client:2.0',
+    'User-Agent': 'Mozilla/5.0'
+}
+
+
+def build_feed_url(base_url, anchor, count, feed_url=FEED_URL):
+    """
+    Builds the URL of one page of the product feed behind a listing page.
+
+    Args:
+    - base_url (str): The URL of the listing page (e.g., "https://www.nike.com/w/mens-jordan-shoes-37eefznik1zy7ok").
+    - anchor (int): The index of the first product of the page.
+    - count (int): How many products the page should have.
+    - feed_url (str, optional): The URL of the feed endpoint. Default is Nike's product wall endpoint.
+
+    Returns:
+    - str: The URL of the feed page.
+    """
+    params = {
+        'path': urlparse(base_url).path,
+        'queryType': 'PRODUCTS',
+        'anchor': anchor,
+        'count': count
+    }
+    return f"{feed_url}?{urlencode(params)}"
+
+
+def format_price(value):
+    """
+    Formats a price from the feed the same way the product cards display it.
+
+    Args:
+    - value (float): The price.
+
+    Returns:
+    - str: The formatted price (e.g., "$95" or "$95.97").
+    """
+    return f"${value:g}"
+
+
+def product_to_card(product):
+    """
+    Converts a product from the feed into the product card shape parse_product_card consumes.
+
+    Args:
+    - product (dict): The product as returned by the feed.
+
+    Returns:
+    - dict: The product card with the keys name, url, promotion_status, price and image_url.
+    """
+    # The card shows the current price followed by the original price when there is a discount
+    prices = product.get('prices') or {}
+    current_price = prices.get('currentPrice')
+    initial_price = prices.get('initialPrice')
+    if current_price is None:
+        price = None
+    elif initial_price is not None and current_price < initial_price:
+        price = format_price(current_price) + format_price(initial_price)
+    else:
+        price = format_price(current_price)
+
+    images = product.get('colorwayImages') or {}
+    return {
+        'name': (product.get('copy') or {}).get('title'),
+        'url': (product.get('pdpUrl') or {}).get('url'),
+        'promotion_status': product.get('badgeLabel'),
+        'price': price,
+        'image_url': images.get('portraitURL') or images.get('squarishURL')
+    }
+
+
+def fetch_feed_text(url, timeout=30):
+    """
+    Fetches the body of a feed page from the network.
+
+    Args:
+    - url (str): The URL of the feed page.
+    - timeout (float, optional): How many seconds to wait for the response. Default is 30.
+
+    Returns:
+    - str: The body of the response.
+    """
+    response = requests.get(url, headers=FEED_HEADERS, timeout=timeout)
+    response.raise_for_status()
+    return response.text
+
+
+def fetch_feed_page(base_url, anchor, count, feed_url=FEED_URL, fetch=fetch_feed_text):
+    """
+    Fetches one page of the product feed.
+
+    Args:
+    - base_url (str): The URL of the listing page.
+    - anchor (int): The index of the first product of the page.
+    - count (int): How many products the page should have.
+    - feed_url (str, optional): The URL of the feed endpoint. Default is Nike's product wall endpoint.
+    - fetch (callable, optional): Function that takes a URL and returns the body of its response.
+      Default fetches it from the network.
+
+    Returns:
+    - Tuple: A tuple containing (list of product cards, total number of products in the listing).
+    """
+    data = json.loads(fetch(build_feed_url(base_url, anchor, count, feed_url)))
+
+    # Products are grouped by model, every product in a group is a separate card
+    cards = []
+    for grouping in data.get('productGroupings') or []:
+        for product in grouping.get('products') or []:
+            cards.append(product_to_card(product))
+
+    total = (data.get('pages') or {}).get('totalResources', len(cards))
+    return cards, total
+
+
+def discover_product_cards(base_url, feed_url=FEED_URL, count=24, max_workers=8, fetch=fetch_feed_text):
+    """
+    Discovers the product cards of a listing page by requesting its product feed directly.
+
+    The first page tells us how many products the listing has, the remaining pages are then fetched
+    concurrently and yielded in order.
+
+    Args:
+    - base_url (str): The URL of the listing page.
+    - feed_url (str, optional): The URL of the feed endpoint. Default is Nike's product wall endpoint.
+    - count (int, optional): How many products to request per page. Default is 24.
+    - max_workers (int, optional): How many pages to fetch at the same time. Default is 8.
+    - fetch (callable, optional): Function that takes a URL and returns the body of its response.
+      Default fetches it from the network.
+
+    Yields:
+    - dict: The product cards in the same shape as extract_product_cards returns.
+    """
+    # Fetch the first page to know how many pages there are
+    cards, total = fetch_feed_page(base_url, 0, count, feed_url, fetch)
+    yield from cards
+
+    # Fetch the remaining pages concurrently, map keeps them in order
+    anchors = range(count, total, count)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages = executor.map(lambda anchor: fetch_feed_page(base_url, anchor, count, feed_url, fetch), anchors)
+        for cards, _ in pages:
+            yield from cards
@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Default directory holding the recorded feed pages
+DEFAULT_PAGES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'feed')
+
+
+def make_handler(pages_dir):
+    """
+    Creates a request handler that serves the recorded feed pages.
+
+    A request with "anchor=N" is answered with the file "<N>.json" from the pages directory,
+    anchors without a recorded page are answered with an empty page and anchors that are not a
+    non-negative integer with a 400.
+
+    Args:
+    - pages_dir (str): The directory holding the recorded feed pages.
+
+    Returns:
+    - class: The request handler class.
+    """
+    class FeedHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            # Find the recorded page for the requested anchor
+            params = parse_qs(urlparse(self.path).query)
+            try:
+                anchor = int(params.get('anchor', ['0'])[0])
+            except ValueError:
+                anchor = -1
+            if anchor < 0:
+                self.send_body(400, json.dumps({"error": "The anchor must be a non-negative integer"}).encode('utf-8'))
+                return
+
+            page_path = os.path.join(pages_dir, f'{anchor}.json')
+            if os.path.exists(page_path):
+                with open(page_path, 'rb') as f:
+                    body = f.read()
+            else:
+                body = json.dumps({"productGroupings": []}).encode('utf-8')
+            self.send_body(200, body)
+
+        def send_body(self, status, body):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Keep the output of the scraper readable
+            pass
+
+    return FeedHandler
+
+
+def start_feed_server(pages_dir=DEFAULT_PAGES_DIR, port=0):
+    """
+    Starts a local stand-in for the product feed in a background thread.
+
+    Args:
+    - pages_dir (str, optional): The directory holding the recorded feed pages.
+    - port (int, optional): The port to listen on. Default is 0 which picks a free port.
+
+    Returns:
+    - Tuple: A tuple containing (server, feed URL). Call server.shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(pages_dir))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/feed"
+
+
+# Main function to run the stand-in feed
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded product feed pages locally.")
+    parser.add_argument("--pages", default=DEFAULT_PAGES_DIR, help="Directory holding the recorded feed pages")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(args.pages))
+    print(f"Serving feed pages from {args.pages} at http://127.0.0.1:{args.port}/feed")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
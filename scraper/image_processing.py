@@ -1,7 +1,11 @@
 import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 from dotenv import load_dotenv
-from db.database import get_product_details, insert_product_type
+from call_policy import CallPolicy
+from db.database import get_product_details, insert_product_type, create_classifications_table, get_classifications, insert_classification, create_image_features_table, get_image_features, insert_image_features
+from image_similarity import SimilarityIndex, compute_all_features, encode_features, decode_features
 
 # Load environment variables from .env file
 load_dotenv()
@@ -9,68 +13,261 @@ load_dotenv()
 # Load the OpenAI key
 api_key = os.getenv("OPENAI_KEY")
 
-client = OpenAI(api_key=api_key)
-    
-def run_image_processing():
+# Retries are left to the call policy so they are not done twice
+client = OpenAI(api_key=api_key, max_retries=0)
+
+# The types a shoe can be categorized into
+VALID_SHOE_TYPES = ['low', 'mid', 'high', 'basketball', 'slides']
+
+# How many vision calls can run at the same time
+MAX_WORKERS = 4
+
+# How many times to retry a vision call that failed with a retryable error
+MAX_RETRIES = 5
+
+# How many seconds each image can take, retries included
+IMAGE_DEADLINE = 120
+
+# Retries with jitter and a circuit breaker, so a failing API stops the run quickly instead of stalling every image
+vision_policy = CallPolicy(turn_deadline=IMAGE_DEADLINE, max_retries=MAX_RETRIES, base_delay=1, max_delay=60)
+
+
+def hash_image_url(image_url):
+    """
+    Returns the key of an image URL in the classification cache.
+
+    Args:
+    - image_url (str): The URL of the image.
+
+    Returns:
+    - str: The SHA-256 hash of the URL.
+    """
+    return hashlib.sha256(image_url.encode('utf-8')).hexdigest()
+
+
+def type_from_name(name):
+    """
+    Matches a shoe into a type using the keywords in its name.
+
+    Args:
+    - name (str): The name of the product.
+
+    Returns:
+    - str or None: The type of the shoe, or None if the name does not mention one.
+    """
+    name = name.lower()
+    if 'low' in name:
+        return 'low'
+    elif 'mid' in name:
+        return 'mid'
+    elif 'high' in name:
+        return 'high'
+    elif 'basketball' in name:
+        return 'basketball'
+    elif 'slides' in name:
+        return 'slides'
+    return None
+
+
+def classify_image(image_url):
+    """
+    Uses gpt vision to categorize the shoe in an image, retrying on rate limits and transient errors within the deadline of the image.
+
+    Args:
+    - image_url (str): The URL of the product image.
+
+    Returns:
+    - str: The type the model categorized the shoe into.
+    """
+    response = vision_policy.call(
+        client.chat.completions.create,
+        deadline=vision_policy.deadline(),
+        model="gpt-4o",
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "The image you are seeing is an Air Jordans product. Categorize the product in the image into one of the following: low, mid, high, basketball, slides. Only output the category and nothing else"},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_url,
+                        },
+                    },
+                ],
+            }
+        ],
+    )
+    return response.choices[0].message.content.strip().lower()
+
+
+def compute_cached_features(image_urls):
+    """
+    Computes the features of images, only downloading the images whose features are not cached yet.
+
+    Args:
+    - image_urls (list of str): The URLs of the images.
+
+    Returns:
+    - dict: Maps each image URL to its (feature vector, perceptual hash), images that failed to load are left out.
+    """
+    create_image_features_table()
+    cached = get_image_features([hash_image_url(image_url) for image_url in image_urls])
+
+    features = {}
+    missing = []
+    for image_url in image_urls:
+        if hash_image_url(image_url) in cached:
+            features[image_url] = decode_features(*cached[hash_image_url(image_url)])
+        else:
+            missing.append(image_url)
+
+    # Download and featurize the new images, and cache them for the next runs
+    computed = compute_all_features(missing)
+    insert_image_features([(hash_image_url(image_url), image_url, *encode_features(*result)) for image_url, result in computed.items()])
+    features.update(computed)
+
+    print(f"Loaded the features of {len(features) - len(computed)} images from the cache, computed {len(computed)}")
+    return features
+
+
+def classify_locally(products, shoe_types, pending):
+    """
+    Classifies images with the local image-similarity classifier, built from the products whose type is known.
+
+    Args:
+    - products (list of tuples): Each tuple contains (id, name, image_src).
+    - shoe_types (dict): Maps the id of each product whose type is known to its type.
+    - pending (set of str): The image URLs that still need a type.
+
+    Returns:
+    - dict: Maps each image URL the classifier is confident about to its type.
+    """
+    # Images of the products whose type is known
+    labeled = {}
+    for id, name, image_url in products:
+        if image_url and id in shoe_types:
+            labeled.setdefault(image_url, shoe_types[id])
+    if not labeled:
+        return {}
+
+    # Get the features of every image and build the index from the typed ones
+    features = compute_cached_features(list(labeled) + list(pending))
+    index = SimilarityIndex()
+    for image_url, shoe_type in labeled.items():
+        if image_url in features:
+            index.add(*features[image_url], shoe_type)
+
+    # Keep only the confident matches
+    results = {}
+    for image_url in pending:
+        if image_url in features:
+            shoe_type, _ = index.predict(*features[image_url])
+            if shoe_type:
+                results[image_url] = shoe_type
+
+    print(f"Local classifier categorized {len(results)} of {len(pending)} images ({len(results) / len(pending):.1%} offloaded from the API)")
+    return results
+
+
+def run_image_processing(max_workers=MAX_WORKERS, local=True, vision=True):
     """
     Uses shoes names to match them into types, if the name does not mention the shoe type we use gpt vision.
+
+    Vision calls run concurrently and each image URL and each product name is only classified once.
+    Results are saved into a classification cache keyed by the hash of the image URL so re-runs never repeat a call.
+    Images that look almost exactly like already typed products are classified locally without a vision call.
+
+    Args:
+    - max_workers (int, optional): How many vision calls can run at the same time. Default is MAX_WORKERS.
+    - local (bool, optional): Whether to try the local image-similarity classifier first. Default is True.
+    - vision (bool, optional): Whether to send the images that are still unknown to gpt vision. Default is True.
+      Without it, only the names, the classification cache and the local classifier are used.
     """
+    # Make sure the cache exists and load it
+    create_classifications_table()
+    cache = get_classifications()
+
     # Fetch all the products and their images
     products = get_product_details()
 
+    # Shoe type of each product, and the image each product name is classified by
+    shoe_types = {}
+    name_images = {}
     for product in products:
         # Get product details
         id, name, image_url = product
-        
+
         # Check if the name contains any of the keywords
-        shoe_type = None
-        if any(keyword in name.lower() for keyword in ['low', 'mid', 'high', 'basketball', 'slides']):
-            if 'low' in name.lower():
-                shoe_type = 'low'
-            elif 'mid' in name.lower():
-                shoe_type = 'mid'
-            elif 'high' in name.lower():
-                shoe_type = 'high'
-            elif 'basketball' in name.lower():
-                shoe_type = 'basketball'
-            elif 'slides' in name.lower():
-                shoe_type = 'slides'
-            else:
-                shoe_type = None  # Default case if none of the keywords match
-        
-        # If no shoe type from name, use GPT-4 to extract
+        shoe_type = type_from_name(name)
+        if shoe_type:
+            shoe_types[id] = shoe_type
+            continue
+
+        # Use the cached type of the image if it was classified before
+        if image_url and hash_image_url(image_url) in cache:
+            shoe_types[id] = cache[hash_image_url(image_url)]
+            name_images.setdefault(name, image_url)
+            continue
+
+        # Colorways of the same model share a silhouette, so classify the first image of each name only
+        # A colorway without an image must not stop the other colorways of the name from being classified
+        if image_url:
+            name_images.setdefault(name, image_url)
+
+    # Find the images that still need a vision call, every URL is only sent once
+    pending = {image_url for image_url in name_images.values() if image_url and hash_image_url(image_url) not in cache}
+
+    # Classify the images that look like already typed products locally, only ambiguous images go to the API
+    if local and pending:
+        for image_url, shoe_type in classify_locally(products, shoe_types, pending).items():
+            print(f"For image {image_url} the local classifier categorized it into type {shoe_type}")
+            cache[hash_image_url(image_url)] = shoe_type
+            insert_classification(hash_image_url(image_url), image_url, shoe_type)
+            pending.discard(image_url)
+
+    # Leave the remaining images untyped if the API should not be called
+    if not vision:
+        pending = set()
+    
+    # Run the vision calls concurrently
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {image_url: executor.submit(classify_image, image_url) for image_url in pending}
+        for image_url, future in futures.items():
+            try:
+                shoe_type = future.result()
+            except Exception as e:
+                print(f"Error categorizing image {image_url} - Error: {str(e)}")
+                continue
+
+            # Save the result so re-runs never repeat the call
+            print(f"For image {image_url} gpt vision categorized it into type {shoe_type}")
+            cache[hash_image_url(image_url)] = shoe_type
+            insert_classification(hash_image_url(image_url), image_url, shoe_type)
+
+    for product in products:
+        id, name, image_url = product
+
+        # Use the type of the product's name if the product itself is not categorized
+        shoe_type = shoe_types.get(id)
         if not shoe_type:
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": "The image you are seeing is an Air Jordans product. Categorize the product in the image into one of the following: low, mid, high, basketball, slides. Only output the category and nothing else"},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": image_url,
-                                },
-                            },
-                        ],
-                    }
-                ],
-            )
-            shoe_type = response.choices[0].message.content.strip().lower()
-            print(f"For shoe with id {id} gpt vision categorized it into type {shoe_type}")
+            image_url = name_images.get(name)
+            shoe_type = cache.get(hash_image_url(image_url)) if image_url else None
+
+        # The vision call failed, leave the product untyped so the next run retries it
+        if not shoe_type:
+            continue
 
         # Ensure shoe_type is within specified categories or default to 'low'
-        valid_shoe_types = ['low', 'mid', 'high', 'basketball', 'slides']
-        if shoe_type not in valid_shoe_types:
+        if shoe_type not in VALID_SHOE_TYPES:
             shoe_type = 'low'  # Default to 'low' if not recognized
 
         # Update the database with the shoe type
         insert_product_type(id, shoe_type)
-        
+
 # Main function to run the image processing
 def main():
     run_image_processing()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
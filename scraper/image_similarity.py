@@ -0,0 +1,391 @@
+import io
+import os
+import hashlib
+import argparse
+import requests
+import numpy as np
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+# Size of the perceptual hash, the hash has HASH_SIZE * HASH_SIZE bits
+HASH_SIZE = 8
+
+# Size of the grid the silhouette of the shoe is sampled on
+SHAPE_SIZE = 16
+
+# Number of bins per color channel of the color histogram
+COLOR_BINS = 4
+
+# How much the color histogram counts compared to the silhouette, the type of a shoe is mostly its shape
+COLOR_WEIGHT = 0.5
+
+# Images whose hashes differ by at most this many bits are treated as the same image
+MAX_HASH_DISTANCE = 4
+
+# Default directory holding the fixture product images, one folder per type (e.g. fixtures/images/low/*.png)
+DEFAULT_IMAGES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'images')
+
+# Synthetic silhouettes, they only check that the classifier runs end to end and say nothing about real images
+SYNTHETIC_IMAGES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'synthetic_images')
+
+# Size of the longest side of the downscaled fixture images
+FIXTURE_IMAGE_SIZE = 128
+
+
+def load_image(source):
+    """
+    Loads an image from a URL or a local path.
+
+    Args:
+    - source (str): The URL or path of the image.
+
+    Returns:
+    - PIL.Image.Image: The image in RGB.
+    """
+    if source.startswith('http://') or source.startswith('https://'):
+        response = requests.get(source, timeout=30)
+        response.raise_for_status()
+        return Image.open(io.BytesIO(response.content)).convert('RGB')
+    return Image.open(source).convert('RGB')
+
+
+def perceptual_hash(image):
+    """
+    Computes the difference hash of an image.
+
+    Each bit tells if a pixel of the downscaled grayscale image is brighter than its right neighbor,
+    so small changes in size, compression or color barely change the hash.
+
+    Args:
+    - image (PIL.Image.Image): The image.
+
+    Returns:
+    - numpy.ndarray: The hash as an array of HASH_SIZE * HASH_SIZE booleans.
+    """
+    pixels = np.asarray(image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE)), dtype=np.int16)
+    return (pixels[:, 1:] > pixels[:, :-1]).ravel()
+
+
+def feature_vector(image):
+    """
+    Computes a compact color and shape feature vector of a product image.
+
+    Product images show the shoe on a plain background, so the pixels that differ from the background
+    are the silhouette of the shoe. The vector holds the silhouette cropped to the shoe and resized to
+    SHAPE_SIZE x SHAPE_SIZE, the aspect ratio of the shoe, and a color histogram of the shoe pixels.
+
+    Args:
+    - image (PIL.Image.Image): The image.
+
+    Returns:
+    - numpy.ndarray: The L2 normalized float32 feature vector.
+    """
+    pixels = np.asarray(image.resize((64, 64)), dtype=np.float32) / 255
+
+    # Estimate the background color from the border of the image
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+    background = np.median(border, axis=0)
+    mask = np.abs(pixels - background).max(axis=2) > 0.08
+
+    # Crop the silhouette to the shoe so its position in the image does not matter
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if len(rows) == 0:
+        return np.zeros(SHAPE_SIZE * SHAPE_SIZE + 1 + COLOR_BINS ** 3, dtype=np.float32)
+    cropped = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    aspect = len(rows) / len(cols)
+
+    silhouette = Image.fromarray(cropped.astype(np.uint8) * 255).resize((SHAPE_SIZE, SHAPE_SIZE))
+    shape = np.asarray(silhouette, dtype=np.float32).ravel() / 255
+    shape /= np.linalg.norm(shape) or 1
+
+    # Histogram of the colors of the shoe pixels
+    quantized = np.minimum((pixels[mask] * COLOR_BINS).astype(np.int64), COLOR_BINS - 1)
+    bins = quantized[:, 0] * COLOR_BINS * COLOR_BINS + quantized[:, 1] * COLOR_BINS + quantized[:, 2]
+    colors = np.bincount(bins, minlength=COLOR_BINS ** 3).astype(np.float32)
+    colors /= np.linalg.norm(colors) or 1
+
+    vector = np.concatenate([shape, [aspect], colors * COLOR_WEIGHT]).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def compute_features(source):
+    """
+    Loads an image and computes its feature vector and perceptual hash.
+
+    Args:
+    - source (str): The URL or path of the image.
+
+    Returns:
+    - Tuple or None: A tuple containing (feature vector, perceptual hash), or None if the image could not be loaded.
+    """
+    try:
+        image = load_image(source)
+    except Exception as e:
+        print(f"Error loading image {source} - Error: {str(e)}")
+        return None
+    return feature_vector(image), perceptual_hash(image)
+
+
+def encode_features(vector, image_hash):
+    """
+    Serializes the features of an image so they can be cached.
+
+    Args:
+    - vector (numpy.ndarray): The feature vector of the image.
+    - image_hash (numpy.ndarray): The perceptual hash of the image.
+
+    Returns:
+    - Tuple: A tuple containing (vector bytes, perceptual hash bytes).
+    """
+    return vector.astype(np.float32).tobytes(), np.packbits(image_hash).tobytes()
+
+
+def decode_features(vector_bytes, hash_bytes):
+    """
+    Restores the features of an image serialized with encode_features.
+
+    Args:
+    - vector_bytes (bytes): The feature vector of the image.
+    - hash_bytes (bytes): The perceptual hash of the image.
+
+    Returns:
+    - Tuple: A tuple containing (feature vector, perceptual hash).
+    """
+    vector = np.frombuffer(vector_bytes, dtype=np.float32)
+    image_hash = np.unpackbits(np.frombuffer(hash_bytes, dtype=np.uint8))[:HASH_SIZE * HASH_SIZE].astype(bool)
+    return vector, image_hash
+
+
+def compute_all_features(sources, max_workers=8):
+    """
+    Computes the features of many images, downloading them concurrently.
+
+    Args:
+    - sources (list of str): The URLs or paths of the images.
+    - max_workers (int, optional): How many images to load at the same time. Default is 8.
+
+    Returns:
+    - dict: Maps each source to its (feature vector, perceptual hash), images that failed to load are left out.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(compute_features, sources)
+        return {source: result for source, result in zip(sources, results) if result is not None}
+
+
+class SimilarityIndex:
+    """
+    Nearest-neighbor index of product images whose type is already known.
+
+    An image gets the type of a near-duplicate image if there is one (by perceptual hash), otherwise
+    the k most similar images (by cosine similarity of the feature vectors) vote on its type. The type is
+    only returned when the match is confident, ambiguous images are left to the vision API.
+    """
+    def __init__(self, k=5, min_similarity=0.9, min_agreement=0.8):
+        # How many neighbors vote on the type of an image
+        self.k = k
+
+        # How similar the closest neighbor must be for the match to count
+        self.min_similarity = min_similarity
+
+        # Which share of the votes the winning type needs
+        self.min_agreement = min_agreement
+
+        self.vectors = []
+        self.hashes = []
+        self.labels = []
+        self.matrix = None
+        self.hash_matrix = None
+
+    def add(self, vector, image_hash, label):
+        """
+        Adds an image whose type is known to the index.
+
+        Args:
+        - vector (numpy.ndarray): The feature vector of the image.
+        - image_hash (numpy.ndarray): The perceptual hash of the image.
+        - label (str): The type of the shoe in the image.
+        """
+        self.vectors.append(vector)
+        self.hashes.append(image_hash)
+        self.labels.append(label)
+        self.matrix = None
+
+    def build(self):
+        """
+        Stacks the added images into contiguous matrices so lookups are a single matrix product.
+        """
+        self.matrix = np.vstack(self.vectors).astype(np.float32)
+        self.hash_matrix = np.vstack(self.hashes)
+
+    def predict(self, vector, image_hash):
+        """
+        Predicts the type of an image.
+
+        Args:
+        - vector (numpy.ndarray): The feature vector of the image.
+        - image_hash (numpy.ndarray): The perceptual hash of the image.
+
+        Returns:
+        - Tuple: A tuple containing (type or None if the match is not confident, confidence between 0 and 1).
+        """
+        if not self.labels:
+            return None, 0.0
+        if self.matrix is None:
+            self.build()
+
+        similarities = self.matrix @ vector
+
+        # A near-duplicate image has the same type, if its features agree as well
+        distances = (self.hash_matrix != image_hash).sum(axis=1)
+        closest = int(np.argmin(distances))
+        if distances[closest] <= MAX_HASH_DISTANCE and similarities[closest] >= self.min_similarity:
+            # The share of the hash bits both images agree on
+            return self.labels[closest], 1.0 - float(distances[closest]) / (HASH_SIZE * HASH_SIZE)
+
+        # Otherwise the most similar images vote, weighted by how similar they are
+        k = min(self.k, len(self.labels))
+        neighbors = np.argpartition(-similarities, k - 1)[:k]
+        votes = {}
+        for neighbor in neighbors:
+            label = self.labels[neighbor]
+            votes[label] = votes.get(label, 0.0) + max(float(similarities[neighbor]), 0.0)
+
+        label = max(votes, key=votes.get)
+        agreement = votes[label] / (sum(votes.values()) or 1)
+        top_similarity = float(similarities[neighbors].max())
+        confidence = agreement * top_similarity
+
+        if top_similarity >= self.min_similarity and agreement >= self.min_agreement:
+            return label, confidence
+        return None, confidence
+
+
+def evaluate(samples, **kwargs):
+    """
+    Evaluates the index with leave-one-out: each image is predicted from all of the other images.
+
+    Args:
+    - samples (list of tuples): Each tuple contains (feature vector, perceptual hash, type).
+    - kwargs: Options passed to SimilarityIndex.
+
+    Returns:
+    - dict: The number of images, the offload rate (share of images classified locally) and the accuracy
+      of the local classifications.
+    """
+    offloaded = 0
+    correct = 0
+    for i, (vector, image_hash, label) in enumerate(samples):
+        # Build the index from every other image
+        index = SimilarityIndex(**kwargs)
+        for j, (other_vector, other_hash, other_label) in enumerate(samples):
+            if i != j:
+                index.add(other_vector, other_hash, other_label)
+
+        predicted, _ = index.predict(vector, image_hash)
+        if predicted is not None:
+            offloaded += 1
+            correct += predicted == label
+
+    return {
+        'images': len(samples),
+        'offload_rate': offloaded / len(samples) if samples else 0.0,
+        'accuracy': correct / offloaded if offloaded else 0.0
+    }
+
+
+def load_fixture_samples(images_dir):
+    """
+    Loads the labeled fixture images, every folder of the directory is named after the type of its images.
+
+    Args:
+    - images_dir (str): The directory holding the fixture images.
+
+    Returns:
+    - list of tuples: Each tuple contains (feature vector, perceptual hash, type).
+    """
+    sources = []
+    for label in sorted(os.listdir(images_dir)):
+        label_dir = os.path.join(images_dir, label)
+        if os.path.isdir(label_dir):
+            sources.extend((os.path.join(label_dir, file_name), label) for file_name in sorted(os.listdir(label_dir)))
+
+    features = compute_all_features([source for source, _ in sources])
+    return [(*features[source], label) for source, label in sources if source in features]
+
+
+def load_database_samples():
+    """
+    Loads the images of the products in the database whose type is already known.
+
+    Returns:
+    - list of tuples: Each tuple contains (feature vector, perceptual hash, type).
+    """
+    from db.database import get_typed_product_images
+
+    rows = get_typed_product_images()
+    features = compute_all_features(list({image_url for image_url, _ in rows}))
+    return [(*features[image_url], label) for image_url, label in rows if image_url in features]
+
+
+def fetch_fixture_images(images_dir, per_type=8, size=FIXTURE_IMAGE_SIZE):
+    """
+    Downloads the images of typed products in the database as downscaled fixture images, one folder per type.
+
+    Args:
+    - images_dir (str): The directory to save the images to.
+    - per_type (int, optional): How many images to save per type. Default is 8.
+    - size (int, optional): Size of the longest side of the saved images. Default is FIXTURE_IMAGE_SIZE.
+
+    Returns:
+    - int: How many images were saved.
+    """
+    from db.database import get_typed_product_images
+
+    saved = 0
+    counts = {}
+    for image_url, label in get_typed_product_images():
+        if counts.get(label, 0) >= per_type:
+            continue
+        try:
+            image = load_image(image_url)
+        except Exception as e:
+            print(f"Error loading image {image_url} - Error: {str(e)}")
+            continue
+
+        # Name the image after its URL so fetching again does not duplicate it
+        image.thumbnail((size, size))
+        os.makedirs(os.path.join(images_dir, label), exist_ok=True)
+        image.save(os.path.join(images_dir, label, f"{hashlib.sha256(image_url.encode('utf-8')).hexdigest()[:16]}.png"), optimize=True)
+        counts[label] = counts.get(label, 0) + 1
+        saved += 1
+    return saved
+
+
+# Main function to evaluate the local classifier
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the local image-similarity classifier with leave-one-out.")
+    parser.add_argument("--images", default=DEFAULT_IMAGES_DIR, help="Directory of fixture images, one folder per type")
+    parser.add_argument("--database", action="store_true", help="Evaluate on the typed products in the database instead of the fixture images")
+    parser.add_argument("--fetch", action="store_true", help="Download the images of typed products in the database into --images, then exit")
+    parser.add_argument("--per-type", type=int, default=8, help="How many images per type --fetch downloads")
+    parser.add_argument("--min-similarity", type=float, default=0.9, help="How similar the closest image must be")
+    parser.add_argument("--min-agreement", type=float, default=0.8, help="Which share of the votes the winning type needs")
+    args = parser.parse_args()
+
+    if args.fetch:
+        print(f"Saved {fetch_fixture_images(args.images, per_type=args.per_type)} images into {args.images}")
+        return
+
+    if not args.database and not os.path.isdir(args.images):
+        print(f"No fixture images found in {args.images}, download them with --fetch or use --images {SYNTHETIC_IMAGES_DIR}")
+        return
+
+    samples = load_database_samples() if args.database else load_fixture_samples(args.images)
+    result = evaluate(samples, min_similarity=args.min_similarity, min_agreement=args.min_agreement)
+    print(f"Images: {result['images']}")
+    print(f"Offload rate: {result['offload_rate']:.1%}")
+    print(f"Accuracy of local classifications: {result['accuracy']:.1%}")
+
+if __name__ == '__main__':
+    main()
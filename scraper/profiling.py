@@ -0,0 +1,77 @@
+import os
+import re
+import io
+import cProfile
+import pstats
+from contextlib import contextmanager
+
+
+class Profiler:
+    """
+    Collects a cProfile profile per unit of work (a conversation turn or a scraped product).
+
+    Every profile is written to the output directory in pstats format (open it with snakeviz, or
+    `python -m pstats`), and the profiles are combined into an aggregated summary of the hottest functions.
+    """
+    def __init__(self, output_dir, top=20):
+        # Directory the profiles are written to
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+        # How many functions the summary shows
+        self.top = top
+
+        # Combined stats of every profile and how many profiles there were
+        self.stats = None
+        self.count = 0
+
+    @contextmanager
+    def profile(self, label):
+        """
+        Profiles the code inside the block and writes the profile to the output directory.
+
+        Args:
+        - label (str): Name of the unit of work, used in the file name (e.g., "turn-1").
+        """
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+            # Write the profile with a file name that sorts in the order they ran
+            self.count += 1
+            slug = re.sub(r'[^a-z0-9]+', '-', str(label).lower()).strip('-')[:60]
+            profile.dump_stats(os.path.join(self.output_dir, f'{self.count:04d}-{slug}.prof'))
+
+            # Add the profile to the combined stats
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+    def summary(self):
+        """
+        Writes the combined profile and returns the top functions by time spent inside them.
+
+        Returns:
+        - str: The summary, or an empty string if nothing was profiled.
+        """
+        if self.stats is None:
+            return ''
+
+        self.stats.dump_stats(os.path.join(self.output_dir, 'combined.prof'))
+
+        output = io.StringIO()
+        self.stats.stream = output
+        self.stats.sort_stats('tottime').print_stats(self.top)
+        return f"Profiled {self.count} units, profiles written to {self.output_dir}\n{output.getvalue()}"
+
+    def print_summary(self):
+        """
+        Prints the summary of the hottest functions.
+        """
+        summary = self.summary()
+        if summary:
+            print(summary)
@@ -0,0 +1,230 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# Default directory holding the recorded responses
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'db', 'responses')
+
+# Default cap on the size of the compressed responses (1 GB)
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# How many reads are remembered before their last use times are written to the index
+USAGE_FLUSH_SIZE = 256
+
+
+class ResponseStore:
+    """
+    Content-addressed store of raw HTTP responses kept on disk.
+
+    Every response is compressed and saved once under the SHA-256 hash of its content, and an index maps
+    each URL to the hash of its latest response and its HTTP status. When the compressed responses grow
+    over the size cap, the least recently used ones are removed. Reads only remember when each response
+    was used, and the times are written to the index in batches.
+    """
+    def __init__(self, path=DEFAULT_STORE_DIR, max_bytes=DEFAULT_MAX_BYTES, track_usage=True):
+        # Directory holding the compressed responses
+        self.path = path
+        self.objects_dir = os.path.join(path, 'objects')
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+        # Cap on the size of the compressed responses
+        self.max_bytes = max_bytes
+
+        # Read-only users like replaying never evict anything, so they do not track when responses are used
+        self.track_usage = track_usage
+
+        # Last use time of the responses read since the last flush, keyed by hash
+        self.pending_usage = {}
+
+        # The index can be used from the threads fetching pages concurrently
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(path, 'index.db'), check_same_thread=False)
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            hash TEXT,
+            fetched_at REAL,
+            status INTEGER
+        )
+        ''')
+
+        # Stores recorded before the status was kept get the column
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(responses)')]
+        if 'status' not in columns:
+            self.conn.execute('ALTER TABLE responses ADD COLUMN status INTEGER')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS objects (
+            hash TEXT PRIMARY KEY,
+            size INTEGER,
+            last_used REAL
+        )
+        ''')
+        self.conn.commit()
+
+    def object_path(self, content_hash):
+        """
+        Returns the path of the compressed response with the given hash.
+
+        Args:
+        - content_hash (str): The SHA-256 hash of the response.
+
+        Returns:
+        - str: The path of the compressed response.
+        """
+        return os.path.join(self.objects_dir, content_hash[:2], f'{content_hash}.gz')
+
+    def put(self, url, content, status=200):
+        """
+        Saves the response of a URL into the store.
+
+        Args:
+        - url (str): The URL the response was fetched from.
+        - content (str): The body of the response.
+        - status (int, optional): The HTTP status of the response. Default is 200.
+
+        Returns:
+        - str: The SHA-256 hash of the response.
+        """
+        data = content.encode('utf-8')
+        content_hash = hashlib.sha256(data).hexdigest()
+        now = time.time()
+
+        with self.lock:
+            # Only write the response if the same content is not saved already
+            row = self.conn.execute('SELECT 1 FROM objects WHERE hash = ?', (content_hash,)).fetchone()
+            if not row:
+                path = self.object_path(content_hash)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                # Write to a temporary file first so a crash never leaves a partial response
+                compressed = gzip.compress(data)
+                tmp_path = f'{path}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(compressed)
+                os.replace(tmp_path, path)
+
+                self.conn.execute('INSERT INTO objects (hash, size, last_used) VALUES (?, ?, ?)', (content_hash, len(compressed), now))
+            else:
+                self.conn.execute('UPDATE objects SET last_used = ? WHERE hash = ?', (now, content_hash))
+
+            # Point the URL to its latest response
+            self.conn.execute('INSERT OR REPLACE INTO responses (url, hash, fetched_at, status) VALUES (?, ?, ?, ?)', (url, content_hash, now, status))
+            self.conn.commit()
+
+            self.enforce_size_cap()
+
+        return content_hash
+
+    def get(self, url):
+        """
+        Returns the latest response of a URL.
+
+        Args:
+        - url (str): The URL to look up.
+
+        Returns:
+        - str or None: The body of the response, or None if the URL was never recorded.
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT hash FROM responses WHERE url = ?', (url,)).fetchone()
+            if not row:
+                return None
+
+            # Remember the use, the index is only written once enough reads add up
+            if self.track_usage:
+                self.pending_usage[row[0]] = time.time()
+                if len(self.pending_usage) >= USAGE_FLUSH_SIZE:
+                    self.flush_usage()
+
+        return self.get_by_hash(row[0])
+
+    def flush_usage(self):
+        """
+        Writes the last use times of the responses read since the last flush to the index.
+
+        Must be called while holding the lock.
+        """
+        if not self.pending_usage:
+            return
+        self.conn.executemany('UPDATE objects SET last_used = MAX(last_used, ?) WHERE hash = ?', [(used, content_hash) for content_hash, used in self.pending_usage.items()])
+        self.conn.commit()
+        self.pending_usage = {}
+
+    def close(self):
+        """
+        Writes the pending use times and closes the index.
+        """
+        with self.lock:
+            self.flush_usage()
+            self.conn.close()
+
+    def get_by_hash(self, content_hash):
+        """
+        Returns the response with the given hash.
+
+        Args:
+        - content_hash (str): The SHA-256 hash of the response.
+
+        Returns:
+        - str or None: The body of the response, or None if it is not in the store.
+        """
+        try:
+            with open(self.object_path(content_hash), 'rb') as f:
+                return gzip.decompress(f.read()).decode('utf-8')
+        except FileNotFoundError:
+            return None
+
+    def urls(self):
+        """
+        Returns every recorded URL.
+
+        Returns:
+        - list of str: The recorded URLs in the order they were fetched.
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT url FROM responses ORDER BY fetched_at').fetchall()
+        return [row[0] for row in rows]
+
+    def items(self):
+        """
+        Iterates over every recorded URL and its latest response.
+
+        Yields:
+        - Tuple: A tuple containing (url, body of the response).
+        """
+        for url in self.urls():
+            content = self.get(url)
+            if content is not None:
+                yield url, content
+
+    def enforce_size_cap(self):
+        """
+        Removes the least recently used responses until the store is under its size cap.
+
+        Must be called while holding the lock.
+        """
+        # The responses read recently must not look unused
+        self.flush_usage()
+
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self.conn.execute('SELECT hash, size FROM objects ORDER BY last_used').fetchall()
+        for content_hash, size in rows:
+            if total <= self.max_bytes:
+                break
+
+            # Remove the response and every URL pointing to it
+            try:
+                os.remove(self.object_path(content_hash))
+            except FileNotFoundError:
+                pass
+            self.conn.execute('DELETE FROM objects WHERE hash = ?', (content_hash,))
+            self.conn.execute('DELETE FROM responses WHERE hash = ?', (content_hash,))
+            total -= size
+
+        self.conn.commit()
@@ -1,10 +1,85 @@
+import argparse
+import atexit
 from selenium import webdriver
-from bs4 import BeautifulSoup
-from db.database import create_products_table, insert_product
+from db.database import create_products_table, insert_product, create_staging_database, publish_staging_database, rollback_catalog, build_name_index, update_semantic_index, carry_over_types, MAX_UNTYPED_SHARE
+from extraction import extract_product_cards, extract_product_details, extract_product_colors
+from feed import FEED_URL, FEED_HEADERS, discover_product_cards
 from image_processing import run_image_processing
+from profiling import Profiler
+from response_store import ResponseStore, DEFAULT_STORE_DIR, DEFAULT_MAX_BYTES
 import requests
 import time
-import re
+
+# Store of the raw responses, set by main when recording or replaying
+response_store = None
+
+# If True every page is read from the response store instead of the browser or the network
+replay = False
+
+# Profiler of every scraped product, set by main when profiling
+profiler = None
+
+
+def get_recorded_response(url):
+    """
+    Returns the recorded response of a URL when replaying.
+
+    Args:
+    - url (str): The URL to look up.
+
+    Returns:
+    - str: The body of the recorded response.
+
+    Raises:
+    - LookupError: If the URL was never recorded.
+    """
+    content = response_store.get(url)
+    if content is None:
+        raise LookupError(f'No recorded response for {url}')
+    return content
+
+
+def fetch_url(url, headers=None):
+    """
+    Fetches the body of a URL with a plain HTTP request, recording or replaying it if a response store is set.
+
+    Args:
+    - url (str): The URL to fetch.
+    - headers (dict, optional): Headers to send with the request.
+
+    Returns:
+    - str: The body of the response.
+    """
+    if replay:
+        return get_recorded_response(url)
+
+    response = requests.get(url, headers=headers, timeout=30)
+    
+    # Record error pages too with their status, the live run parses them as well so replaying must see the same
+    if response_store is not None:
+        response_store.put(url, response.text, status=response.status_code)
+    return response.text
+
+
+def fetch_feed_url(url):
+    """
+    Fetches the body of a product feed page, recording or replaying it if a response store is set.
+
+    Args:
+    - url (str): The URL of the feed page.
+
+    Returns:
+    - str: The body of the response.
+    """
+    if replay:
+        return get_recorded_response(url)
+
+    response = requests.get(url, headers=FEED_HEADERS, timeout=30)
+    response.raise_for_status()
+    if response_store is not None:
+        response_store.put(url, response.text)
+    return response.text
+
 
 def get_page_content(url):
     """
@@ -18,7 +93,10 @@ def get_page_content(url):
     
     This function initializes a headless Chrome WebDriver, navigates to the given URL,
     waits for product images to load, and then retrieves the page source.
+    When replaying, the recorded page is returned instead.
     """
+    if replay:
+        return get_recorded_response(url)
     
     # Imitate a chrome web driver
     options = webdriver.ChromeOptions()
@@ -48,10 +126,48 @@ def get_page_content(url):
     content = driver.page_source
     driver.quit()
     
+    # Record the page so it can be re-parsed later
+    if response_store is not None:
+        response_store.put(url, content)
+    
     # Return the content
     return content
 
 
+def get_product_page(url):
+    """
+    Fetches the HTML content of a product page using Selenium WebDriver.
+
+    Args:
+    - url (str): The URL of the product page.
+
+    Returns:
+    - str: The HTML content of the product page.
+
+    When replaying, the recorded page is returned instead.
+    """
+    if replay:
+        return get_recorded_response(url)
+
+    # Imitate a chrome web driver
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless') # So we do not open the GUI
+    driver = webdriver.Chrome(options=options)
+    driver.get(url)
+    
+    time.sleep(1)  # Wait for the page to load so images are not placeholders
+    
+    # Fetch the content then close the web driver
+    content = driver.page_source
+    driver.quit()
+    
+    # Record the page so it can be re-parsed later
+    if response_store is not None:
+        response_store.put(url, content)
+    
+    return content
+
+
 def parse_product_card(product_card):
     """
     Parses the product card to extract various details including product name, promotion status, price, image source,
@@ -60,7 +176,8 @@ def parse_product_card(product_card):
     Adds the product and all of its different colors into the DB.
 
     Args:
-    - product_card (BeautifulSoup Tag): The BeautifulSoup Tag object representing the product card.
+    - product_card (dict): The product card as returned by extract_product_cards, with the keys
+      name, url, promotion_status, price and image_url.
 
     Returns:
     Tuple: A tuple containing the following elements in order:
@@ -74,70 +191,35 @@ def parse_product_card(product_card):
         - Description (str): Description of the product
 
     Notes:
-    - This function uses BeautifulSoup and Selenium WebDriver to navigate and extract data from web pages.
-    - It assumes specific HTML structure and class names for locating elements.
+    - This function uses Selenium WebDriver to load the product page and the extraction module to parse it.
+    - The extraction module tries the JSON Nike embeds in the page first, then falls back to parsing the HTML.
     - Uses Chrome WebDriver in headless mode (--headless) to avoid opening a GUI.
     - Waits for the page to load to ensure correct extraction of data.
+    - When replaying, every page is read from the response store so no browser or network is used.
     """
-    # Extract product name and URL
-    link = product_card.find('a', class_='product-card__link-overlay')
-    name = link.text.strip()
-    url = link['href']
-    
-    # Extract messaging if exists
+    # Extract product name, URL, messaging, price and image from the card
     # Messaging can be something like "Just coming in" or "On Sale"
-    message_tag = product_card.find('div', {'data-testid': 'product-card__messaging'})
-    promotion_status = message_tag.text.strip() if message_tag else None
-    
-    # Extract price if exists
-    price_tag = product_card.find('div', {'data-testid': 'product-card__price'})
-    price = price_tag.text.strip() if price_tag else None
-    
-    # Extract the image of product
-    image_tag = product_card.find('img', class_=re.compile(r'^product-card__hero-image'))
-    image_url = image_tag['src'] if image_tag else None
+    name = product_card['name']
+    url = product_card['url']
+    promotion_status = product_card['promotion_status']
+    price = product_card['price']
+    image_url = product_card['image_url']
     
     # Now we will use the web driver again to enter the product page and fetch more details
     # We will fetch the color of the shoe, its id and any other colors that shoe has
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless') # So we do not open the GUI
-    driver = webdriver.Chrome(options=options)
-    driver.get(url)
-    
-    time.sleep(1)  # Wait for the page to load so images are not placeholders
-        
     # Parse product details
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    
-    # Extract Product description
-    description_element = soup.find('div',class_=re.compile(r'^description-preview'))
-    if description_element:   
-        p_tag = description_element.find('p')
-        description = p_tag.text.strip() if p_tag else None
-    else:
-        description = None
-    
-    # Extract "Shown:" details
-    shown_element = soup.find('li', class_='description-preview__color-description')
-    colors = shown_element.text.split('Shown:')[1].strip() if shown_element else None
-    
-    # Extract "Style:" details
-    style_element = soup.find('li', class_='description-preview__style-color')
-    product_id = style_element.text.split('Style:')[1].strip() if style_element else None
+    details = extract_product_details(get_product_page(url))
+    product_id = details['product_id']
+    colors = details['colors']
+    description = details['description']
     
     # For other colors of the shoe extract their URLs, image url, and id
-    colorway_div = soup.find('div', id='ColorwayDiv')
-    if colorway_div:
-        colorway_containers = colorway_div.find_all('div', class_=re.compile(r'^css-7aigzk colorway-container'))
+    if details['colorways']:
         # Go over each color of the same product
-        for container in colorway_containers:
-            # Find the product id of the color
-            input_tag = container.find('input', {'name': 'pdp-colorpicker'})
-            product_id = input_tag['data-style-color'] if input_tag else None
-            
-            # Find the image url of the color
-            img_tag = container.find('img')
-            image_url = img_tag['src'] if img_tag else None
+        for colorway in details['colorways']:
+            # Get the product id and image url of the color
+            product_id = colorway['product_id']
+            image_url = colorway['image_url']
             
             # Construct the url of the product color using the parent url
             parent_url = url.split('/')
@@ -146,12 +228,15 @@ def parse_product_card(product_card):
             
             # Parse the child product details
             # Can use this later to parse sizes as well
-            cur_request = requests.get(cur_url)
-            soup = BeautifulSoup(cur_request.text, 'html.parser')
+            try:
+                cur_content = fetch_url(cur_url)
+            except LookupError as e:
+                # The colorway was never recorded, skip only this colorway when replaying
+                print(f'Error fetching colorway: {cur_url} - Error: {str(e)}')
+                continue
             
             # Extract "Shown:" details
-            shown_element = soup.find('li', class_='description-preview__color-description')
-            colors = shown_element.text.split('Shown:')[1].strip() if shown_element else None
+            colors = extract_product_colors(cur_content)
             
             # Enter child product into the db
             try:
@@ -182,42 +267,130 @@ def parse_product_card(product_card):
             )
         except Exception as e:
             print(f'Error inserting product: {name} - Error: {str(e)}')
-             
-    # Close the web browser after the use
-    driver.quit()
     
     # Returns tuple, used this mainly to print information to make sure everything ran smoothly
     return (product_id, name, promotion_status, price, colors, url, image_url, description)
 
 
-def scrape_main_page(base_url):
+def scrape_main_page(base_url, discovery='feed', feed_url=FEED_URL):
     """
     Scrapes the main page of a website to extract product information from product cards.
 
     Args:
     - base_url (str): The base URL of the main page to scrape.
+    - discovery (str, optional): How to discover the products, "feed" requests the listing's product feed
+      directly and "browser" scrolls the page with Selenium. Default is "feed".
+    - feed_url (str, optional): The URL of the product feed endpoint. Default is Nike's product wall endpoint.
     """
-    content = get_page_content(base_url)
-    soup = BeautifulSoup(content, 'html.parser')
+    product_cards = None
     
-    # Find all product card elements
-    product_cards = soup.find_all('div', class_='product-card__body')
+    # Request the product feed directly, this is much faster than scrolling the page
+    if discovery == 'feed':
+        try:
+            product_cards = list(discover_product_cards(base_url, feed_url=feed_url, fetch=fetch_feed_url))
+        except (requests.RequestException, ValueError, LookupError) as e:
+            print(f'Error discovering products from the feed, falling back to the browser - Error: {str(e)}')
+    
+    # Fall back to scrolling the page with the browser
+    if not product_cards:
+        try:
+            content = get_page_content(base_url)
+        except LookupError as e:
+            # The page was never recorded, there is nothing to parse when replaying
+            print(f'Error fetching the main page: {base_url} - Error: {str(e)}')
+            return
+        product_cards = extract_product_cards(content)
+    
+    # Parse every product card
     for product_card in product_cards:
-        parse_product_card(product_card)
+        try:
+            if profiler:
+                with profiler.profile(product_card['name']):
+                    parse_product_card(product_card)
+            else:
+                parse_product_card(product_card)
+        except LookupError as e:
+            # A page was never recorded, skip the product when replaying
+            print(f'Error parsing product: {product_card["name"]} - Error: {str(e)}')
 
 # Main function to run the scraper
 def main():
+    # Parse how the products should be discovered
+    parser = argparse.ArgumentParser(description="Scraper for Nike Air Jordan products.")
+    parser.add_argument("--discovery", choices=["feed", "browser"], default="feed", help="Discover products from the product feed or by scrolling the page")
+    parser.add_argument("--feed-url", default=FEED_URL, help="URL of the product feed endpoint (e.g., a local feed_server.py)")
+    parser.add_argument("--store", choices=["record", "replay"], help="Record every fetched page into the response store, or re-parse the recorded pages without a browser or network")
+    parser.add_argument("--store-dir", default=DEFAULT_STORE_DIR, help="Directory of the response store")
+    parser.add_argument("--store-max-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help="Size cap of the response store in MB")
+    parser.add_argument("--in-place", action="store_true", help="Write into the published catalog instead of building and publishing a new generation")
+    parser.add_argument("--keep-generations", type=int, default=2, help="How many published catalog generations to keep for rollback")
+    parser.add_argument("--allow-untyped", action="store_true", help="Publish the catalog even if many of its products have no type")
+    parser.add_argument("--rollback", action="store_true", help="Point readers back at the previous catalog generation and exit")
+    parser.add_argument("--profile", nargs="?", const="profiles", help="Profile every scraped product and write the profiles to this directory (default: profiles)")
+    parser.add_argument("--profile-top", type=int, default=20, help="How many of the hottest functions the profile summary shows")
+    args = parser.parse_args()
+    
+    # Switch readers back to the previous generation without scraping
+    if args.rollback:
+        try:
+            print(f"Readers now use catalog {rollback_catalog()}")
+        except ValueError as e:
+            print(f'Error rolling back the catalog - Error: {str(e)}')
+        return
+    
+    # Set up the response store
+    global response_store, replay, profiler
+    if args.store:
+        replay = args.store == 'replay'
+        response_store = ResponseStore(args.store_dir, max_bytes=args.store_max_mb * 1024 * 1024, track_usage=not replay)
+        atexit.register(response_store.close)
+    
+    # Profile every product and print the hottest functions on exit
+    if args.profile:
+        profiler = Profiler(args.profile, top=args.profile_top)
+        atexit.register(profiler.print_summary)
+    
     # Define the base url to scrape from
     base_url = 'https://www.nike.com/w/mens-jordan-shoes-37eefznik1zy7ok'
     
-    # Create the DB table if it does not exist
-    create_products_table()
+    # Build the catalog in a staging database so readers never see a half-built or half-classified catalog
+    staging_path = None
+    if args.in_place:
+        # Create the DB table if it does not exist
+        create_products_table()
+    else:
+        staging_path = create_staging_database()
+        print(f"Building the catalog in {staging_path}")
     
     # Parse and save products
-    scrape_main_page(base_url=base_url)
+    scrape_main_page(base_url=base_url, discovery=args.discovery, feed_url=args.feed_url)
     
     # Run image processing to filter the shoes into types
-    run_image_processing()
+    # Replaying only re-parses the recorded pages, so it never calls the API or downloads images,
+    # the names and the cached classifications are used instead
+    run_image_processing(local=not replay, vision=not replay)
+    
+    # Keep the types of the published catalog for the products that are still untyped
+    if staging_path:
+        print(f"Carried over the type of {carry_over_types()} products from the published catalog")
+    
+    # Rebuilding the indexes rewrites tables and files readers are using, so it only runs on a staging catalog
+    if not staging_path:
+        print("Skipped the name and semantic indexes, they are only rebuilt when a new catalog generation is built")
+        return
+    
+    # Index the product names so misspelled and shorthand names still find products
+    build_name_index()
+    
+    # Embed the new and changed products for the semantic search
+    print(f"Updated the semantic index: {update_semantic_index()}")
+    
+    # Swap readers over to the new catalog
+    try:
+        max_untyped_share = 1.0 if args.allow_untyped else MAX_UNTYPED_SHARE
+        print(f"Published catalog {publish_staging_database(staging_path, keep=args.keep_generations, max_untyped_share=max_untyped_share)}")
+    except ValueError as e:
+        print(f'Error publishing the catalog - Error: {str(e)}')
 
 if __name__ == '__main__':
     main()
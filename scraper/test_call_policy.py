@@ -0,0 +1,166 @@
+import importlib
+import os
+import sys
+import threading
+import time
+import pytest
+from openai import OpenAI, BadRequestError, InternalServerError
+from call_policy import CallPolicy, CircuitBreaker, CircuitOpenError
+
+# The stand-in and the assistant live in the repository root, which is not on the path when pytest runs from this folder
+SCRAPER_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRAPER_DIR)
+if ROOT_DIR not in [os.path.abspath(path or '.') for path in sys.path]:
+    sys.path.append(ROOT_DIR)
+from openai_stub import OpenAIStub, load_behavior, start_stub_server
+MESSAGES = [{"role": "user", "content": "Show me Air Jordan 1s"}]
+
+
+@pytest.fixture
+def stub():
+    behavior = load_behavior()
+    behavior.update({"tool_selection_latency": 0.01, "first_token_latency": 0.01, "tokens_per_second": 2000, "jitter": 0, "slow_latency": 1.0})
+    return OpenAIStub(behavior)
+
+
+@pytest.fixture
+def client(stub):
+    server, url = start_stub_server(stub)
+    yield OpenAI(api_key='x', base_url=url, max_retries=0)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def assistant_modules(monkeypatch):
+    """
+    Imports the assistant and the call policy module it uses. While the scraper folder is on the path
+    scraper.py shadows the scraper package the assistant imports from, so it is left out of the path.
+    """
+    monkeypatch.setattr(sys, 'path', [path for path in sys.path if os.path.abspath(path or '.') != SCRAPER_DIR])
+    return importlib.import_module('assistant'), importlib.import_module('scraper.call_policy')
+
+
+def complete(policy, client, **kwargs):
+    return policy.call(client.chat.completions.create, model='stub', messages=MESSAGES, **kwargs)
+
+
+def test_retries_until_the_call_succeeds(stub, client):
+    stub.update_behavior({"error_rate": 0.5})
+    policy = CallPolicy(max_retries=20, base_delay=0.001, max_delay=0.01)
+    for _ in range(10):
+        assert complete(policy, client).choices[0].message.content
+
+    # Every injected error cost exactly one retry, and retried calls that succeeded keep the circuit closed
+    assert stub.faults > 0
+    assert stub.requests['chat/completions'] == 10 + stub.faults
+    assert policy.breaker.state == 'closed'
+
+
+def test_gives_up_after_the_last_retry(stub, client):
+    stub.update_behavior({"error_rate": 1.0})
+    policy = CallPolicy(max_retries=2, base_delay=0.001, max_delay=0.01)
+    with pytest.raises(InternalServerError):
+        complete(policy, client)
+    assert stub.requests['chat/completions'] == 3
+    assert policy.breaker.failures == 1
+
+
+def test_circuit_opens_probes_and_closes(stub, client):
+    stub.update_behavior({"error_rate": 1.0})
+    policy = CallPolicy(max_retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.2))
+    for _ in range(2):
+        with pytest.raises(InternalServerError):
+            complete(policy, client)
+    assert policy.breaker.state == 'open'
+
+    # While the circuit is open calls fail fast without a request
+    with pytest.raises(CircuitOpenError):
+        complete(policy, client)
+    assert stub.requests['chat/completions'] == 2
+
+    # A failing probe opens the circuit again
+    time.sleep(0.25)
+    with pytest.raises(InternalServerError):
+        complete(policy, client)
+    assert policy.breaker.state == 'open'
+
+    # Only one probe goes through while the circuit is half open, and its success closes the circuit
+    time.sleep(0.25)
+    stub.update_behavior({"error_rate": 0.0, "slow_rate": 1.0, "slow_latency": 0.3})
+    probe = threading.Thread(target=complete, args=(policy, client))
+    probe.start()
+    time.sleep(0.1)
+    assert policy.breaker.state == 'half_open'
+    with pytest.raises(CircuitOpenError):
+        complete(policy, client)
+    probe.join()
+    assert policy.breaker.state == 'closed'
+
+
+def test_bad_request_does_not_close_a_half_open_circuit(stub, client):
+    stub.update_behavior({"error_rate": 1.0, "error_status": 400})
+    policy = CallPolicy(max_retries=3, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.1))
+    policy.breaker.record_failure()
+    time.sleep(0.15)
+
+    # The bad request is not retried, and the circuit stays open for the next probe
+    with pytest.raises(BadRequestError):
+        complete(policy, client)
+    assert stub.requests['chat/completions'] == 1
+    assert policy.breaker.state == 'open'
+    assert policy.breaker.failures == 1
+
+
+def test_slow_call_is_hedged(stub, client):
+    policy = CallPolicy(hedge=True, hedge_min_samples=5)
+    policy.latencies.extend([0.2] * 5)
+
+    # The first request is slow, the duplicate sent after the p95 of 0.2 seconds is not
+    stub.update_behavior({"slow_rate": 1.0})
+    threading.Timer(0.1, stub.update_behavior, args=({"slow_rate": 0.0},)).start()
+    start = time.perf_counter()
+    assert complete(policy, client, hedgeable=True).choices[0].message.content
+    assert time.perf_counter() - start < 0.9
+    assert policy.hedges == 1
+    assert stub.requests['chat/completions'] == 2
+
+
+def test_failing_api_gives_degraded_turns(stub, client, assistant_modules):
+    assistant_module, call_policy = assistant_modules
+    Assistant = assistant_module.Assistant
+    policy = call_policy.CallPolicy(max_retries=0, breaker=call_policy.CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    question = "Show me Air Jordan 1s"
+
+    # Answer the opening question while the API works
+    assistant = Assistant(client=client, policy=policy)
+    answer = "".join(assistant.generate_response(question))
+    assert not assistant.degraded
+
+    # During the outage the opening question of another conversation gets the cached answer
+    stub.update_behavior({"error_rate": 1.0})
+    other = Assistant(client=client, policy=policy)
+    assert "".join(other.generate_response(question)) == answer
+    assert other.degraded
+    assert policy.breaker.state == 'open'
+
+    # A follow-up question is never answered with the answer it got in another conversation
+    follow_up = Assistant(client=client, policy=policy)
+    follow_up.messages.extend([{"role": "user", "content": "Show me Air Jordan 4s"}, {"role": "assistant", "content": "Here are some Air Jordan 4s."}])
+    degraded_answer = "".join(follow_up.generate_response(question))
+    assert follow_up.degraded
+    assert degraded_answer != answer
+    assert degraded_answer.startswith("Sorry")
+
+
+def test_turn_running_out_of_time_mid_stream_is_not_a_failure(stub, client, assistant_modules):
+    assistant_module, call_policy = assistant_modules
+    stub.update_behavior({"tokens_per_second": 20, "answers": [" ".join(["word"] * 200)]})
+    policy = call_policy.CallPolicy(turn_deadline=0.5)
+    assistant = assistant_module.Assistant(client=client, policy=policy)
+
+    # The answer is cut off where the deadline ran out
+    answer = "".join(assistant.generate_response("Show me Air Jordan 1s"))
+    assert 0 < len(answer.split()) < 200
+    assert policy.breaker.failures == 0
+    assert policy.breaker.state == 'closed'
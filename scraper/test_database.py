@@ -0,0 +1,94 @@
+import json
+import sqlite3
+import pytest
+from db import database
+
+# Names of the test catalog, the Air Jordan 11 is there so "air jordan 1" can be checked not to find it
+CATALOG_NAMES = [
+    'air jordan 1 low',
+    'air jordan 1 mid',
+    'air jordan 1 mid se',
+    'air jordan 1 retro high og "latte"',
+    'air jordan 11 retro "bred"',
+    'air jordan 4 retro "oxidized green"',
+    'jordan spizike low',
+    'jumpman mvp',
+    'luka 2',
+    'jordan 2/3'
+]
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    database.set_database_path(str(tmp_path / 'catalog.db'))
+    database.create_products_table()
+    for i, name in enumerate(CATALOG_NAMES):
+        database.insert_product(str(i), name, 'Just In', '$120', 'black', '', '', 'leather upper')
+    database.build_name_index()
+    yield
+    database.set_database_path(None)
+
+
+def found_names(name):
+    """
+    Returns the names of the products a name search finds.
+    """
+    response = json.loads(database.search_products(name=name))
+    return sorted(product['name'] for product in response['products'])
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('air jordan 1', ['air jordan 1 low', 'air jordan 1 mid', 'air jordan 1 mid se', 'air jordan 1 retro high og "latte"']),
+    ('air jordan 11', ['air jordan 11 retro "bred"']),
+    ('latte', ['air jordan 1 retro high og "latte"']),
+    ('jordan 2', ['jordan 2/3'])
+])
+def test_name_matches_whole_words(catalog, name, expected):
+    assert found_names(name) == expected
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('aj1 lo', ['air jordan 1 low']),
+    ('aj11', ['air jordan 11 retro "bred"']),
+    ('aj4', ['air jordan 4 retro "oxidized green"'])
+])
+def test_shorthand_is_expanded(catalog, name, expected):
+    assert found_names(name) == expected
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('air jordn 1 mid', ['air jordan 1 mid', 'air jordan 1 mid se']),
+    ('jordan spizke low', ['jordan spizike low']),
+    ('jumpmn mvp', ['jumpman mvp']),
+    ('luka2', ['luka 2'])
+])
+def test_typos_find_the_most_similar_names(catalog, name, expected):
+    assert found_names(name) == expected
+
+
+@pytest.mark.parametrize('name', [
+    # Model numbers that are not in the catalog never fall back to another model
+    'aj9',
+    'air jordan 12 retro',
+    # A colorway is not a model, and no product of the catalog is called that
+    'chicago',
+    'nike dunk low'
+])
+def test_unknown_names_find_nothing(catalog, name):
+    assert found_names(name) == []
+
+
+def test_retired_aliases_are_removed(catalog):
+    with sqlite3.connect(database.get_database_file()) as conn:
+        conn.execute("INSERT OR REPLACE INTO name_aliases (alias, name) VALUES ('chicago', 'air jordan 1 retro high og')")
+    database.build_name_index()
+    assert found_names('chicago') == []
+
+
+def test_keyword_fallback_finds_products_without_a_description(catalog):
+    database.insert_product('no-description', 'jordan outdoor court', 'Just In', '$90', 'black', '', '', None)
+
+    # The test catalog has no semantic index, so the words of the query are counted instead
+    response = json.loads(database.semantic_search('outdoor court'))
+    assert response['fallback'] == 'keyword'
+    assert response['products'][0]['name'] == 'jordan outdoor court'
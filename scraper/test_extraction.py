@@ -0,0 +1,32 @@
+import pytest
+from benchmark_extraction import DEFAULT_FIXTURES_DIR, load_fixtures
+from extraction import extract_product_details, extract_product_colors, get_default_parser
+
+# Every saved page that has expected details
+FIXTURES = [(name, html, expected) for name, html, expected in load_fixtures(DEFAULT_FIXTURES_DIR) if expected is not None]
+
+# The ways a page can be extracted: the embedded JSON first, or only the HTML with each parser
+PATHS = {
+    'default': {},
+    'bs4': {'use_next_data': False, 'parser': 'bs4'},
+    'lxml': {'use_next_data': False, 'parser': 'lxml'}
+}
+
+
+@pytest.mark.parametrize('path', PATHS)
+@pytest.mark.parametrize('name, html, expected', FIXTURES, ids=[name for name, _, _ in FIXTURES])
+def test_extracts_expected_details(name, html, expected, path):
+    if path == 'lxml' and get_default_parser() != 'lxml':
+        pytest.skip('lxml is not installed')
+
+    details = extract_product_details(html, **PATHS[path])
+
+    assert details['product_id'] == expected['product_id']
+    assert details['colors'] == expected['colors']
+    assert details['description'] == expected['description']
+    assert details['colorways'] == expected['colorways']
+
+
+@pytest.mark.parametrize('name, html, expected', FIXTURES, ids=[name for name, _, _ in FIXTURES])
+def test_extracts_colors_of_a_colorway(name, html, expected):
+    assert extract_product_colors(html) == expected['colors']
@@ -0,0 +1,49 @@
+import json
+import os
+import pytest
+import requests
+from feed import discover_product_cards, product_to_card
+from feed_server import start_feed_server, DEFAULT_PAGES_DIR
+
+LISTING_URL = 'https://www.nike.com/w/mens-jordan-shoes-37eefznik1zy7ok'
+
+
+@pytest.fixture
+def feed_url():
+    server, url = start_feed_server()
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def recorded_cards():
+    """
+    Returns the product cards of the recorded feed pages in the order of their anchors.
+    """
+    cards = []
+    anchors = sorted(int(file_name.split('.')[0]) for file_name in os.listdir(DEFAULT_PAGES_DIR) if file_name.endswith('.json'))
+    for anchor in anchors:
+        with open(os.path.join(DEFAULT_PAGES_DIR, f'{anchor}.json'), encoding='utf-8') as f:
+            for grouping in json.load(f)['productGroupings']:
+                cards.extend(product_to_card(product) for product in grouping['products'])
+    return cards
+
+
+def test_discovers_every_page_in_order(feed_url):
+    cards = list(discover_product_cards(LISTING_URL, feed_url=feed_url, count=24))
+
+    # The first page says there are 30 products, the second page holds the last 6
+    assert len(cards) == 30
+    assert cards == recorded_cards()
+
+
+def test_bad_anchor_is_a_bad_request(feed_url):
+    for anchor in ['abc', '-24']:
+        response = requests.get(feed_url, params={'anchor': anchor}, timeout=5)
+        assert response.status_code == 400
+
+
+def test_anchor_past_the_end_is_an_empty_page(feed_url):
+    response = requests.get(feed_url, params={'anchor': 48}, timeout=5)
+    assert response.status_code == 200
+    assert response.json() == {"productGroupings": []}
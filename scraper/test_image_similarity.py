@@ -0,0 +1,49 @@
+import os
+import numpy as np
+import pytest
+from image_similarity import DEFAULT_IMAGES_DIR, SYNTHETIC_IMAGES_DIR, SimilarityIndex, evaluate, load_fixture_samples, HASH_SIZE
+
+# Share of the fixture product images the local classifier has to classify without the vision API
+OFFLOAD_TARGET = 0.5
+
+# Share of the local classifications that have to be right
+ACCURACY_TARGET = 0.95
+
+
+@pytest.mark.skipif(not os.path.isdir(DEFAULT_IMAGES_DIR), reason="No product images, download them with python image_similarity.py --fetch")
+def test_offload_and_accuracy_on_product_images():
+    result = evaluate(load_fixture_samples(DEFAULT_IMAGES_DIR))
+
+    assert result['images'] > 0
+    assert result['offload_rate'] >= OFFLOAD_TARGET
+    assert result['accuracy'] >= ACCURACY_TARGET
+
+
+def test_runs_end_to_end_on_synthetic_images():
+    # The synthetic silhouettes only check that loading, featurizing and indexing work, not how well it classifies
+    samples = load_fixture_samples(SYNTHETIC_IMAGES_DIR)
+    assert len(samples) == 20
+
+    index = SimilarityIndex()
+    for vector, image_hash, label in samples:
+        index.add(vector, image_hash, label)
+
+    # Every image that was already classified is found again with its type
+    for vector, image_hash, label in samples:
+        assert index.predict(vector, image_hash) == (label, 1.0)
+
+
+def test_near_duplicate_hash_needs_similar_features():
+    index = SimilarityIndex(min_similarity=0.9)
+    image_hash = np.zeros(HASH_SIZE * HASH_SIZE, dtype=bool)
+    index.add(np.array([1.0, 0.0], dtype=np.float32), image_hash, 'low')
+
+    # The same hash with different features is not a match
+    assert index.predict(np.array([0.0, 1.0], dtype=np.float32), image_hash) == (None, 0.0)
+
+    # The same hash with the same features is, and a hash one bit off is a bit less confident
+    assert index.predict(np.array([1.0, 0.0], dtype=np.float32), image_hash) == ('low', 1.0)
+    off_by_one = image_hash.copy()
+    off_by_one[0] = True
+    label, confidence = index.predict(np.array([1.0, 0.0], dtype=np.float32), off_by_one)
+    assert label == 'low' and confidence < 1.0
@@ -0,0 +1,386 @@
+import asyncio
+import functools
+import json
+import time
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAI, DefaultHttpxClient
+from assistant import Assistant, api_key
+from session_store import SessionStore
+import metrics
+
+# HTTP status messages used by the server
+STATUS_MESSAGES = {
+    200: 'OK',
+    201: 'Created',
+    204: 'No Content',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    503: 'Service Unavailable'
+}
+
+
+class Session:
+    """
+    A conversation with one client, holding its own assistant and message history.
+    """
+    def __init__(self, assistant):
+        # The assistant holding the message history of the session
+        self.assistant = assistant
+
+        # When the session was last used, used to evict idle sessions
+        self.last_used = time.monotonic()
+
+        # Only one turn of a session can run at a time
+        self.lock = asyncio.Lock()
+
+
+class AssistantServer:
+    """
+    HTTP server hosting many concurrent assistant sessions in one process.
+
+    Every session has its own message history, while all of them share one pooled OpenAI client.
+    Responses are streamed back to the client with Server-Sent Events. Histories are saved in the
+    session store, so evicted sessions, sessions from before a restart or from another worker can be resumed.
+
+    Endpoints:
+    - POST /sessions: Creates a session and returns its id.
+    - POST /sessions/<id>/messages: Sends {"message": "..."} and streams the response back.
+    - DELETE /sessions/<id>: Ends a session.
+    - GET /health: Returns the number of open sessions.
+    - GET /metrics: Returns the latency and token histograms in Prometheus text format.
+    """
+    def __init__(self, max_inflight=16, idle_timeout=900, max_sessions=1000, client=None, session_store=None):
+        # How many completions can be in flight at the same time
+        self.max_inflight = max_inflight
+
+        # How many seconds a session can be idle before it is evicted
+        self.idle_timeout = idle_timeout
+
+        # How many sessions can be open at the same time
+        self.max_sessions = max_sessions
+
+        # One OpenAI client shared by every session, its connection pool is sized to the in-flight cap
+        self.client = client or OpenAI(
+            api_key=api_key,
+            max_retries=0, # Retries are left to the call policy
+            http_client=DefaultHttpxClient(limits=httpx.Limits(max_connections=max_inflight * 2, max_keepalive_connections=max_inflight * 2))
+        )
+
+        # The OpenAI client and the database are blocking, so turns run on a pool of threads
+        self.executor = ThreadPoolExecutor(max_workers=max_inflight)
+
+        # Session store queries run on their own threads so they never wait behind the turns
+        self.store_executor = ThreadPoolExecutor(max_workers=4)
+        self.inflight = None
+        self.sessions = {}
+
+        # Store that persists the histories of the sessions
+        self.session_store = session_store or SessionStore()
+
+    async def run_blocking(self, function, *args, **kwargs):
+        """
+        Runs a blocking call, like a session store query, on a worker thread so the event loop keeps serving the other streams.
+
+        Args:
+        - function (callable): The function to call.
+        - args, kwargs: The arguments of the function.
+
+        Returns:
+        - Any: What the function returned.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.store_executor, functools.partial(function, *args, **kwargs))
+
+    def has_room(self):
+        """
+        Checks if another session can be opened, evicting idle sessions first if the server is full.
+
+        Returns:
+        - bool: True if fewer than max_sessions sessions are open.
+        """
+        if len(self.sessions) >= self.max_sessions:
+            self.evict_idle_sessions()
+        return len(self.sessions) < self.max_sessions
+
+    async def create_session(self):
+        """
+        Creates a new session.
+
+        Returns:
+        - str or None: The id of the session, or None if the server is full.
+        """
+        if not self.has_room():
+            return None
+
+        # Creating the assistant saves the new session
+        assistant = await self.run_blocking(Assistant, client=self.client, session_store=self.session_store)
+        self.sessions[assistant.session_id] = Session(assistant)
+        return assistant.session_id
+
+    async def get_session(self, session_id):
+        """
+        Returns an open session, resuming it from the session store if it is not open in this process.
+        Resumed sessions count towards max_sessions like new ones.
+
+        Args:
+        - session_id (str): The id of the session.
+
+        Returns:
+        - Session or None: The session, or None if it does not exist or the server is full.
+        """
+        session = self.sessions.get(session_id)
+        if session is not None:
+            return session
+        if not self.has_room() or not await self.run_blocking(self.session_store.exists, session_id):
+            return None
+
+        # Loading the history reads the session store
+        assistant = await self.run_blocking(Assistant, client=self.client, session_store=self.session_store, session_id=session_id)
+
+        # Another request may have resumed the same session meanwhile, keep the first one
+        return self.sessions.setdefault(session_id, Session(assistant))
+
+    def evict_idle_sessions(self):
+        """
+        Removes the sessions that were idle for longer than the idle timeout.
+        Sessions that are in the middle of a turn are never removed.
+        """
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if not session.lock.locked() and now - session.last_used > self.idle_timeout:
+                del self.sessions[session_id]
+
+    async def evict_idle_sessions_forever(self, interval=60):
+        """
+        Evicts idle sessions every interval seconds.
+
+        Args:
+        - interval (float, optional): How many seconds to wait between evictions. Default is 60.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle_sessions()
+
+    async def stream_turn(self, session, message):
+        """
+        Runs one turn of a session, yielding the response in chunks as it is streamed.
+
+        Args:
+        - session (Session): The session to run the turn in.
+        - message (str): The user message.
+
+        Yields:
+        - Tuple: A tuple containing (event, data) where event is "chunk", "error" or "done".
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def run():
+            # Runs on a worker thread and hands the chunks back to the event loop
+            try:
+                for chunk in session.assistant.generate_response(message):
+                    loop.call_soon_threadsafe(queue.put_nowait, ('chunk', chunk))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, ('error', str(e)))
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, ('done', None))
+
+        async with session.lock, self.inflight:
+            loop.run_in_executor(self.executor, run)
+            while True:
+                event, data = await queue.get()
+                yield event, data
+                if event == 'done':
+                    break
+            session.last_used = time.monotonic()
+
+    async def send_json(self, writer, status, data=None):
+        """
+        Sends a JSON response and closes the connection.
+
+        Args:
+        - writer (asyncio.StreamWriter): The connection to the client.
+        - status (int): The HTTP status code.
+        - data (dict, optional): The body of the response.
+        """
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        head = (
+            f"HTTP/1.1 {status} {STATUS_MESSAGES[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode('utf-8') + body)
+        await writer.drain()
+
+    async def send_text(self, writer, status, text):
+        """
+        Sends a plain text response and closes the connection.
+
+        Args:
+        - writer (asyncio.StreamWriter): The connection to the client.
+        - status (int): The HTTP status code.
+        - text (str): The body of the response.
+        """
+        body = text.encode('utf-8')
+        head = (
+            f"HTTP/1.1 {status} {STATUS_MESSAGES[status]}\r\n"
+            f"Content-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode('utf-8') + body)
+        await writer.drain()
+
+    async def send_events(self, writer, session, message):
+        """
+        Streams the response of a turn to the client as Server-Sent Events.
+
+        Args:
+        - writer (asyncio.StreamWriter): The connection to the client.
+        - session (Session): The session to run the turn in.
+        - message (str): The user message.
+        """
+        head = (
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: text/event-stream\r\n"
+            "Cache-Control: no-cache\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode('utf-8'))
+
+        # Keep running the turn even if the client goes away so the history stays consistent
+        connected = True
+        async for event, data in self.stream_turn(session, message):
+            if not connected:
+                continue
+            if event == 'chunk':
+                payload = f"data: {json.dumps({'content': data})}\n\n"
+            elif event == 'error':
+                payload = f"event: error\ndata: {json.dumps({'error': data})}\n\n"
+            else:
+                payload = "event: done\ndata: {}\n\n"
+            try:
+                writer.write(payload.encode('utf-8'))
+                await writer.drain()
+            except ConnectionError:
+                connected = False
+
+    async def handle(self, reader, writer):
+        """
+        Handles one HTTP request.
+
+        Args:
+        - reader (asyncio.StreamReader): The request from the client.
+        - writer (asyncio.StreamWriter): The connection to the client.
+        """
+        try:
+            # Parse the request line and the headers
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, path, _ = request_line.decode('utf-8').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, value = line.decode('utf-8').split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            # Route the request
+            parts = path.split('?')[0].strip('/').split('/')
+            if parts == ['health'] and method == 'GET':
+                await self.send_json(writer, 200, {"sessions": len(self.sessions)})
+            elif parts == ['metrics'] and method == 'GET':
+                await self.send_text(writer, 200, metrics.render_prometheus())
+            elif parts == ['sessions'] and method == 'POST':
+                session_id = await self.create_session()
+                if session_id is None:
+                    await self.send_json(writer, 503, {"error": "Too many sessions"})
+                else:
+                    await self.send_json(writer, 201, {"session_id": session_id})
+            elif len(parts) == 2 and parts[0] == 'sessions' and method == 'DELETE':
+                # Deleting a session does not need to resume it
+                if parts[1] not in self.sessions and not await self.run_blocking(self.session_store.exists, parts[1]):
+                    await self.send_json(writer, 404, {"error": "Unknown session"})
+                else:
+                    self.sessions.pop(parts[1], None)
+                    await self.run_blocking(self.session_store.delete, parts[1])
+                    await self.send_json(writer, 204)
+            elif len(parts) >= 2 and parts[0] == 'sessions':
+                session = await self.get_session(parts[1])
+                if session is None and await self.run_blocking(self.session_store.exists, parts[1]):
+                    await self.send_json(writer, 503, {"error": "Too many sessions"})
+                elif session is None:
+                    await self.send_json(writer, 404, {"error": "Unknown session"})
+                elif parts[2:] == ['messages'] and method == 'POST':
+                    # The body must be a JSON object with the message as a string
+                    try:
+                        data = json.loads(body or b'{}')
+                    except ValueError:
+                        data = None
+                    message = data.get('message') if isinstance(data, dict) else None
+                    if not isinstance(data, dict):
+                        await self.send_json(writer, 400, {"error": "The body must be a JSON object"})
+                    elif not message or not isinstance(message, str):
+                        await self.send_json(writer, 400, {"error": "Missing message"})
+                    else:
+                        session.last_used = time.monotonic()
+                        await self.send_events(writer, session, message)
+                else:
+                    await self.send_json(writer, 405, {"error": "Method not allowed"})
+            else:
+                await self.send_json(writer, 404, {"error": "Not found"})
+        except (ValueError, asyncio.IncompleteReadError):
+            await self.send_json(writer, 400, {"error": "Bad request"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        """
+        Runs the server until it is cancelled.
+
+        Args:
+        - host (str, optional): The host to listen on. Default is 127.0.0.1.
+        - port (int, optional): The port to listen on. Default is 8000.
+        """
+        self.inflight = asyncio.Semaphore(self.max_inflight)
+        server = await asyncio.start_server(self.handle, host, port)
+        eviction = asyncio.create_task(self.evict_idle_sessions_forever())
+        print(f"Air Jordans AI Assistant serving on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            eviction.cancel()
+            self.executor.shutdown(wait=False)
+            self.store_executor.shutdown(wait=False)
+
+
+def run_server(host='127.0.0.1', port=8000, max_inflight=16, idle_timeout=900, sessions_path=None):
+    """
+    Runs the assistant server.
+
+    Args:
+    - host (str, optional): The host to listen on. Default is 127.0.0.1.
+    - port (int, optional): The port to listen on. Default is 8000.
+    - max_inflight (int, optional): How many completions can be in flight at the same time. Default is 16.
+    - idle_timeout (float, optional): How many seconds a session can be idle before it is evicted. Default is 900.
+    - sessions_path (str, optional): Path of the session database. Default is sessions.db next to the scripts.
+    """
+    session_store = SessionStore(sessions_path) if sessions_path else SessionStore()
+    server = AssistantServer(max_inflight=max_inflight, idle_timeout=idle_timeout, session_store=session_store)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        pass
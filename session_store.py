@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+# Default path of the session database, next to this script
+DEFAULT_SESSIONS_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'sessions.db')
+
+
+def encode_message(message):
+    """
+    Serializes a message into its compact normalized form.
+
+    Keys without a value are dropped and tool results (which are JSON) are re-encoded without indentation.
+
+    Args:
+    - message (dict): The message to serialize.
+
+    Returns:
+    - str: The compact JSON of the message.
+    """
+    message = {key: value for key, value in message.items() if value is not None}
+    if message.get('role') == 'tool' and isinstance(message.get('content'), str):
+        try:
+            message['content'] = json.dumps(json.loads(message['content']), separators=(',', ':'))
+        except ValueError:
+            pass
+    return json.dumps(message, separators=(',', ':'))
+
+
+class SessionStore:
+    """
+    Persistent store of conversation histories backed by SQLite.
+
+    Every message is stored as its own row, so a turn only appends the messages it added instead of
+    rewriting the whole history, and resuming a session only loads the most recent turns it needs.
+    The database can be shared by many workers so a session can continue on any of them.
+    """
+    def __init__(self, path=DEFAULT_SESSIONS_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+
+        # Write-ahead logging lets readers on other workers keep going while a turn is appended
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            created_at REAL,
+            updated_at REAL
+        )
+        ''')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            session_id TEXT,
+            seq INTEGER,
+            role TEXT,
+            message TEXT,
+            PRIMARY KEY (session_id, seq)
+        )
+        ''')
+        self.conn.commit()
+
+    def create(self, session_id=None):
+        """
+        Creates a new empty session.
+
+        Args:
+        - session_id (str, optional): The id of the session. Default is a random id.
+
+        Returns:
+        - str: The id of the session.
+        """
+        session_id = session_id or uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.conn.execute('INSERT OR IGNORE INTO sessions (id, created_at, updated_at) VALUES (?, ?, ?)', (session_id, now, now))
+            self.conn.commit()
+        return session_id
+
+    def exists(self, session_id):
+        """
+        Checks if a session exists.
+
+        Args:
+        - session_id (str): The id of the session.
+
+        Returns:
+        - bool: True if the session exists.
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM sessions WHERE id = ?', (session_id,)).fetchone()
+        return row is not None
+
+    def append(self, session_id, messages, start_seq):
+        """
+        Appends new messages to a session.
+
+        Messages are only ever inserted, so a worker whose history is out of date can never overwrite the
+        messages another worker appended. The existence check and the inserts run in one transaction, so a
+        session that is deleted meanwhile never gets orphan messages.
+
+        Args:
+        - session_id (str): The id of the session.
+        - messages (list of dict): The new messages.
+        - start_seq (int): The position of the first new message in the session's history.
+
+        Raises:
+        - LookupError: If the session does not exist anymore.
+        - sqlite3.IntegrityError: If another worker already stored messages at these positions.
+        """
+        rows = [(session_id, start_seq + i, message.get('role'), encode_message(message)) for i, message in enumerate(messages)]
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                if self.conn.execute('SELECT 1 FROM sessions WHERE id = ?', (session_id,)).fetchone() is None:
+                    raise LookupError(f"Session {session_id} does not exist")
+                self.conn.executemany('INSERT INTO messages (session_id, seq, role, message) VALUES (?, ?, ?, ?)', rows)
+                self.conn.execute('UPDATE sessions SET updated_at = ? WHERE id = ?', (time.time(), session_id))
+            except Exception:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+
+    def load(self, session_id, max_turns=None):
+        """
+        Loads the history of a session.
+
+        Only the system prompt and the last max_turns turns are loaded. A turn starts at a user message,
+        so the tool calls and tool results of a turn are never split.
+
+        Args:
+        - session_id (str): The id of the session.
+        - max_turns (int, optional): How many of the most recent turns to load. Default loads all of them.
+
+        Returns:
+        - Tuple: A tuple containing (list of messages, position the next message will be stored at).
+        """
+        with self.lock:
+            # Find where the window of turns starts
+            start = 0
+            if max_turns is not None:
+                row = self.conn.execute(
+                    "SELECT seq FROM messages WHERE session_id = ? AND role = 'user' ORDER BY seq DESC LIMIT 1 OFFSET ?",
+                    (session_id, max_turns - 1)
+                ).fetchone()
+                start = row[0] if row else 0
+
+            # The system prompt is always loaded
+            rows = self.conn.execute(
+                "SELECT seq, message FROM messages WHERE session_id = ? AND (seq >= ? OR role = 'system') ORDER BY seq",
+                (session_id, start)
+            ).fetchall()
+            last = self.conn.execute('SELECT MAX(seq) FROM messages WHERE session_id = ?', (session_id,)).fetchone()[0]
+
+        messages = [json.loads(message) for _, message in rows]
+        next_seq = last + 1 if last is not None else 0
+        return messages, next_seq
+
+    def delete(self, session_id):
+        """
+        Deletes a session and its history.
+
+        Args:
+        - session_id (str): The id of the session.
+        """
+        with self.lock:
+            # Delete both in one transaction so a turn appended meanwhile either lands before it or finds no session
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+                self.conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+            except Exception:
+                self.conn.rollback()
+                raise
+            self.conn.commit()